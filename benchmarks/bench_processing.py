@@ -0,0 +1,58 @@
+import random
+import sys
+import timeit
+from pathlib import Path
+
+import click
+
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import processing  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def synthetic_titles(n_titles: int, seed: int = 0) -> list:
+    rnd = random.Random(seed)
+    return [
+        ' '.join(rnd.choice(synthetic.WORDS) for _ in range(rnd.randint(4, 12))).title()
+        for _ in range(n_titles)
+    ]
+
+
+def uncached_clean_title(s: str, min_title_word_length: int = 3) -> str:
+    # the implementation before the stemming cache, kept as the baseline
+    s = processing.clean_field(s).lower()
+    s = processing.pattern_alpha.sub(' ', s)
+    s = [processing.get_stemmer().stem(w) for w in s.split()]
+    s = [
+        w
+        for w in s
+        if w not in processing.stop_words and len(w) > min_title_word_length
+    ]
+    return ' '.join(s)
+
+
+@click.command()
+@click.option('--n-titles', '-n', type=int, default=10000)
+@click.option('--repeat', '-r', type=int, default=3)
+def main(n_titles: int, repeat: int) -> None:
+    titles = synthetic_titles(n_titles)
+    # nltk is imported by the first stem, which is not what is measured here
+    processing.warm_up()
+    candidates = {
+        'uncached clean_title': lambda: [uncached_clean_title(t) for t in titles],
+        'cached clean_title': lambda: [processing.clean_title(t) for t in titles],
+        'batch clean_titles': lambda: processing.clean_titles(titles),
+    }
+    baseline = None
+    for name, function in candidates.items():
+        duration = min(timeit.repeat(function, number=1, repeat=repeat))
+        baseline = duration if baseline is None else baseline
+        click.echo(
+            f'{name:<24} {duration:8.4f}s  {n_titles / duration:12.0f} titles/s'
+            + f'  x{baseline / duration:.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import json
+import sys
+from typing import Dict, Tuple
+
+import click
+
+
+@click.command()
+@click.argument('baseline_path', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--max-regression', '-mr', type=float, default=0.1)
+def main(baseline_path: str, current_path: str, max_regression: float) -> None:
+    baseline_meta, baseline = _read(baseline_path)
+    current_meta, current = _read(current_path)
+    scale_keys = ('n_papers_per_year', 'n_years', 'n_requests')
+    if any([baseline_meta.get(k) != current_meta.get(k) for k in scale_keys]):
+        click.echo('The runs used different scales, throughputs may not compare')
+    n_regressions = 0
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            click.echo(
+                f'{name:<40} only in {"current" if name in current else "baseline"}'
+            )
+            continue
+
+        before = baseline[name]['items_per_second']
+        after = current[name]['items_per_second']
+        change = after / before - 1.0
+        is_regression = change < -max_regression
+        n_regressions += is_regression
+        click.echo(
+            f'{name:<40} {before:12.0f} -> {after:12.0f} items/s {change:+7.1%}'
+            + (' REGRESSION' if is_regression else '')
+        )
+
+    if n_regressions > 0:
+        click.echo(f'{n_regressions} benchmarks lost more than {max_regression:.0%}')
+        sys.exit(1)
+
+
+def _read(path: str) -> Tuple[Dict, Dict[str, Dict]]:
+    with open(path, 'r') as input_file:
+        baseline = json.load(input_file)
+    return baseline['meta'], baseline['results']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+import contextlib
+import csv
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import click
+import numpy as np
+
+
+# the stand-ins of the backends are shared with the tests
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import compression  # noqa: E402
+import config  # noqa: E402
+import convert  # noqa: E402
+import graph  # noqa: E402
+import processing  # noqa: E402
+import records as records_module  # noqa: E402
+import search  # noqa: E402
+import synthetic  # noqa: E402
+import watch  # noqa: E402
+from tests import standins  # noqa: E402
+
+
+FIRST_YEAR = 2015
+
+
+@click.command()
+@click.option('--n-papers-per-year', '-n', type=int, default=5000)
+@click.option('--n-years', '-ny', type=int, default=3)
+@click.option('--n-requests', '-nr', type=int, default=200)
+@click.option('--repeat', '-r', type=int, default=3)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None)
+def main(
+    n_papers_per_year: int,
+    n_years: int,
+    n_requests: int,
+    repeat: int,
+    output: Optional[str],
+) -> None:
+    results = dict()
+    with tempfile.TemporaryDirectory() as temporary_path, _working_directory(
+        Path(temporary_path)
+    ):
+        years = list(range(FIRST_YEAR, FIRST_YEAR + n_years))
+        input_path = Path('data') / config.InputConfig.INPUT_FOLDER_NAME
+        input_file_paths = synthetic.write_input(input_path, years, n_papers_per_year)
+        # the modules log every file at debug level, which would skew the timings
+        logging.getLogger().setLevel(logging.WARNING)
+
+        records = _read_records(input_file_paths)
+        results.update(_bench_reading(input_file_paths, len(records), repeat))
+        results.update(_bench_processing(records, repeat))
+        results.update(_bench_converters(records, repeat))
+        results.update(_bench_convert_main(len(records), repeat))
+        results.update(_bench_api(n_requests, repeat))
+
+    baseline = dict(meta=_meta(n_papers_per_year, n_years, n_requests), results=results)
+    for name, result in results.items():
+        click.echo(
+            f'{name:<40} {result["seconds"]:9.4f}s'
+            + f' {result["items_per_second"]:12.0f} items/s'
+        )
+    if output is not None:
+        with open(output, 'w') as output_file:
+            json.dump(baseline, output_file, indent=2, sort_keys=True)
+
+
+def measure(
+    function: Callable[[], None],
+    n_items: int,
+    repeat: int,
+    setup: Optional[Callable[[], None]] = None,
+) -> Dict:
+    # the best of several runs is the least disturbed by the rest of the machine
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    seconds = max(min(durations), 1e-9)
+    return dict(seconds=seconds, n_items=n_items, items_per_second=n_items / seconds)
+
+
+def _bench_reading(
+    input_file_paths: List[Path], n_records: int, repeat: int
+) -> Dict[str, Dict]:
+    # items are all lines of the input, also the ones the filter skips
+    return {
+        'records.read_records': measure(
+            lambda: _read_records(input_file_paths), n_records, repeat
+        ),
+        'records.read_records (filtered)': measure(
+            lambda: _read_records(
+                input_file_paths, config.InputConfig.CATEGORY_PREFIXES
+            ),
+            n_records,
+            repeat,
+        ),
+    }
+
+
+def _bench_processing(records: List[List[str]], repeat: int) -> Dict[str, Dict]:
+    titles = [r[config.InputConfig.TITLE_INDEX] for r in records]
+    authors = [r[config.InputConfig.AUTHORS_INDEX] for r in records]
+    ids = [r[config.InputConfig.ID_INDEX] for r in records]
+    # nltk is imported by the first stem, which would land in the first timing
+    processing.warm_up()
+
+    def clear_caches() -> None:
+        processing.stem.cache_clear()
+        processing._title_stem.cache_clear()
+
+    cases = {
+        'processing.clean_id': lambda: [processing.clean_id(i) for i in ids],
+        'processing.clean_title': lambda: [processing.clean_title(t) for t in titles],
+        'processing.clean_titles': lambda: processing.clean_titles(titles),
+        'processing.clean_query': lambda: [processing.clean_query(t) for t in titles],
+        'processing.clean_queries': lambda: processing.clean_queries(titles),
+        'processing.clean_authors': lambda: [
+            processing.clean_authors(a) for a in authors
+        ],
+    }
+    return {
+        name: measure(function, len(records), repeat, clear_caches)
+        for name, function in cases.items()
+    }
+
+
+def _bench_converters(records: List[List[str]], repeat: int) -> Dict[str, Dict]:
+    results = dict()
+    codecs = dict.fromkeys(['none', compression.resolve_codec('auto')])
+    for converter_class, codec in itertools.product(
+        (convert.BlastConverter, convert.RedisConverter, convert.PostgresConverter),
+        codecs,
+    ):
+
+        def convert_records() -> None:
+            converter = converter_class(Path('bench_converters'), True, 10000, codec)
+            converter.input_file_opened(
+                str(FIRST_YEAR), 'bench', config.InputConfig.CATEGORY_PREFIXES
+            )
+            for index in range(0, len(records), config.InputConfig.BATCH_SIZE):
+                batch = records[index:][: config.InputConfig.BATCH_SIZE]
+                converter.handle_lines(batch)
+            converter.input_file_closed()
+            converter.post_conversion()
+
+        name = f'convert.{converter_class.__name__}'
+        if codec != 'none':
+            name += f' ({codec})'
+        results[name] = measure(convert_records, len(records), repeat)
+    return results
+
+
+def _bench_convert_main(n_records: int, repeat: int) -> Dict[str, Dict]:
+    def run(clean_output: bool) -> None:
+        convert.main.callback(
+            max_elements_per_file=10000, max_n_files=None, clean_output=clean_output,
+        )
+
+    return {
+        'convert.main': measure(lambda: run(True), n_records, repeat),
+        # nothing changed since the last run, so every year is skipped
+        'convert.main unchanged input': measure(lambda: run(False), n_records, repeat),
+    }
+
+
+def _bench_api(n_requests: int, repeat: int) -> Dict[str, Dict]:
+    hashes, fields = _prepare_api_data()
+    citation_graph = graph.CitationGraph(config.GraphConfig.FOLDER_PATH)
+    search_index = search.SearchIndex(config.SearchConfig.FOLDER_PATH)
+    # the api connects when it warms up, so the stand-ins have to be in place
+    redis_connection = standins.StandInRedis(hashes)
+    postgres_pool = standins.StandInPostgresPool(citation_graph)
+    config.RedisServiceConfig.create_connection = lambda: redis_connection
+    import api
+
+    api.warm_up()
+    client = api.app.test_client()
+    rnd = random.Random(0)
+    paper_ids = rnd.sample(list(hashes), min(n_requests, len(hashes)))
+    queries = [_typeahead_query(rnd, hashes[i]['title']) for i in paper_ids]
+
+    def get_all(paths: List[str]) -> Callable[[], None]:
+        def function() -> None:
+            for path in paths:
+                response = client.get(path)
+                assert response.status_code == 200, path
+
+        return function
+
+    def clear_caches() -> None:
+        api.paper_cache.clear()
+        api.autocomplete_cache.clear()
+
+    paths = dict(
+        paper=[f'/api/v1/paper/{i}' for i in paper_ids],
+        autocomplete=[f'/api/v1/autocomplete/{q}' for q in queries],
+        referenced_by=[f'/api/v1/referenced_by/{i}?limit=100' for i in paper_ids],
+        references=[f'/api/v1/references/{i}?limit=100' for i in paper_ids],
+        neighborhood=[f'/api/v1/neighborhood/{i}?depth=2' for i in paper_ids],
+    )
+    backends = dict(
+        redis=dict(),
+        graph=dict(citation_graph=citation_graph),
+        # the pool is only opened without a graph, so it is handed over here
+        postgres=dict(citation_graph=None, postgres_pool=postgres_pool),
+        embedded=dict(search_index=search_index),
+        blast=dict(
+            search_index=None,
+            blast_session=standins.StandInBlastSession(search_index, fields),
+        ),
+    )
+    cases = [
+        ('paper', 'redis'),
+        ('autocomplete', 'embedded'),
+        ('autocomplete', 'blast'),
+        ('referenced_by', 'graph'),
+        ('referenced_by', 'postgres'),
+        ('references', 'graph'),
+        ('references', 'postgres'),
+        ('neighborhood', 'graph'),
+        ('neighborhood', 'postgres'),
+    ]
+    results = dict()
+    for endpoint, backend in cases:
+        [setattr(api, name, value) for name, value in backends[backend].items()]
+        results[f'api.{endpoint} ({backend}, cold)'] = measure(
+            get_all(paths[endpoint]), len(paths[endpoint]), repeat, clear_caches
+        )
+    api.search_index = search_index
+    results['api.autocomplete (embedded, warm)'] = measure(
+        get_all(paths['autocomplete']), len(paths['autocomplete']), repeat
+    )
+    return results
+
+
+def _prepare_api_data() -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    # loads the converted files the way the watchers would, but into memory
+    output_path = Path('data') / 'output_for'
+    hashes = dict()
+    redis_path = output_path / config.RedisServiceConfig.FOLDER_NAME
+    for file_path in redis_path.glob(config.RedisServiceConfig.FILE_GLOB):
+        with compression.open_file(file_path, 'r', newline='') as input_file:
+            for paper_id, year, authors, title in csv.reader(input_file):
+                hashes[paper_id] = dict(year=year, authors=authors, title=title)
+
+    blast_path = output_path / config.BlastServiceConfig.FOLDER_NAME
+    blast_file_paths = sorted(blast_path.glob(config.BlastServiceConfig.FILE_GLOB))
+    fields = dict(watch._read_blast_documents(blast_file_paths))
+
+    postgres_config = config.PostgresServiceConfig
+    postgres_path = output_path / postgres_config.FOLDER_NAME
+    ref_file_paths = [
+        p
+        for p in postgres_path.glob(postgres_config.FILE_GLOB)
+        if compression.base_name(p) != postgres_config.PAPERS_FILE_NAME
+    ]
+    papers_file_path = compression.find(
+        postgres_path / postgres_config.PAPERS_FILE_NAME
+    )
+    with compression.open_file(papers_file_path, 'r') as papers_file:
+        ids = np.array([line.rstrip('\n') for line in papers_file], dtype='S')
+    edges = []
+    for ref_file_path in ref_file_paths:
+        with compression.open_file(ref_file_path, 'r') as ref_file:
+            edges.extend(line.rstrip('\n').split('\t') for line in ref_file)
+    referencers = np.searchsorted(ids, np.array([e[0] for e in edges], dtype='S'))
+    referencees = np.searchsorted(ids, np.array([e[1] for e in edges], dtype='S'))
+    graph.build(config.GraphConfig.FOLDER_PATH, ids, referencers, referencees)
+
+    search.build(
+        config.SearchConfig.FOLDER_PATH,
+        fields.items(),
+        watch._count_referencees(ref_file_paths),
+    )
+    return hashes, fields
+
+
+def _typeahead_query(rnd: random.Random, title: str) -> str:
+    # a query typed up to the middle of a word, the way autocomplete sees it
+    words = title.split()
+    n_words = rnd.randint(1, min(len(words), 3))
+    last_word = words[n_words - 1]
+    partial = last_word[: rnd.randint(1, len(last_word))]
+    return ' '.join(words[: n_words - 1] + [partial])
+
+
+def _read_records(
+    input_file_paths: List[Path], category_prefixes: Tuple[str, ...] = ('',)
+) -> List[List[str]]:
+    # every category by default, so the benchmarks do not depend on the synthetic mix
+    records = []
+    for input_file_path in input_file_paths:
+        with open(str(input_file_path), 'rb') as input_file:
+            records.extend(
+                records_module.read_records(
+                    input_file,
+                    category_prefixes,
+                    config.InputConfig.N_MAX_SPLITS,
+                    config.InputConfig.READ_CHUNK_SIZE,
+                )
+            )
+    return records
+
+
+def _meta(n_papers_per_year: int, n_years: int, n_requests: int) -> Dict:
+    try:
+        commit = (
+            subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=str(Path(__file__).resolve().parent),
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+            .stdout.decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        commit=commit,
+        created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        n_papers_per_year=n_papers_per_year,
+        n_years=n_years,
+        n_requests=n_requests,
+    )
+
+
+@contextlib.contextmanager
+def _working_directory(path: Path) -> Iterator[None]:
+    # the modules resolve data/ relative to the working directory
+    previous_path = os.getcwd()
+    os.chdir(str(path))
+    try:
+        yield
+    finally:
+        os.chdir(previous_path)
+
+
+if __name__ == '__main__':
+    main()
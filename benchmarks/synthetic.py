@@ -0,0 +1,71 @@
+import random
+from pathlib import Path
+from typing import List
+
+import click
+
+
+WORDS = (
+    'a the of for on with deep neural network networks learning learned graph'
+    + ' graphs quantum algorithm algorithms analysis optimization optimal robust'
+    + ' stochastic gradient descent convex bounds approximation efficient fast'
+    + ' language models representation representations adversarial training'
+).split()
+LAST_NAMES = (
+    'Smith Jones Müller Garcia Chen Wang Kumar Rossi Novak Silva Kim Dubois'
+).split()
+CATEGORIES = ['cs.LG', 'cs.AI,stat.ML', 'cs.CV', 'hep-th', 'math.CO', 'quant-ph']
+
+
+def write_input(
+    input_path: Path,
+    years: List[int],
+    n_papers_per_year: int,
+    n_max_refs: int = 20,
+    seed: int = 0,
+) -> List[Path]:
+    # files follow the paperscape layout: id;categories;;;refs;authors;title;...
+    rnd = random.Random(seed)
+    input_path.mkdir(exist_ok=True, parents=True)
+    paper_ids = []
+    file_paths = []
+    for year in sorted(years):
+        file_path = input_path / f'pscp-{year}.csv'
+        with open(str(file_path), 'w') as input_file:
+            input_file.write('# synthetic paperscape data\n')
+            for index in range(n_papers_per_year):
+                paper_id = f'{year % 100:02d}{index // 99999 + 1:02d}.{index:05d}'
+                n_refs = min(len(paper_ids), rnd.randint(0, n_max_refs))
+                refs = ','.join(rnd.sample(paper_ids, n_refs))
+                authors = ','.join(
+                    f'{rnd.choice("ABCDEFGH")}.{rnd.choice(LAST_NAMES)}'
+                    for _ in range(rnd.randint(1, 5))
+                )
+                title = ' '.join(
+                    rnd.choice(WORDS) for _ in range(rnd.randint(4, 12))
+                ).capitalize()
+                input_file.write(
+                    f'{paper_id};{rnd.choice(CATEGORIES)};0;0;{refs};{authors};'
+                    + f'{title};0\n'
+                )
+                paper_ids.append(paper_id)
+        file_paths.append(file_path)
+    return file_paths
+
+
+@click.command()
+@click.argument('input_path', type=click.Path(file_okay=False))
+@click.option('--n-papers-per-year', '-n', type=int, default=10000)
+@click.option('--first-year', '-fy', type=int, default=2015)
+@click.option('--n-years', '-ny', type=int, default=5)
+@click.option('--seed', '-s', type=int, default=0)
+def main(
+    input_path: str, n_papers_per_year: int, first_year: int, n_years: int, seed: int
+) -> None:
+    years = list(range(first_year, first_year + n_years))
+    file_paths = write_input(Path(input_path), years, n_papers_per_year, seed=seed)
+    click.echo(f'Wrote {len(file_paths)} files to {input_path}')
+
+
+if __name__ == '__main__':
+    main()
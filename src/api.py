@@ -1,17 +1,76 @@
-import copy
+import contextlib
+import itertools
 import json
-from typing import Dict, Optional
+import socket
+import threading
+import time
+from typing import (
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import redis
 import requests
-from flask import Flask, abort, jsonify
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+    url_for,
+)
 
+import api_common
+import cache
 import config
+import graph
+import metrics
 import processing
+import search
 
 
 app = Flask(__name__)
-redis_connection = config.RedisServiceConfig.create_connection()
-postgres_connection = config.PostgresServiceConfig.create_connection()
+# the backends are opened by warm_up, so importing this module never blocks on them
+redis_connection: Optional[redis.Redis] = None
+postgres_pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+# ThreadedConnectionPool raises when exhausted, so callers wait for a free slot here
+postgres_pool_slots = threading.BoundedSemaphore(
+    config.PostgresServiceConfig.POOL_MAX_SIZE
+)
+blast_session: Optional[requests.Session] = None
+citation_graph: Optional[graph.CitationGraph] = None
+search_index: Optional[search.SearchIndex] = None
+is_warmed_up = False
+_warm_up_lock = threading.Lock()
+paper_cache = cache.LRUCache(
+    config.RedisServiceConfig.PAPER_CACHE_MAX_SIZE,
+    config.RedisServiceConfig.PAPER_CACHE_TTL,
+)
+autocomplete_cache = cache.LRUCache(
+    config.BlastServiceConfig.AUTOCOMPLETE_CACHE_MAX_SIZE,
+    config.BlastServiceConfig.AUTOCOMPLETE_CACHE_TTL,
+)
+# a backend that is down when warming up, or index files that are missing
+WARM_UP_ERRORS = (redis.RedisError, psycopg2.Error, OSError)
+# answered from the process alone, so they keep working while the backends are down
+UNWARMED_ENDPOINTS = frozenset(
+    ['hello_world', 'healthz', 'readyz', 'prometheus_metrics', 'cache_stats']
+)
+_autocomplete_stats = dict(prefix_reuses=0)
+_dataset_version_check = api_common.DatasetVersionCheck(
+    [paper_cache, autocomplete_cache]
+)
 
 
 @app.route('/')
@@ -19,65 +78,436 @@ def hello_world():
     return 'Hello World!'
 
 
+@app.route('/healthz')
+def healthz():
+    # liveness only, the backends are left alone
+    return jsonify(dict(status='ok', is_warmed_up=is_warmed_up))
+
+
+@app.route('/readyz')
+def readyz():
+    try:
+        warm_up()
+    except WARM_UP_ERRORS as error:
+        return jsonify(dict(is_ready=False, error=str(error))), 503
+
+    backends = _backend_status()
+    is_ready = all([status == 'ok' for status in backends.values()])
+    return jsonify(dict(is_ready=is_ready, backends=backends)), 200 if is_ready else 503
+
+
 @app.route('/api/v1/paper/<string:paper_id>')
 def paper(paper_id: str):
-    p = _get_paper(paper_id)
-    if p is None:
-        p = dict()
+    papers = _get_papers([paper_id])
+    p = papers[0] if len(papers) > 0 else dict()
 
-    return jsonify(p)
+    return _jsonify(p)
+
+
+@app.route('/api/v1/papers', methods=['POST'])
+def papers():
+    paper_ids, fields = api_common.bulk_params(request.get_json(silent=True))
+    result = api_common.select_fields(_lookup_papers(paper_ids), fields)
+    return _jsonify(result)
 
 
 @app.route('/api/v1/autocomplete/<string:query>')
 def autocomplete(query: str):
-    query = processing.clean_query(query)
-    payload = copy.deepcopy(config.BlastServiceConfig.SEARCH_REQUEST_DICT)
-    payload['search_request']['query']['query'] = query
-    payload = json.dumps(payload)
+    query, prefix = processing.clean_typeahead_query(query)
+    terms = query.split()
+    if len(terms) == 0 and prefix == '':
+        return _jsonify([])
+    _check_dataset_version()
 
-    blast_response = requests.post(config.BlastServiceConfig.SEARCH_URL, data=payload)
-    if blast_response.status_code != 200:
-        abort(blast_response.status_code)
+    cache_key = config.BlastServiceConfig.SEARCH_QUERY(terms, prefix)
+    hits = autocomplete_cache.get(cache_key)
+    if hits is cache.MISSING:
+        hits = api_common.search_from_shorter_query(autocomplete_cache, terms, prefix)
+        if hits is not cache.MISSING:
+            _autocomplete_stats['prefix_reuses'] += 1
+        else:
+            hits = _search(terms, prefix)
+        if hits is None:
+            return _jsonify([])
+        autocomplete_cache.set(cache_key, hits)
 
-    blast_response = json.loads(blast_response.content.decode())
-    if blast_response['success']:
-        hits = blast_response['search_result']['hits']
-        result = [_get_paper(h['id']) for h in hits]
-        result = [r for r in result if r is not None]
-    else:
-        result = []
-
-    return jsonify(result)
+    papers = _get_papers(hits.ids)
+    if search_index is None:
+        # blast scores the text alone, the embedded index already boosted the
+        # referenced papers, so the hydrated hits are ranked like it ranks them
+        papers = api_common.rank_blast_hits(papers, hits, prefix)
+    result = api_common.order_papers(papers, request.args.get('order'))
+    return _jsonify(result)
 
 
 @app.route('/api/v1/referenced_by/<string:paper_id>')
+def referenced_by(paper_id: str):
+    return _adjacent_papers('referenced_by', 'in', paper_id)
+
+
+@app.route('/api/v1/references/<string:paper_id>')
 def references(paper_id: str):
-    cursor = postgres_connection.cursor()
+    return _adjacent_papers('references', 'out', paper_id)
+
+
+@app.route('/api/v1/neighborhood/<string:paper_id>')
+def neighborhood(paper_id: str):
+    depth, max_fan_out, directions = api_common.neighborhood_params(request.args)
+    neighborhood = api_common.Neighborhood(paper_id)
+    with _graph_cursor() as cursor:
+        for _ in range(depth):
+            if len(neighborhood.frontier) == 0:
+                break
+            hop_edges = []
+            for d in directions:
+                hop_edges.extend(
+                    _neighborhood_edges(cursor, d, neighborhood.frontier, max_fan_out)
+                )
+            neighborhood.add_hop(hop_edges)
+
+    nodes = _get_papers(neighborhood.node_ids)
+    return _jsonify(neighborhood.to_dict(nodes))
+
+
+def _neighborhood_edges(
+    cursor: Optional[psycopg2.extensions.cursor],
+    direction: str,
+    frontier: List[str],
+    max_fan_out: int,
+) -> List[Tuple[str, str]]:
+    with _timed(_graph_backend()):
+        if citation_graph is None:
+            cursor.execute(
+                api_common.neighborhood_sql(direction),
+                dict(paper_ids=frontier, max_fan_out=max_fan_out),
+            )
+            return cursor.fetchall()
+        elif direction == 'in':
+            return [
+                (n, paper_id)
+                for paper_id in frontier
+                for n in citation_graph.referenced_by(paper_id, limit=max_fan_out)
+            ]
+        else:
+            return [
+                (paper_id, n)
+                for paper_id in frontier
+                for n in citation_graph.references(paper_id, limit=max_fan_out)
+            ]
+
 
-    cursor.execute(
-        config.PostgresServiceConfig.REFERENCED_BY_SQL, dict(paper_id=paper_id)
+def _adjacent_papers(endpoint: str, direction: str, paper_id: str) -> Response:
+    after, limit = api_common.page_params(request.args)
+    order = request.args.get('order')
+    if request.args.get('format') == 'ndjson':
+        if order is not None:
+            raise api_common.RequestError(400, 'A stream cannot be ordered')
+        # the first page is read before answering, so a busy pool is still a 503
+        pages = _stream_pages(direction, paper_id, after, limit)
+        first_page = next(pages)
+        return Response(
+            stream_with_context(itertools.chain([first_page], pages)),
+            mimetype='application/x-ndjson',
+        )
+
+    with _graph_cursor() as cursor:
+        adjacent_ids = _adjacent_ids(cursor, direction, paper_id, after, limit)
+
+    # a page still holds the ids after the cursor, only its order changes
+    result = api_common.order_papers(_get_papers(adjacent_ids), order)
+    response = _jsonify(result)
+    if limit is not None and len(adjacent_ids) == limit:
+        next_url = url_for(
+            endpoint, paper_id=paper_id, after=adjacent_ids[-1], limit=limit
+        )
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def _adjacent_ids(
+    cursor: Optional[psycopg2.extensions.cursor],
+    direction: str,
+    paper_id: str,
+    after: str,
+    limit: Optional[int],
+) -> List[str]:
+    with _timed(_graph_backend()):
+        if citation_graph is None:
+            cursor.execute(
+                api_common.adjacent_ids_sql(direction),
+                dict(paper_id=paper_id, after=after, limit=limit),
+            )
+            return [r[0] for r in cursor.fetchall()]
+        elif direction == 'in':
+            return citation_graph.referenced_by(paper_id, after, limit)
+        else:
+            return citation_graph.references(paper_id, after, limit)
+
+
+def _stream_pages(
+    direction: str, paper_id: str, after: str, limit: Optional[int]
+) -> Iterator[str]:
+    # every page is a query of its own after the last id of the previous one, so
+    # no connection is held while a slow client reads
+    batch_size = config.PostgresServiceConfig.STREAM_BATCH_SIZE
+    n_streamed = 0
+    while True:
+        if limit is not None:
+            batch_size = min(batch_size, limit - n_streamed)
+        with _graph_cursor() as cursor:
+            adjacent_ids = _adjacent_ids(cursor, direction, paper_id, after, batch_size)
+        yield api_common.to_ndjson(_get_papers(adjacent_ids))
+        n_streamed += len(adjacent_ids)
+        if len(adjacent_ids) < batch_size or n_streamed == limit:
+            break
+        after = adjacent_ids[-1]
+
+
+@app.route('/api/v1/stats/caches')
+def cache_stats():
+    autocomplete_stats = dict(autocomplete_cache.stats(), **_autocomplete_stats)
+    return jsonify(dict(papers=paper_cache.stats(), autocomplete=autocomplete_stats))
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.latest(), mimetype=metrics.CONTENT_TYPE)
+
+
+@app.before_request
+def _start_timing() -> None:
+    g.start_time = time.perf_counter()
+    g.timings = dict()
+
+
+@app.after_request
+def _finish_timing(response: Response) -> Response:
+    endpoint = request.endpoint or 'unknown'
+    start_time = g.start_time
+    timings = g.timings
+    duration = time.perf_counter() - start_time
+    response.headers['Server-Timing'] = metrics.server_timing(duration, timings)
+    # a streamed body is only produced after this, so it is observed once closed
+    response.call_on_close(
+        lambda: metrics.observe(
+            endpoint, response.status_code, time.perf_counter() - start_time, timings,
+        )
     )
-    postgres_result = cursor.fetchall()
-    if len(postgres_result) > 0:
-        result = [_get_paper(r[0]) for r in postgres_result]
-        result = [r for r in result if r is not None]
-    else:
-        result = []
+    g.is_observed = True
+    return response
+
+
+@app.teardown_request
+def _observe_failed_request(error: Optional[BaseException]) -> None:
+    # an exception that propagates, e.g. in debug mode, skips after_request, so
+    # the request is counted as a 500 here
+    if error is None or g.get('is_observed', False) or 'start_time' not in g:
+        return
+    duration = time.perf_counter() - g.start_time
+    metrics.observe(request.endpoint or 'unknown', 500, duration, g.timings)
+
+
+@app.errorhandler(api_common.RequestError)
+def _request_error(error: api_common.RequestError) -> Tuple[Response, int]:
+    return jsonify(dict(error=str(error))), error.status
 
-    postgres_connection.commit()
-    cursor.close()
-    return jsonify(result)
 
+@app.errorhandler(TimeoutError)
+def _backend_timeout(error: TimeoutError) -> Tuple[Response, int]:
+    return jsonify(dict(error=str(error))), 503
 
-def _get_paper(paper_id: str) -> Optional[Dict[str, str]]:
-    p = redis_connection.hgetall(paper_id)
-    if len(p.keys()) > 0:
-        p['id'] = paper_id
-        p['referenced_by_n'] = p.get('referenced_by_n', 0)
-        return p
+
+@app.before_request
+def _warm_up_before_request() -> None:
+    if request.endpoint in UNWARMED_ENDPOINTS:
+        return
+    try:
+        warm_up()
+    except WARM_UP_ERRORS:
+        abort(503)
+
+
+def warm_up() -> None:
+    # opens the backends, maps the indices and loads the stemmer once, a failed
+    # warm-up is retried by the next request or readiness probe
+    global redis_connection, postgres_pool, blast_session, citation_graph
+    global search_index, is_warmed_up
+    if is_warmed_up:
+        return
+    processing.warm_up()
+    with _warm_up_lock:
+        # the clients connect on first use, so nothing here waits on the network
+        if redis_connection is None:
+            redis_connection = config.RedisServiceConfig.create_connection()
+        if blast_session is None:
+            blast_session = config.BlastServiceConfig.create_session()
+        if citation_graph is None and graph.CitationGraph.exists(
+            config.GraphConfig.FOLDER_PATH
+        ):
+            citation_graph = graph.CitationGraph(config.GraphConfig.FOLDER_PATH)
+        if search_index is None and config.SearchConfig.ENGINE == 'embedded':
+            search_index = search.SearchIndex(config.SearchConfig.FOLDER_PATH)
+        # with the graph mapped, postgres is never asked and need not be up
+        is_opening_postgres = postgres_pool is None and citation_graph is None
+
+    if is_opening_postgres:
+        # connects outside of the lock, so a postgres that hangs only holds up
+        # the requests that need it, the first pool to be opened is kept
+        pool = config.PostgresServiceConfig.create_connection_pool()
+        with _warm_up_lock:
+            if postgres_pool is None:
+                postgres_pool, pool = pool, None
+        if pool is not None:
+            pool.closeall()
+    is_warmed_up = True
+
+
+def _backend_status() -> Dict[str, str]:
+    backends = dict()
+    backends['redis'] = _check(lambda: redis_connection.ping())
+    if citation_graph is None:
+        backends['postgres'] = _check(_ping_postgres)
+    if search_index is None:
+        blast_config = config.BlastServiceConfig
+        backends['blast'] = _check(
+            lambda: socket.create_connection(
+                (blast_config.HOST, blast_config.PORT), config.ProbeConfig.TIMEOUT
+            ).close()
+        )
+    return backends
+
+
+def _check(probe: Callable[[], object]) -> str:
+    try:
+        probe()
+    except WARM_UP_ERRORS as error:
+        return f'{type(error).__name__}: {error}'
+    return 'ok'
+
+
+def _ping_postgres() -> None:
+    # a pool busy with other requests counts as not ready, instead of queueing
+    with _postgres_cursor(timeout=config.ProbeConfig.TIMEOUT) as cursor:
+        cursor.execute('SELECT 1')
+
+
+@contextlib.contextmanager
+def _timed(backend: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        g.timings[backend] = g.timings.get(backend, 0.0) + duration
+
+
+def _jsonify(result: object) -> Response:
+    with _timed('json'):
+        return jsonify(result)
+
+
+def _graph_backend() -> str:
+    return 'postgres' if citation_graph is None else 'graph'
+
+
+@contextlib.contextmanager
+def _postgres_cursor(
+    timeout: Optional[float] = None,
+) -> Iterator[psycopg2.extensions.cursor]:
+    # a request that finds no free connection in time is answered with a 503
+    if timeout is None:
+        timeout = config.PostgresServiceConfig.POOL_TIMEOUT
+    if not postgres_pool_slots.acquire(timeout=timeout):
+        raise TimeoutError('No free postgres connection')
+    try:
+        connection = postgres_pool.getconn()
+        try:
+            # commits on success and rolls back on error, so a failed
+            # transaction never leaks into the next request using this connection
+            with connection:
+                with connection.cursor() as cursor:
+                    yield cursor
+        finally:
+            postgres_pool.putconn(connection, close=bool(connection.closed))
+    finally:
+        postgres_pool_slots.release()
+
+
+def _graph_cursor() -> ContextManager[Optional[psycopg2.extensions.cursor]]:
+    # the memory-mapped graph, when present, keeps postgres off the read path
+    if citation_graph is None:
+        return _postgres_cursor()
     else:
-        return None
+        return contextlib.nullcontext()
+
+
+def _search(terms: List[str], prefix: str) -> Optional[api_common.SearchHits]:
+    if search_index is not None:
+        with _timed('search'):
+            ids, _ = search_index.search(terms, config.SearchConfig.N_HITS, prefix)
+        # the index keeps no document terms, but a local query is cheap to rerun
+        return api_common.SearchHits(ids=ids, terms=[], is_complete=False)
+
+    with _timed('blast'):
+        try:
+            blast_response = blast_session.post(
+                config.BlastServiceConfig.SEARCH_URL,
+                data=api_common.search_payload(terms, prefix),
+                timeout=config.BlastServiceConfig.SEARCH_TIMEOUT,
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            # a hung or unreachable blast must not hold on to the worker
+            abort(503)
+    if blast_response.status_code != 200:
+        abort(blast_response.status_code)
+
+    return api_common.search_hits(json.loads(blast_response.content.decode()))
+
+
+def _get_papers(paper_ids: Iterable[str]) -> List[Dict[str, str]]:
+    paper_ids = list(paper_ids)
+    papers = _lookup_papers(paper_ids)
+    return [papers[paper_id] for paper_id in paper_ids if papers[paper_id] is not None]
+
+
+def _lookup_papers(paper_ids: List[str]) -> Dict[str, Optional[Dict[str, str]]]:
+    # unknown ids map to None, the cached dicts are shared and must not be changed
+    if len(paper_ids) == 0:
+        return dict()
+
+    _check_dataset_version()
+    papers = {paper_id: paper_cache.get(paper_id) for paper_id in paper_ids}
+    missing_ids = [paper_id for paper_id, p in papers.items() if p is cache.MISSING]
+    if len(missing_ids) > 0:
+        pipeline = redis_connection.pipeline(transaction=False)
+        for paper_id in missing_ids:
+            pipeline.hgetall(paper_id)
+        with _timed('redis'):
+            results = pipeline.execute()
+        for paper_id, p in zip(missing_ids, results):
+            papers[paper_id] = api_common.to_paper(paper_id, p)
+            paper_cache.set(paper_id, papers[paper_id])
+
+    return papers
+
+
+def _check_dataset_version() -> None:
+    if not _dataset_version_check.is_due():
+        return
+
+    with _timed('redis'):
+        version = redis_connection.get(config.RedisServiceConfig.DATASET_VERSION_KEY)
+    _dataset_version_check.update(version)
+
+
+def _warm_up_in_background() -> None:
+    try:
+        warm_up()
+    except WARM_UP_ERRORS as error:
+        app.logger.warning(f'Warm-up failed, retrying on the next request: {error}')
 
 
 if __name__ == '__main__':
+    # the server accepts connections right away, /readyz tells when to send traffic
+    threading.Thread(target=_warm_up_in_background, daemon=True).start()
     app.run('0.0.0.0')
@@ -0,0 +1,502 @@
+import asyncio
+import contextlib
+import json
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import asyncpg
+import redis
+from aiohttp import web
+
+import api_common
+import cache
+import config
+import graph
+import metrics
+import processing
+import search
+
+
+routes = web.RouteTableDef()
+paper_cache = cache.LRUCache(
+    config.RedisServiceConfig.PAPER_CACHE_MAX_SIZE,
+    config.RedisServiceConfig.PAPER_CACHE_TTL,
+)
+# loaded with the connections when the app starts
+citation_graph: Optional[graph.CitationGraph] = None
+search_index: Optional[search.SearchIndex] = None
+# opened by the first request that needs it, see _postgres_pool
+postgres_pool: Optional[asyncpg.pool.Pool] = None
+_postgres_pool_opening: Optional[asyncio.Future] = None
+autocomplete_cache = cache.LRUCache(
+    config.BlastServiceConfig.AUTOCOMPLETE_CACHE_MAX_SIZE,
+    config.BlastServiceConfig.AUTOCOMPLETE_CACHE_TTL,
+)
+_autocomplete_stats = dict(prefix_reuses=0)
+_dataset_version_check = api_common.DatasetVersionCheck(
+    [paper_cache, autocomplete_cache]
+)
+# a postgres that is down, refuses the connection or does not answer in time
+POSTGRES_ERRORS = (asyncpg.PostgresError, OSError, asyncio.TimeoutError)
+# answered with a 503, like the flask app does for a backend that is down
+BACKEND_ERRORS = (redis.RedisError,) + POSTGRES_ERRORS
+
+
+@routes.get('/')
+async def hello_world(request: web.Request) -> web.Response:
+    return web.Response(text='Hello World!')
+
+
+@routes.get('/healthz')
+async def healthz(request: web.Request) -> web.Response:
+    return web.json_response(dict(status='ok'))
+
+
+@routes.get('/readyz')
+async def readyz(request: web.Request) -> web.Response:
+    # also opens the postgres pool, so a probe is enough to warm it up
+    backends = dict(redis=await _check(request.app['redis_connection'].ping()))
+    if citation_graph is None:
+        backends['postgres'] = await _check(_ping_postgres())
+    if search_index is None:
+        backends['blast'] = await _check(_ping_blast())
+    is_ready = all([status == 'ok' for status in backends.values()])
+    return web.json_response(
+        dict(is_ready=is_ready, backends=backends), status=200 if is_ready else 503
+    )
+
+
+async def _check(probe: Awaitable) -> str:
+    try:
+        await asyncio.wait_for(probe, config.ProbeConfig.TIMEOUT)
+    except (redis.RedisError, asyncpg.PostgresError, OSError) as error:
+        return f'{type(error).__name__}: {error}'
+    except asyncio.TimeoutError:
+        return 'timeout'
+    return 'ok'
+
+
+async def _ping_postgres() -> None:
+    await (await _postgres_pool()).fetchval('SELECT 1')
+
+
+async def _ping_blast() -> None:
+    _, writer = await asyncio.open_connection(
+        config.BlastServiceConfig.HOST, config.BlastServiceConfig.PORT
+    )
+    writer.close()
+
+
+@routes.get('/api/v1/paper/{paper_id}')
+async def paper(request: web.Request) -> web.Response:
+    papers = await _get_papers(request, [request.match_info['paper_id']])
+    p = papers[0] if len(papers) > 0 else dict()
+
+    return _json_response(request, p)
+
+
+@routes.post('/api/v1/papers')
+async def papers(request: web.Request) -> web.Response:
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    paper_ids, fields = api_common.bulk_params(body)
+    papers = await _lookup_papers(request, paper_ids)
+    return _json_response(request, api_common.select_fields(papers, fields))
+
+
+@routes.get('/api/v1/autocomplete/{query}')
+async def autocomplete(request: web.Request) -> web.Response:
+    query, prefix = processing.clean_typeahead_query(request.match_info['query'])
+    terms = query.split()
+    if len(terms) == 0 and prefix == '':
+        return _json_response(request, [])
+    await _check_dataset_version(request)
+
+    cache_key = config.BlastServiceConfig.SEARCH_QUERY(terms, prefix)
+    hits = autocomplete_cache.get(cache_key)
+    if hits is cache.MISSING:
+        hits = api_common.search_from_shorter_query(autocomplete_cache, terms, prefix)
+        if hits is not cache.MISSING:
+            _autocomplete_stats['prefix_reuses'] += 1
+        else:
+            hits = await _search(request, terms, prefix)
+        if hits is None:
+            return _json_response(request, [])
+        autocomplete_cache.set(cache_key, hits)
+
+    papers = await _get_papers(request, hits.ids)
+    if search_index is None:
+        # blast scores the text alone, the embedded index already boosted the
+        # referenced papers, so the hydrated hits are ranked like it ranks them
+        papers = api_common.rank_blast_hits(papers, hits, prefix)
+    result = api_common.order_papers(papers, request.query.get('order'))
+    return _json_response(request, result)
+
+
+async def _search(
+    request: web.Request, terms: List[str], prefix: str
+) -> Optional[api_common.SearchHits]:
+    if search_index is not None:
+        with _timed(request, 'search'):
+            ids, _ = search_index.search(terms, config.SearchConfig.N_HITS, prefix)
+        # the index keeps no document terms, but a local query is cheap to rerun
+        return api_common.SearchHits(ids=ids, terms=[], is_complete=False)
+
+    connect_timeout, read_timeout = config.BlastServiceConfig.SEARCH_TIMEOUT
+    with _timed(request, 'blast'):
+        try:
+            async with request.app['blast_session'].post(
+                config.BlastServiceConfig.SEARCH_URL,
+                data=api_common.search_payload(terms, prefix),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout, sock_read=read_timeout
+                ),
+            ) as blast_response:
+                if blast_response.status != 200:
+                    raise api_common.RequestError(
+                        blast_response.status, 'The search failed'
+                    )
+                blast_response = json.loads(await blast_response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # a hung or unreachable blast must not keep the client waiting
+            raise web.HTTPServiceUnavailable()
+
+    return api_common.search_hits(blast_response)
+
+
+@routes.get('/api/v1/referenced_by/{paper_id}', name='referenced_by')
+async def referenced_by(request: web.Request) -> web.StreamResponse:
+    return await _adjacent_papers(request, 'referenced_by', 'in')
+
+
+@routes.get('/api/v1/references/{paper_id}', name='references')
+async def references(request: web.Request) -> web.StreamResponse:
+    return await _adjacent_papers(request, 'references', 'out')
+
+
+@routes.get('/api/v1/neighborhood/{paper_id}')
+async def neighborhood(request: web.Request) -> web.Response:
+    depth, max_fan_out, directions = api_common.neighborhood_params(request.query)
+    neighborhood = api_common.Neighborhood(request.match_info['paper_id'])
+    for _ in range(depth):
+        if len(neighborhood.frontier) == 0:
+            break
+        hop_edges = []
+        for d in directions:
+            hop_edges.extend(
+                await _neighborhood_edges(
+                    request, d, neighborhood.frontier, max_fan_out
+                )
+            )
+        neighborhood.add_hop(hop_edges)
+
+    nodes = await _get_papers(request, neighborhood.node_ids)
+    return _json_response(request, neighborhood.to_dict(nodes))
+
+
+async def _neighborhood_edges(
+    request: web.Request, direction: str, frontier: List[str], max_fan_out: int
+) -> List[Tuple[str, str]]:
+    with _timed(request, _graph_backend()):
+        if citation_graph is None:
+            rows = await _fetch(
+                api_common.neighborhood_sql(direction),
+                paper_ids=frontier,
+                max_fan_out=max_fan_out,
+            )
+            return [tuple(r) for r in rows]
+        elif direction == 'in':
+            return [
+                (n, paper_id)
+                for paper_id in frontier
+                for n in citation_graph.referenced_by(paper_id, limit=max_fan_out)
+            ]
+        else:
+            return [
+                (paper_id, n)
+                for paper_id in frontier
+                for n in citation_graph.references(paper_id, limit=max_fan_out)
+            ]
+
+
+async def _adjacent_papers(
+    request: web.Request, endpoint: str, direction: str
+) -> web.StreamResponse:
+    paper_id = request.match_info['paper_id']
+    after, limit = api_common.page_params(request.query)
+    order = request.query.get('order')
+    if request.query.get('format') == 'ndjson':
+        if order is not None:
+            raise api_common.RequestError(400, 'A stream cannot be ordered')
+        return await _stream_pages(request, direction, paper_id, after, limit)
+
+    adjacent_ids = await _adjacent_ids(request, direction, paper_id, after, limit)
+    # a page still holds the ids after the cursor, only its order changes
+    result = api_common.order_papers(await _get_papers(request, adjacent_ids), order)
+    response = _json_response(request, result)
+    if limit is not None and len(adjacent_ids) == limit:
+        next_url = (
+            request.app.router[endpoint]
+            .url_for(paper_id=paper_id)
+            .with_query(after=adjacent_ids[-1], limit=limit)
+        )
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+async def _adjacent_ids(
+    request: web.Request,
+    direction: str,
+    paper_id: str,
+    after: str,
+    limit: Optional[int],
+) -> List[str]:
+    with _timed(request, _graph_backend()):
+        if citation_graph is None:
+            rows = await _fetch(
+                api_common.adjacent_ids_sql(direction),
+                paper_id=paper_id,
+                after=after,
+                limit=limit,
+            )
+            return [r[0] for r in rows]
+        elif direction == 'in':
+            return citation_graph.referenced_by(paper_id, after, limit)
+        else:
+            return citation_graph.references(paper_id, after, limit)
+
+
+async def _stream_pages(
+    request: web.Request,
+    direction: str,
+    paper_id: str,
+    after: str,
+    limit: Optional[int],
+) -> web.StreamResponse:
+    # every page is a query of its own after the last id of the previous one, so
+    # no connection is held while a slow client reads, and the first page is read
+    # before answering, so a busy pool is still a 503
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    batch_size = config.PostgresServiceConfig.STREAM_BATCH_SIZE
+    n_streamed = 0
+    while True:
+        if limit is not None:
+            batch_size = min(batch_size, limit - n_streamed)
+        adjacent_ids = await _adjacent_ids(
+            request, direction, paper_id, after, batch_size
+        )
+        page = api_common.to_ndjson(await _get_papers(request, adjacent_ids))
+        if not response.prepared:
+            await response.prepare(request)
+        await response.write(page.encode())
+        n_streamed += len(adjacent_ids)
+        if len(adjacent_ids) < batch_size or n_streamed == limit:
+            break
+        after = adjacent_ids[-1]
+
+    await response.write_eof()
+    return response
+
+
+@routes.get('/api/v1/stats/caches')
+async def cache_stats(request: web.Request) -> web.Response:
+    autocomplete_stats = dict(autocomplete_cache.stats(), **_autocomplete_stats)
+    return web.json_response(
+        dict(papers=paper_cache.stats(), autocomplete=autocomplete_stats)
+    )
+
+
+@routes.get('/metrics')
+async def prometheus_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=metrics.latest(), headers={'Content-Type': metrics.CONTENT_TYPE}
+    )
+
+
+@web.middleware
+async def _timing_and_errors(
+    request: web.Request, handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    # times the request, and answers the errors of the backends with a 503 and
+    # an unsupported parameter with its status, as the flask app does
+    request['start_time'] = time.perf_counter()
+    request['timings'] = dict()
+    status = 500
+    try:
+        try:
+            response = await handler(request)
+        except api_common.RequestError as error:
+            response = web.json_response(dict(error=str(error)), status=error.status)
+        except BACKEND_ERRORS as error:
+            response = web.json_response(
+                dict(error=f'{type(error).__name__}: {error}'), status=503
+            )
+        status = response.status
+        return response
+    except web.HTTPException as error:
+        status = error.status
+        raise
+    finally:
+        route = request.match_info.route
+        endpoint = 'unknown' if route.resource is None else route.handler.__name__
+        duration = time.perf_counter() - request['start_time']
+        metrics.observe(endpoint, status, duration, request['timings'])
+
+
+async def _add_server_timing(
+    request: web.Request, response: web.StreamResponse
+) -> None:
+    # a streamed body is only produced after this, so it carries the first page
+    if 'start_time' not in request:
+        return
+    duration = time.perf_counter() - request['start_time']
+    response.headers['Server-Timing'] = metrics.server_timing(
+        duration, request['timings']
+    )
+
+
+@contextlib.contextmanager
+def _timed(request: web.Request, backend: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        timings = request['timings']
+        timings[backend] = timings.get(backend, 0.0) + duration
+
+
+def _json_response(request: web.Request, result: object) -> web.Response:
+    with _timed(request, 'json'):
+        return web.json_response(result)
+
+
+def _graph_backend() -> str:
+    return 'postgres' if citation_graph is None else 'graph'
+
+
+async def _fetch(sql: str, **parameters: object) -> List[asyncpg.Record]:
+    # a request that finds no free connection in time is answered with a 503
+    sql, names = config.PostgresServiceConfig.POSITIONAL_SQL(sql)
+    pool = await _postgres_pool()
+    async with pool.acquire(
+        timeout=config.PostgresServiceConfig.POOL_TIMEOUT
+    ) as connection:
+        return await connection.fetch(sql, *[parameters[n] for n in names])
+
+
+async def _get_papers(request: web.Request, paper_ids: List[str]) -> List[Dict]:
+    papers = await _lookup_papers(request, paper_ids)
+    return [papers[paper_id] for paper_id in paper_ids if papers[paper_id] is not None]
+
+
+async def _lookup_papers(
+    request: web.Request, paper_ids: List[str]
+) -> Dict[str, Optional[Dict]]:
+    # unknown ids map to None, the cached dicts are shared and must not be changed
+    if len(paper_ids) == 0:
+        return dict()
+
+    await _check_dataset_version(request)
+    papers = {paper_id: paper_cache.get(paper_id) for paper_id in paper_ids}
+    missing_ids = [paper_id for paper_id, p in papers.items() if p is cache.MISSING]
+    if len(missing_ids) > 0:
+        chunk_size = config.RedisServiceConfig.HYDRATION_CHUNK_SIZE
+        n_chunks = (len(missing_ids) + chunk_size - 1) // chunk_size
+        with _timed(request, 'redis'):
+            chunk_results = await asyncio.gather(
+                *[
+                    _fetch_papers(request.app, missing_ids[i::n_chunks])
+                    for i in range(n_chunks)
+                ]
+            )
+        for fetched in chunk_results:
+            for paper_id, p in fetched.items():
+                papers[paper_id] = p
+                paper_cache.set(paper_id, p)
+
+    return papers
+
+
+async def _fetch_papers(app: web.Application, paper_ids: List[str]) -> Dict:
+    pipeline = app['redis_connection'].pipeline(transaction=False)
+    for paper_id in paper_ids:
+        pipeline.hgetall(paper_id)
+    return {
+        paper_id: api_common.to_paper(paper_id, p)
+        for paper_id, p in zip(paper_ids, await pipeline.execute())
+    }
+
+
+async def _check_dataset_version(request: web.Request) -> None:
+    if not _dataset_version_check.is_due():
+        return
+
+    with _timed(request, 'redis'):
+        version = await request.app['redis_connection'].get(
+            config.RedisServiceConfig.DATASET_VERSION_KEY
+        )
+    _dataset_version_check.update(version)
+
+
+async def _postgres_pool() -> asyncpg.pool.Pool:
+    # the app starts while postgres is down, concurrent requests share one attempt
+    # to open the pool and a failed attempt is retried by the next request
+    global postgres_pool, _postgres_pool_opening
+    if postgres_pool is not None:
+        return postgres_pool
+    if _postgres_pool_opening is None:
+        _postgres_pool_opening = asyncio.ensure_future(
+            asyncpg.create_pool(
+                config.PostgresServiceConfig.ASYNC_CONNECTION_STRING,
+                min_size=config.PostgresServiceConfig.POOL_MIN_SIZE,
+                max_size=config.PostgresServiceConfig.POOL_MAX_SIZE,
+                timeout=config.PostgresServiceConfig.CONNECT_TIMEOUT,
+            )
+        )
+    opening = _postgres_pool_opening
+    try:
+        # a request that gives up, e.g. a probe timing out, leaves it to the others
+        postgres_pool = await asyncio.shield(opening)
+    except Exception:
+        if opening.done() and _postgres_pool_opening is opening:
+            _postgres_pool_opening = None
+        raise
+    return postgres_pool
+
+
+async def _open_connections(app: web.Application) -> None:
+    # redis and blast connect on first use, nothing here waits on a backend
+    global citation_graph, search_index
+    processing.warm_up()
+    if citation_graph is None and graph.CitationGraph.exists(
+        config.GraphConfig.FOLDER_PATH
+    ):
+        citation_graph = graph.CitationGraph(config.GraphConfig.FOLDER_PATH)
+    if search_index is None and config.SearchConfig.ENGINE == 'embedded':
+        search_index = search.SearchIndex(config.SearchConfig.FOLDER_PATH)
+    app['redis_connection'] = config.RedisServiceConfig.create_async_connection()
+    app['blast_session'] = config.BlastServiceConfig.create_async_session()
+
+
+async def _close_connections(app: web.Application) -> None:
+    await app['blast_session'].close()
+    if postgres_pool is not None:
+        await postgres_pool.close()
+    await app['redis_connection'].close()
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[_timing_and_errors])
+    app.add_routes(routes)
+    app.on_startup.append(_open_connections)
+    app.on_response_prepare.append(_add_server_timing)
+    app.on_cleanup.append(_close_connections)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=5000)
@@ -0,0 +1,261 @@
+import json
+import time
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import cache
+import config
+import search
+
+
+class SearchHits(NamedTuple):
+    ids: List[str]
+    terms: List[FrozenSet[str]]
+    is_complete: bool
+
+
+class RequestError(Exception):
+    # answered with the status by both servers, e.g. an unsupported parameter
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class DatasetVersionCheck:
+    # the loaders bump the dataset version, which is read at most once per
+    # interval, and a new version drops the cached papers and hits
+    def __init__(self, caches: List[cache.LRUCache]):
+        self._caches = caches
+        self._next_check = 0.0
+
+    def is_due(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = (
+            now + config.RedisServiceConfig.DATASET_VERSION_CHECK_INTERVAL
+        )
+        return True
+
+    def update(self, version: Optional[str]) -> None:
+        for c in self._caches:
+            c.invalidate_if_stale(version)
+
+
+class Neighborhood:
+    # grows hop by hop from a paper until the node limit, the edges between the
+    # papers that are found are kept
+    def __init__(self, paper_id: str):
+        self._node_ids = {paper_id: None}
+        self._edges: Set[Tuple[str, str]] = set()
+        self.frontier = [paper_id]
+
+    @property
+    def node_ids(self) -> List[str]:
+        return list(self._node_ids)
+
+    def add_hop(self, hop_edges: Iterable[Tuple[str, str]]) -> None:
+        self.frontier = []
+        for edge in hop_edges:
+            self._edges.add(edge)
+            for node_id in edge:
+                is_new = node_id not in self._node_ids
+                if (
+                    is_new
+                    and len(self._node_ids)
+                    < config.PostgresServiceConfig.MAX_NEIGHBORHOOD_NODES
+                ):
+                    self._node_ids[node_id] = None
+                    self.frontier.append(node_id)
+
+    def to_dict(self, nodes: List[Dict[str, str]]) -> Dict[str, List[Dict]]:
+        found_ids = {p['id'] for p in nodes}
+        edges = [
+            dict(referencer=referencer, referencee=referencee)
+            for referencer, referencee in sorted(self._edges)
+            if referencer in found_ids and referencee in found_ids
+        ]
+        return dict(nodes=nodes, edges=edges)
+
+
+def to_paper(paper_id: str, p: Dict[str, str]) -> Optional[Dict[str, str]]:
+    if len(p.keys()) > 0:
+        p['id'] = paper_id
+        p['referenced_by_n'] = p.get('referenced_by_n', 0)
+        return p
+    else:
+        return None
+
+
+def order_papers(
+    papers: List[Dict[str, str]], order: Optional[str]
+) -> List[Dict[str, str]]:
+    # the importance is already part of the paper hashes, so ordering is free
+    if order is None:
+        return papers
+    if order != 'importance':
+        raise RequestError(400, f'Unknown order: {order}')
+    importance_field = config.GraphConfig.IMPORTANCE_FIELD
+    return sorted(papers, key=lambda p: -float(p.get(importance_field, 0)))
+
+
+def rank_blast_hits(
+    papers: List[Dict[str, str]], hits: SearchHits, prefix: str
+) -> List[Dict[str, str]]:
+    # exact matches of the prefix first, then importance, and the id makes the
+    # order total, so filtered hits of a shorter query rank like a fresh search
+    terms_by_id = dict(zip(hits.ids, hits.terms))
+    importance_field = config.GraphConfig.IMPORTANCE_FIELD
+    return sorted(
+        papers,
+        key=lambda p: (
+            prefix != '' and prefix not in terms_by_id[p['id']],
+            -float(p.get(importance_field, 0)),
+            p['id'],
+        ),
+    )
+
+
+def search_payload(terms: List[str], prefix: str) -> str:
+    query = config.BlastServiceConfig.SEARCH_QUERY(terms, prefix)
+    payload = config.BlastServiceConfig.SEARCH_REQUEST_DICT
+    payload['search_request']['query']['query'] = query
+    return json.dumps(payload)
+
+
+def search_hits(blast_response: Dict) -> Optional[SearchHits]:
+    if not blast_response['success']:
+        return None
+
+    search_result = blast_response['search_result']
+    hits = search_result['hits']
+    return SearchHits(
+        ids=[h['id'] for h in hits],
+        terms=[document_terms(h.get('fields', dict())) for h in hits],
+        is_complete=search_result['total_hits'] <= len(hits),
+    )
+
+
+def search_from_shorter_query(
+    autocomplete_cache: cache.LRUCache, terms: List[str], prefix: str
+) -> object:
+    # the hits of a shorter prefix or of fewer terms are a superset, so once they
+    # are complete the longer query can be answered by filtering them
+    shorter_queries = [
+        (terms, prefix[:n])
+        for n in range(len(prefix) - 1, -1, -1)
+        if len(terms) + n > 0
+    ]
+    shorter_queries += [(terms[:n], '') for n in range(len(terms) - 1, 0, -1)]
+    for shorter_terms, shorter_prefix in shorter_queries:
+        hits = autocomplete_cache.peek(
+            config.BlastServiceConfig.SEARCH_QUERY(shorter_terms, shorter_prefix)
+        )
+        if hits is not cache.MISSING and hits.is_complete:
+            matches = [
+                (paper_id, terms_of_paper)
+                for paper_id, terms_of_paper in zip(hits.ids, hits.terms)
+                if is_match(terms_of_paper, terms, prefix)
+            ]
+            return SearchHits(
+                ids=[paper_id for paper_id, _ in matches],
+                terms=[terms_of_paper for _, terms_of_paper in matches],
+                is_complete=True,
+            )
+
+    return cache.MISSING
+
+
+def is_match(terms_of_paper: FrozenSet[str], terms: List[str], prefix: str) -> bool:
+    return set(terms) <= terms_of_paper and (
+        prefix == '' or any([t.startswith(prefix) for t in terms_of_paper])
+    )
+
+
+def document_terms(fields: Dict[str, str]) -> FrozenSet[str]:
+    return frozenset(term.lower() for term in search.document_terms(fields))
+
+
+def adjacent_ids_sql(direction: str) -> str:
+    if direction == 'in':
+        return config.PostgresServiceConfig.REFERENCED_BY_SQL
+    else:
+        return config.PostgresServiceConfig.REFERENCES_SQL
+
+
+def neighborhood_sql(direction: str) -> str:
+    if direction == 'in':
+        return config.PostgresServiceConfig.NEIGHBORHOOD_REFERENCED_BY_SQL
+    else:
+        return config.PostgresServiceConfig.NEIGHBORHOOD_REFERENCES_SQL
+
+
+def page_params(args: Mapping[str, str]) -> Tuple[str, Optional[int]]:
+    after = args.get('after', '')
+    limit = _int_param(args, 'limit', None)
+    if limit is not None:
+        limit = max(1, min(limit, config.PostgresServiceConfig.MAX_PAGE_SIZE))
+    return after, limit
+
+
+def neighborhood_params(args: Mapping[str, str]) -> Tuple[int, int, List[str]]:
+    postgres_config = config.PostgresServiceConfig
+    depth = _int_param(args, 'depth', 1)
+    depth = max(1, min(depth, postgres_config.MAX_NEIGHBORHOOD_DEPTH))
+    max_fan_out = _int_param(args, 'max_fan_out', postgres_config.DEFAULT_FAN_OUT)
+    max_fan_out = max(1, min(max_fan_out, postgres_config.MAX_FAN_OUT))
+    direction = args.get('direction', 'both')
+    if direction not in ('in', 'out', 'both'):
+        raise RequestError(400, f'Unknown direction: {direction}')
+    directions = ['in', 'out'] if direction == 'both' else [direction]
+    return depth, max_fan_out, directions
+
+
+def bulk_params(body: object) -> Tuple[List[str], Optional[List[str]]]:
+    if not isinstance(body, dict):
+        raise RequestError(400, 'Expected a JSON object')
+    paper_ids = body.get('ids')
+    fields = body.get('fields')
+    if not _is_list_of_strings(paper_ids) or len(paper_ids) == 0:
+        raise RequestError(400, 'Expected a non-empty list of ids')
+    if len(paper_ids) > config.RedisServiceConfig.MAX_BULK_PAPERS:
+        raise RequestError(413, 'Too many ids')
+    if fields is not None and not _is_list_of_strings(fields):
+        raise RequestError(400, 'Expected a list of fields')
+    return paper_ids, fields
+
+
+def select_fields(
+    papers: Dict[str, Optional[Dict[str, str]]], fields: Optional[List[str]]
+) -> Dict[str, Optional[Dict[str, str]]]:
+    if fields is None:
+        return papers
+    return {
+        paper_id: None if p is None else {f: p[f] for f in fields if f in p}
+        for paper_id, p in papers.items()
+    }
+
+
+def to_ndjson(papers: List[Dict[str, str]]) -> str:
+    return ''.join([json.dumps(p) + '\n' for p in papers])
+
+
+def _int_param(args: Mapping[str, str], name: str, default: Optional[int]) -> object:
+    # an argument that is no number falls back to the default, as flask does
+    try:
+        return int(args[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _is_list_of_strings(value: object) -> bool:
+    return isinstance(value, list) and all([isinstance(v, str) for v in value])
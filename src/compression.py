@@ -0,0 +1,74 @@
+import gzip
+import io
+from pathlib import Path
+from typing import IO, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# the codec of a file is told by the suffix after its extension
+SUFFIXES = dict(none='', gzip='.gz', zstd='.zst')
+# fast levels, the files are written once and read once
+GZIP_LEVEL = 3
+ZSTD_LEVEL = 3
+
+
+def resolve_codec(codec: str) -> str:
+    # 'auto' prefers zstd, which is several times faster than gzip
+    if codec == 'auto':
+        return 'gzip' if zstandard is None else 'zstd'
+    if codec not in SUFFIXES:
+        raise ValueError(f'Unknown compression {codec}')
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression needs the zstandard package')
+    return codec
+
+
+def codec_of(path: Path) -> str:
+    for codec, suffix in SUFFIXES.items():
+        if suffix != '' and path.name.endswith(suffix):
+            return codec
+    return 'none'
+
+
+def base_name(path: Path) -> str:
+    # the name of the file without its compression suffix
+    suffix = SUFFIXES[codec_of(path)]
+    return path.name[: len(path.name) - len(suffix)]
+
+
+def with_codec(path: Path, codec: str) -> Path:
+    return path.with_name(path.name + SUFFIXES[codec])
+
+
+def find(path: Path) -> Path:
+    # the existing variant of an uncompressed path, or the path itself
+    for codec in SUFFIXES:
+        if with_codec(path, codec).exists():
+            return with_codec(path, codec)
+    return path
+
+
+def open_file(path: Path, mode: str = 'r', newline: Optional[str] = None) -> IO:
+    # compressed files are opened in text mode unless 'b' is in the mode, like open
+    codec = codec_of(path)
+    if codec == 'none':
+        return open(str(path), mode, newline=newline)
+
+    binary_mode = mode.replace('b', '') + 'b'
+    if codec == 'gzip':
+        # without a timestamp in the header the same input gives the same file
+        binary_file = gzip.GzipFile(
+            str(path), binary_mode, compresslevel=GZIP_LEVEL, mtime=0
+        )
+    elif zstandard is None:
+        raise ValueError(f'{path.name} needs the zstandard package')
+    else:
+        compressor = None if 'r' in mode else zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        binary_file = zstandard.open(str(path), binary_mode, cctx=compressor)
+    if 'b' in mode:
+        return binary_file
+    return io.TextIOWrapper(binary_file, newline=newline)
@@ -1,8 +1,14 @@
 import abc
-from typing import Dict, List
+import re
+from pathlib import Path
+from typing import Dict, List, Match, Tuple
 
+import aiohttp
 import psycopg2
+import psycopg2.pool
 import redis
+import redis.asyncio
+import requests
 
 
 class InputConfig:
@@ -15,6 +21,59 @@ class InputConfig:
     TITLE_INDEX = 6
     INPUT_FOLDER_NAME = 'input'
     FILE_GLOB = '*.csv'
+    BATCH_SIZE = 1000
+    HASH_CHUNK_SIZE = 1 << 20
+    READ_CHUNK_SIZE = 1 << 22
+    # papers with a category starting with one of these are converted
+    CATEGORY_PREFIXES = ('cs.',)
+
+
+class CompressionConfig:
+    # 'auto', 'none', 'gzip' or 'zstd' for the files written by convert.py,
+    # 'auto' is zstd when the zstandard package is installed and gzip otherwise,
+    # it is not in the Pipfile, pip install zstandard to make use of it
+    CODEC = 'auto'
+
+
+class SearchConfig:
+    # 'blast' or 'embedded', the latter needs an index from watch.py build-search-index
+    ENGINE = 'blast'
+    FOLDER_PATH = Path('data') / 'search'
+    N_HITS = 10
+
+
+class GraphConfig:
+    FOLDER_PATH = Path('data') / 'graph'
+    EXPORT_BATCH_SIZE = 100_000
+    PAGERANK_DAMPING = 0.85
+    # summed absolute change of all ranks between two iterations
+    PAGERANK_TOLERANCE = 1e-6
+    PAGERANK_MAX_ITERATIONS = 100
+    # written to the paper hashes by watch.py compute-citation-metrics
+    IMPORTANCE_FIELD = 'pagerank'
+
+
+class ProbeConfig:
+    # seconds the readiness probe waits for a backend
+    TIMEOUT = 1.0
+
+
+class MetricsConfig:
+    # request latencies are mostly below a few milliseconds
+    LATENCY_BUCKETS = (
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+    )
 
 
 class ServiceConfig(abc.ABC):
@@ -40,7 +99,21 @@ class ServiceConfig(abc.ABC):
 
     @property
     def FILE_GLOB(self) -> str:
-        return f'*.{self.FILE_EXTENSION}'
+        # also matches the compressed files, e.g. 2019_1.json.gz
+        return f'*.{self.FILE_EXTENSION}*'
+
+    @property
+    def MANIFEST_FOLDER_NAME(self) -> str:
+        return 'manifest'
+
+    @property
+    def MANIFEST_FILE_NAME(self) -> str:
+        return 'manifest.json'
+
+    @property
+    def CONNECT_TIMEOUT(self) -> int:
+        # whole seconds, libpq takes no fractions and waits at least 2
+        return 2
 
 
 class _BlastServiceConfig(ServiceConfig):
@@ -96,12 +169,60 @@ class _BlastServiceConfig(ServiceConfig):
     def SEARCH_URL(self) -> str:
         return f'{self._URL_BASE}/_search'
 
+    @property
+    def POOL_SIZE(self) -> int:
+        return 10
+
+    def create_session(self) -> requests.Session:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.POOL_SIZE, pool_block=True
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        return session
+
+    def create_async_session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.POOL_SIZE)
+        )
+
+    @property
+    def BULK_TIMEOUT(self) -> float:
+        return 60.0
+
+    @property
+    def BULK_MAX_RETRIES(self) -> int:
+        return 5
+
+    @property
+    def BULK_BACKOFF(self) -> float:
+        return 1.0
+
+    @property
+    def SEARCH_TIMEOUT(self) -> Tuple[float, float]:
+        # seconds to connect and to wait for the answer, a typeahead search that
+        # takes longer is not worth waiting for
+        return float(self.CONNECT_TIMEOUT), 2.0
+
+    @property
+    def AUTOCOMPLETE_CACHE_MAX_SIZE(self) -> int:
+        return 10_000
+
+    @property
+    def AUTOCOMPLETE_CACHE_TTL(self) -> float:
+        return 10.0 * 60.0
+
+    def SEARCH_QUERY(self, terms: List[str], prefix: str = '') -> str:
+        # all terms are required so that a longer query only ever narrows the hits
+        terms = terms + [f'{prefix}*'] if prefix != '' else terms
+        return ' '.join([f'+{t}' for t in terms])
+
     @property
     def SEARCH_REQUEST_DICT(self) -> Dict:
         return {
             "search_request": {
                 "query": {"query": None},
-                "size": 10,
+                "size": SearchConfig.N_HITS,
                 "from": 0,
                 "fields": ["*"],
                 "sort": ["-_score"],
@@ -122,7 +243,7 @@ class _PostgresServiceConfig(ServiceConfig):
 
     @property
     def FILE_EXTENSION(self) -> str:
-        return 'sql'
+        return 'tsv'
 
     @property
     def FOLDER_NAME(self) -> str:
@@ -144,15 +265,53 @@ class _PostgresServiceConfig(ServiceConfig):
         )
 
     def create_connection(self) -> psycopg2.extensions.connection:
-        return psycopg2.connect(self.CONNECTION_STRING)
+        return psycopg2.connect(
+            self.CONNECTION_STRING, connect_timeout=self.CONNECT_TIMEOUT
+        )
+
+    @property
+    def ASYNC_CONNECTION_STRING(self) -> str:
+        return (
+            f'postgresql://{self.USER_NAME}:mysecretpassword'
+            + f'@{self.HOST}:{self.PORT}/{self.DB_NAME}'
+        )
+
+    @property
+    def POOL_MIN_SIZE(self) -> int:
+        return 1
+
+    @property
+    def POOL_MAX_SIZE(self) -> int:
+        return 10
+
+    @property
+    def POOL_TIMEOUT(self) -> float:
+        # seconds a request waits for a free connection before it gives up
+        return 5.0
+
+    def create_connection_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        return psycopg2.pool.ThreadedConnectionPool(
+            self.POOL_MIN_SIZE,
+            self.POOL_MAX_SIZE,
+            self.CONNECTION_STRING,
+            connect_timeout=self.CONNECT_TIMEOUT,
+        )
 
     @property
     def CREATE_TABLE_FILE_NAME(self) -> str:
-        return f'create_tables.{self.FILE_EXTENSION}'
+        return 'create_tables.sql'
+
+    @property
+    def PAPERS_FILE_NAME(self) -> str:
+        return f'papers.{self.FILE_EXTENSION}'
+
+    def YEAR_IDS_FILE_NAME(self, year: str) -> str:
+        return f'ids_{year}.txt'
 
     @property
-    def INSERT_INTO_PAPERS_FILE_NAME(self) -> str:
-        return f'insert_into_papers.{self.FILE_EXTENSION}'
+    def ID_STORE_MAX_SIZE(self) -> int:
+        # ids held in memory per converter before they are spilled to disk
+        return 1_000_000
 
     @property
     def CREATE_TABLES_SQL(self) -> str:
@@ -171,42 +330,105 @@ CREATE TABLE IF NOT EXISTS refs
   FOREIGN KEY (referencer) REFERENCES papers (ID),
   FOREIGN KEY (referencee) REFERENCES papers (ID),
   PRIMARY KEY (referencer, referencee)
-);"""
+);
+
+CREATE INDEX IF NOT EXISTS refs_referencee_referencer_idx
+  ON refs (referencee, referencer);"""
+
+    # text format of COPY: tab separated columns with backslash escapes
+    _COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+    def COPY_ROW(self, *fields: str) -> str:
+        return '\t'.join([f.translate(self._COPY_ESCAPES) for f in fields]) + '\n'
 
     @property
-    def INSERT_INTO_REFS_START(self) -> str:
-        return """INSERT INTO refs (referencer, referencee)
-VALUES"""
+    def COPY_REFS_SQL(self) -> str:
+        return 'COPY refs (referencer, referencee) FROM STDIN'
 
-    def INSERT_INTO_REFS_ENTRY(
-        self, is_first_line: bool, paper_id: str, refs: List[str]
-    ) -> str:
-        document = [
-            ('' if is_first_line and index == 0 else ',\n      ')
-            + f" ('{paper_id}', '{r}')"
-            for index, r in enumerate(refs)
-        ]
-        document = ''.join(document)
-        return document
-
-    @property
-    def INSERT_INTO_REFS_END(self) -> str:
-        return '\n;'
-
-    def INSERT_INTO_PAPERS_SQL(self, ids: set) -> str:
-        document = [
-            ('' if index == 0 else ',\n      ') + f" ('{r}')"
-            for index, r in enumerate(sorted(list(ids)))
-        ]
-        document = ''.join(document)
-        document = f"""INSERT INTO papers (ID)
-VALUES{document}
-;"""
-        return document
+    @property
+    def COPY_PAPERS_SQL(self) -> str:
+        return 'COPY papers (ID) FROM STDIN'
+
+    @property
+    def COPY_CHUNK_SIZE(self) -> int:
+        return 1 << 20
 
     @property
     def REFERENCED_BY_SQL(self) -> str:
-        return 'SELECT referencer FROM refs WHERE referencee = %(paper_id)s'
+        # a NULL limit means no limit, the empty string sorts before every id
+        return """SELECT referencer
+FROM refs
+WHERE referencee = %(paper_id)s AND referencer > %(after)s
+ORDER BY referencer
+LIMIT %(limit)s"""
+
+    @property
+    def REFERENCES_SQL(self) -> str:
+        return """SELECT referencee
+FROM refs
+WHERE referencer = %(paper_id)s AND referencee > %(after)s
+ORDER BY referencee
+LIMIT %(limit)s"""
+
+    @property
+    def NEIGHBORHOOD_REFERENCED_BY_SQL(self) -> str:
+        return """SELECT r.referencer, r.referencee
+FROM unnest(%(paper_ids)s::VARCHAR(64)[]) AS p (ID)
+    CROSS JOIN LATERAL (
+        SELECT referencer, referencee
+        FROM refs
+        WHERE referencee = p.ID
+        ORDER BY referencer
+        LIMIT %(max_fan_out)s
+    ) r"""
+
+    @property
+    def NEIGHBORHOOD_REFERENCES_SQL(self) -> str:
+        return """SELECT r.referencer, r.referencee
+FROM unnest(%(paper_ids)s::VARCHAR(64)[]) AS p (ID)
+    CROSS JOIN LATERAL (
+        SELECT referencer, referencee
+        FROM refs
+        WHERE referencer = p.ID
+        ORDER BY referencee
+        LIMIT %(max_fan_out)s
+    ) r"""
+
+    @property
+    def MAX_NEIGHBORHOOD_DEPTH(self) -> int:
+        return 3
+
+    @property
+    def DEFAULT_FAN_OUT(self) -> int:
+        return 20
+
+    @property
+    def MAX_FAN_OUT(self) -> int:
+        return 100
+
+    @property
+    def MAX_NEIGHBORHOOD_NODES(self) -> int:
+        return 2000
+
+    def POSITIONAL_SQL(self, sql: str) -> Tuple[str, List[str]]:
+        # asyncpg takes $1, $2, ... instead of named parameters, a parameter that is
+        # used twice keeps its number
+        names = []  # type: List[str]
+
+        def number(match: Match) -> str:
+            if match.group(1) not in names:
+                names.append(match.group(1))
+            return f'${names.index(match.group(1)) + 1}'
+
+        return re.sub(r'%\((\w+)\)s', number, sql), names
+
+    @property
+    def MAX_PAGE_SIZE(self) -> int:
+        return 1000
+
+    @property
+    def STREAM_BATCH_SIZE(self) -> int:
+        return 1000
 
 
 class _RedisServiceConfig(ServiceConfig):
@@ -230,15 +452,62 @@ class _RedisServiceConfig(ServiceConfig):
     def DB(self) -> int:
         return 0
 
+    @property
+    def LOAD_BATCH_SIZE(self) -> int:
+        return 1000
+
+    @property
+    def DATASET_VERSION_KEY(self) -> str:
+        # ':' never appears in a cleaned paper id, so this cannot collide
+        return 'meta:dataset_version'
+
+    @property
+    def DATASET_VERSION_CHECK_INTERVAL(self) -> float:
+        return 5.0
+
+    @property
+    def PAPER_CACHE_MAX_SIZE(self) -> int:
+        return 100_000
+
+    @property
+    def PAPER_CACHE_TTL(self) -> float:
+        return 60.0 * 60.0
+
+    @property
+    def SOCKET_TIMEOUT(self) -> float:
+        # a redis that stops answering fails the command instead of hanging it
+        return 5.0
+
     def create_connection(self) -> redis.Redis:
         return redis.StrictRedis(
             host=self.HOST,
             port=self.PORT,
             db=self.DB,
-            charset='utf-8',
+            encoding='utf-8',
             decode_responses=True,
+            socket_connect_timeout=self.CONNECT_TIMEOUT,
+            socket_timeout=self.SOCKET_TIMEOUT,
         )
 
+    def create_async_connection(self) -> redis.asyncio.Redis:
+        return redis.asyncio.StrictRedis(
+            host=self.HOST,
+            port=self.PORT,
+            db=self.DB,
+            encoding='utf-8',
+            decode_responses=True,
+            socket_connect_timeout=self.CONNECT_TIMEOUT,
+            socket_timeout=self.SOCKET_TIMEOUT,
+        )
+
+    @property
+    def HYDRATION_CHUNK_SIZE(self) -> int:
+        return 500
+
+    @property
+    def MAX_BULK_PAPERS(self) -> int:
+        return 1000
+
 
 BlastServiceConfig = _BlastServiceConfig()
 PostgresServiceConfig = _PostgresServiceConfig()
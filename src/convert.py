@@ -1,15 +1,22 @@
 import abc
+import contextlib
 import csv
+import hashlib
+import json
 import logging
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional, TextIO
+from typing import Dict, List, Optional, TextIO, Tuple
 
 import click
 from git import Repo
 
+import compression
 import config
+import idstore
 import processing
+import records
 
 
 logging.basicConfig(format=config.LOG_FORMAT, level=logging.DEBUG)
@@ -18,35 +25,69 @@ logger = logging.getLogger(__name__)
 
 class Converter(abc.ABC):
     def __init__(
-        self, output_path: Path, clean_folder: bool, max_elements_per_file: int
+        self,
+        output_path: Path,
+        clean_folder: bool,
+        max_elements_per_file: int,
+        codec: str,
     ):
         super().__init__()
         # self._service_config must be set by the implementation class
         self.output_path = output_path / self._service_config.FOLDER_NAME
         clean_folder_maybe(self.output_path, clean_folder)
+        self._manifest_path = (
+            self.output_path / self._service_config.MANIFEST_FOLDER_NAME
+        )
+        self._manifest_path.mkdir(exist_ok=True)
         self._max_elements_in_file = max_elements_per_file
+        self._codec = codec
         self._file_index = None  # type: int
         self._current_year = None  # type: str
+        self._current_fingerprint = None  # type: Dict
         self._n_elements_in_file = None  # type: int
         self._is_first_line = None  # type: bool
         self._is_skipping_file = None  # type: bool
-        self._skipped_once = False
+        # maps each converted year to the fingerprint of the input it came from
+        self._manifest = self._read_manifest()  # type: Dict[str, Dict]
+        self._converted_years = []  # type: List[str]
 
-    def input_file_opened(self, year: str) -> None:
+    def input_file_opened(
+        self, year: str, input_hash: str, category_prefixes: Tuple[str, ...]
+    ) -> None:
         self._file_index = 1
         self._n_elements_in_file = 0
         self._current_year = year
-        self._is_skipping_file = self._output_file_path.exists()
-        if self._is_skipping_file:
-            self._skipped_once = True
-        else:
+        self._current_fingerprint = dict(
+            input_hash=input_hash,
+            max_elements_per_file=self._max_elements_in_file,
+            category_prefixes=sorted(category_prefixes),
+        )
+        self._is_skipping_file = self._is_up_to_date()
+        if not self._is_skipping_file:
+            self._remove_outputs_of_year()
             self._open_output_file()
 
+    @property
+    def is_skipping_file(self) -> bool:
+        return self._is_skipping_file
+
+    def _is_up_to_date(self) -> bool:
+        return (
+            self._manifest.get(self._current_year) == self._current_fingerprint
+            and self._output_file_path.exists()
+        )
+
+    def _remove_outputs_of_year(self) -> None:
+        # a changed input can produce fewer files than before, or other suffixes
+        output_glob = f'{self._current_year}_*.{self._service_config.FILE_EXTENSION}*'
+        [p.unlink() for p in self.output_path.glob(output_glob)]
+
     @property
     def _output_file_path(self) -> Path:
         return self.output_path / (
             f'{self._current_year}_{self._file_index}'
             + f'.{self._service_config.FILE_EXTENSION}'
+            + compression.SUFFIXES[self._codec]
         )
 
     @abc.abstractmethod
@@ -65,6 +106,9 @@ class Converter(abc.ABC):
 
         self._handle_fields(fields)
 
+    def handle_lines(self, fields_list: List[List[str]]) -> None:
+        [self.handle_line(fields) for fields in fields_list]
+
     @abc.abstractmethod
     def _handle_fields(self, fields: List[str]) -> None:
         pass
@@ -73,6 +117,8 @@ class Converter(abc.ABC):
         if self._is_skipping_file:
             return
         self._close_file()
+        self._manifest[self._current_year] = self._current_fingerprint
+        self._converted_years.append(self._current_year)
 
     def _close_output_file(self) -> None:
         if self._is_skipping_file:
@@ -87,21 +133,57 @@ class Converter(abc.ABC):
     def post_conversion(self) -> None:
         pass
 
+    def get_state(self) -> Dict:
+        # only the years converted here, a worker's view of the others is outdated
+        return dict(manifest={y: self._manifest[y] for y in self._converted_years})
+
+    def merge_state(self, state: Dict) -> None:
+        self._manifest.update(state['manifest'])
+
+    def _read_manifest(self) -> Dict[str, Dict]:
+        manifest_file_path = (
+            self._manifest_path / self._service_config.MANIFEST_FILE_NAME
+        )
+        if not manifest_file_path.exists():
+            return dict()
+        with open(str(manifest_file_path), 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    def write_manifest(self) -> None:
+        manifest_file_path = (
+            self._manifest_path / self._service_config.MANIFEST_FILE_NAME
+        )
+        temporary_file_path = manifest_file_path.with_suffix('.tmp')
+        with open(str(temporary_file_path), 'w') as manifest_file:
+            json.dump(self._manifest, manifest_file, indent=2, sort_keys=True)
+        temporary_file_path.replace(manifest_file_path)
+
 
 class BlastConverter(Converter):
     def __init__(
-        self, output_path_base: Path, clean_folder: bool, max_elements_per_file: int
+        self,
+        output_path_base: Path,
+        clean_folder: bool,
+        max_elements_per_file: int,
+        codec: str,
     ):
         # set it here so the type is correctly recognized
         self._service_config = config.BlastServiceConfig
-        super().__init__(output_path_base, clean_folder, max_elements_per_file)
+        super().__init__(output_path_base, clean_folder, max_elements_per_file, codec)
         self._current_file = None  # type: TextIO
+        self._clean_titles = dict()  # type: Dict[str, str]
 
     def _open_output_file(self) -> None:
         self._is_first_line = True
-        self._current_file = open(str(self._output_file_path), 'w')
+        self._current_file = compression.open_file(self._output_file_path, 'w')
         self._current_file.write(self._service_config.FILE_START)
 
+    def handle_lines(self, fields_list: List[List[str]]) -> None:
+        titles = [fields[config.InputConfig.TITLE_INDEX] for fields in fields_list]
+        self._clean_titles = dict(zip(titles, processing.clean_titles(titles)))
+        super().handle_lines(fields_list)
+        self._clean_titles = dict()
+
     def _handle_fields(self, fields: List[str]) -> None:
         document = self._convert_to_document(fields)
         self._current_file.write(document)
@@ -110,7 +192,10 @@ class BlastConverter(Converter):
     def _convert_to_document(self, fields: List[str]) -> str:
         paper_id = processing.clean_id(fields[config.InputConfig.ID_INDEX])
         authors = processing.clean_authors(fields[config.InputConfig.AUTHORS_INDEX])
-        title = processing.clean_title(fields[config.InputConfig.TITLE_INDEX])
+        title = fields[config.InputConfig.TITLE_INDEX]
+        title = self._clean_titles.get(title)
+        if title is None:
+            title = processing.clean_title(fields[config.InputConfig.TITLE_INDEX])
         document = self._service_config.FILE_ENTRY(
             self._is_first_line, paper_id, self._current_year, authors, title
         )
@@ -127,18 +212,32 @@ class BlastConverter(Converter):
 
 class PostgresConverter(Converter):
     def __init__(
-        self, output_path_base: Path, clean_folder: bool, max_elements_per_file: int
+        self,
+        output_path_base: Path,
+        clean_folder: bool,
+        max_elements_per_file: int,
+        codec: str,
     ):
         # set it here so the type is correctly recognized
         self._service_config = config.PostgresServiceConfig
-        super().__init__(output_path_base, clean_folder, max_elements_per_file)
+        super().__init__(output_path_base, clean_folder, max_elements_per_file, codec)
         self._current_file = None  # type: TextIO
-        self._ids = set()
+        self._year_ids = idstore.IdStore(
+            self._manifest_path, self._service_config.ID_STORE_MAX_SIZE
+        )
+
+    def _is_up_to_date(self) -> bool:
+        return super()._is_up_to_date() and self._year_ids_file_path.exists()
+
+    @property
+    def _year_ids_file_path(self) -> Path:
+        return self._manifest_path / self._service_config.YEAR_IDS_FILE_NAME(
+            self._current_year
+        )
 
     def _open_output_file(self) -> None:
         self._is_first_line = True
-        self._current_file = open(str(self._output_file_path), 'w')
-        self._current_file.write(self._service_config.INSERT_INTO_REFS_START)
+        self._current_file = compression.open_file(self._output_file_path, 'w')
 
     def _handle_fields(self, fields: List[str]) -> None:
         document = self._convert_to_document(fields)
@@ -153,51 +252,73 @@ class PostgresConverter(Converter):
         if len(refs) == 1 and refs[0] == '':
             return None
 
-        self._ids.add(paper_id)
-        [self._ids.add(r) for r in refs]
-        document = self._service_config.INSERT_INTO_REFS_ENTRY(
-            self._is_first_line, paper_id, refs
-        )
+        # a duplicate row would violate the primary key and abort the whole COPY
+        refs = list(dict.fromkeys(refs))
+        self._year_ids.add(paper_id)
+        self._year_ids.update(refs)
+        document = ''.join([self._service_config.COPY_ROW(paper_id, r) for r in refs])
         return document
 
     def _close_file(self) -> None:
-        self._current_file.write(self._service_config.INSERT_INTO_REFS_END)
         self._current_file.close()
 
+    def input_file_closed(self) -> None:
+        if not self._is_skipping_file:
+            # persisted per year, so papers.tsv can be rebuilt when years are skipped
+            self._year_ids.write(self._year_ids_file_path)
+            self._year_ids.clear()
+        super().input_file_closed()
+
     def post_conversion(self) -> None:
-        if self._skipped_once:
-            logger.warning(
-                'Skipping post conversion for postgres because'
-                + 'at least one input file was skipped.'
-            )
-            return
         create_tables_file_path = (
             self.output_path / self._service_config.CREATE_TABLE_FILE_NAME
         )
         with open(str(create_tables_file_path), 'w') as create_tables_file:
             create_tables_file.write(config.PostgresServiceConfig.CREATE_TABLES_SQL)
 
-        insert_into_papers_file_path = (
-            self.output_path / self._service_config.INSERT_INTO_PAPERS_FILE_NAME
-        )
-        with open(str(insert_into_papers_file_path), 'w') as insert_into_papers_file:
-            document = config.PostgresServiceConfig.INSERT_INTO_PAPERS_SQL(self._ids)
-            insert_into_papers_file.write(document)
+        year_ids_file_paths = [
+            self._manifest_path / self._service_config.YEAR_IDS_FILE_NAME(year)
+            for year in sorted(self._manifest.keys())
+        ]
+        papers_file_path = self.output_path / self._service_config.PAPERS_FILE_NAME
+        # only one variant may exist, or the loader could pick an outdated one
+        [
+            compression.with_codec(papers_file_path, codec).unlink()
+            for codec in compression.SUFFIXES
+            if compression.with_codec(papers_file_path, codec).exists()
+        ]
+        papers_file_path = compression.with_codec(papers_file_path, self._codec)
+        with contextlib.ExitStack() as stack:
+            year_ids_files = [
+                stack.enter_context(open(str(p))) for p in year_ids_file_paths
+            ]
+            papers_file = stack.enter_context(
+                compression.open_file(papers_file_path, 'w')
+            )
+            for line in idstore.merge_unique(year_ids_files):
+                papers_file.write(self._service_config.COPY_ROW(line[:-1]))
 
 
 class RedisConverter(Converter):
     def __init__(
-        self, output_path_base: Path, clean_folder: bool, max_elements_per_file: int
+        self,
+        output_path_base: Path,
+        clean_folder: bool,
+        max_elements_per_file: int,
+        codec: str,
     ):
         # set it here so the type is correctly recognized
         self._service_config = config.RedisServiceConfig
-        super().__init__(output_path_base, clean_folder, max_elements_per_file)
+        super().__init__(output_path_base, clean_folder, max_elements_per_file, codec)
+        self._current_file = None  # type: TextIO
         self._writer = None  # type: csv.writer
 
     def _open_output_file(self) -> None:
         self._is_first_line = True
-        output_file = open(str(self._output_file_path), 'w', newline='')
-        self._writer = csv.writer(output_file)
+        self._current_file = compression.open_file(
+            self._output_file_path, 'w', newline=''
+        )
+        self._writer = csv.writer(self._current_file)
 
     def _handle_fields(self, fields: List[str]) -> None:
         document = self._convert_to_document(fields)
@@ -214,7 +335,7 @@ class RedisConverter(Converter):
         return document
 
     def _close_file(self) -> None:
-        pass
+        self._current_file.close()
 
     def post_conversion(self) -> None:
         pass
@@ -234,11 +355,31 @@ def clean_folder_maybe(path: Path, clean_folder: bool, recreate: bool = True) ->
 @click.option('--max-n-files', '-mnf', type=int, default=5)
 @click.option('--clean-input/--no-clean-input', '-ci/-nci', default=False)
 @click.option('--clean-output/--no-clean-output', '-co/-nco', default=False)
+@click.option('--workers', '-w', type=int, default=1)
+@click.option(
+    '--compression',
+    '-c',
+    'codec',
+    type=click.Choice(['auto', *compression.SUFFIXES]),
+    default=config.CompressionConfig.CODEC,
+    show_default=True,
+)
+@click.option(
+    '--category-prefix',
+    '-cp',
+    'category_prefixes',
+    multiple=True,
+    default=config.InputConfig.CATEGORY_PREFIXES,
+    show_default=True,
+)
 def main(
     max_elements_per_file: int,
     max_n_files: Optional[int],
     clean_input: bool = False,
     clean_output: bool = False,
+    workers: int = 1,
+    category_prefixes: Tuple[str, ...] = config.InputConfig.CATEGORY_PREFIXES,
+    codec: str = config.CompressionConfig.CODEC,
 ) -> None:
     base_path = Path('data')
     input_path = base_path / config.InputConfig.INPUT_FOLDER_NAME
@@ -246,44 +387,110 @@ def main(
     clone_repo(input_path)
 
     output_path_base = base_path / 'output_for'
-    converters = [
-        BlastConverter(output_path_base, clean_output, max_elements_per_file),
-        RedisConverter(output_path_base, clean_output, max_elements_per_file),
-        PostgresConverter(output_path_base, clean_output, max_elements_per_file),
-    ]
+    # resolved once, so all workers write the same format
+    codec = compression.resolve_codec(codec)
+    converters = create_converters(
+        output_path_base, clean_output, max_elements_per_file, codec
+    )
 
-    n_total_elements = 0
     input_file_paths = input_path.glob(config.InputConfig.FILE_GLOB)
     input_file_paths = sorted(input_file_paths, reverse=True)
-    for index, input_file_path in enumerate(input_file_paths):
-        if max_n_files is not None and index >= max_n_files:
-            break
-
-        logging.info(f'Converting {input_file_path.name}...')
-        year = input_file_path.name[5:9]
-        with open(str(input_file_path), 'r') as input_file:
-            n_elements_in_file = 0
-
-            [c.input_file_opened(year) for c in converters]
+    if max_n_files is not None:
+        input_file_paths = input_file_paths[:max_n_files]
+
+    if workers > 1:
+        # every year goes to its own output files, so years can be converted
+        # independently and only the converter state has to be merged afterwards
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _convert_file_in_worker,
+                input_file_paths,
+                [output_path_base] * len(input_file_paths),
+                [max_elements_per_file] * len(input_file_paths),
+                [category_prefixes] * len(input_file_paths),
+                [codec] * len(input_file_paths),
+            )
+            results = list(results)
+        for _, states in results:
+            [c.merge_state(state) for c, state in zip(converters, states)]
+        n_total_elements = sum(n_elements for n_elements, _ in results)
+    else:
+        n_total_elements = sum(
+            convert_file(input_file_path, converters, category_prefixes)
+            for input_file_path in input_file_paths
+        )
 
-            for line in input_file:
-                line_clean = line.strip()
-                if line_clean.startswith('#'):
-                    continue
+    [c.post_conversion() for c in converters]
+    [c.write_manifest() for c in converters]
+    logging.info(f'N elements converted in total: {n_total_elements}')
 
-                fields = line.split(';', config.InputConfig.N_MAX_SPLITS)
-                categories = fields[config.InputConfig.CATEGORIES_INDEX].split(',')
-                if any([c.startswith('cs.') for c in categories]):
-                    n_elements_in_file += 1
-                    [c.handle_line(fields) for c in converters]
 
-            [c.input_file_closed() for c in converters]
+def create_converters(
+    output_path_base: Path, clean_output: bool, max_elements_per_file: int, codec: str
+) -> List[Converter]:
+    return [
+        BlastConverter(output_path_base, clean_output, max_elements_per_file, codec),
+        RedisConverter(output_path_base, clean_output, max_elements_per_file, codec),
+        PostgresConverter(output_path_base, clean_output, max_elements_per_file, codec),
+    ]
 
-            logging.info(f'N elements converted: {n_elements_in_file}')
-            n_total_elements += n_elements_in_file
 
-    [c.post_conversion() for c in converters]
-    logging.info(f'N elements converted in total: {n_total_elements}')
+def convert_file(
+    input_file_path: Path,
+    converters: List[Converter],
+    category_prefixes: Tuple[str, ...],
+) -> int:
+    logging.info(f'Converting {input_file_path.name}...')
+    year = input_file_path.name[5:9]
+    input_hash = hash_file(input_file_path)
+    [c.input_file_opened(year, input_hash, category_prefixes) for c in converters]
+    if all([c.is_skipping_file for c in converters]):
+        logging.info(f'{input_file_path.name} is unchanged, skipping')
+        return 0
+
+    with open(str(input_file_path), 'rb') as input_file:
+        n_elements_in_file = 0
+
+        batch = []
+        for fields in records.read_records(
+            input_file,
+            category_prefixes,
+            config.InputConfig.N_MAX_SPLITS,
+            config.InputConfig.READ_CHUNK_SIZE,
+        ):
+            n_elements_in_file += 1
+            batch.append(fields)
+            if len(batch) >= config.InputConfig.BATCH_SIZE:
+                [c.handle_lines(batch) for c in converters]
+                batch = []
+        [c.handle_lines(batch) for c in converters]
+
+        [c.input_file_closed() for c in converters]
+
+    logging.info(f'N elements converted: {n_elements_in_file}')
+    return n_elements_in_file
+
+
+def hash_file(file_path: Path) -> str:
+    file_hash = hashlib.sha256()
+    with open(str(file_path), 'rb') as file:
+        for chunk in iter(lambda: file.read(config.InputConfig.HASH_CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _convert_file_in_worker(
+    input_file_path: Path,
+    output_path_base: Path,
+    max_elements_per_file: int,
+    category_prefixes: Tuple[str, ...],
+    codec: str,
+) -> Tuple[int, List[Dict]]:
+    converters = create_converters(
+        output_path_base, False, max_elements_per_file, codec
+    )
+    n_elements = convert_file(input_file_path, converters, category_prefixes)
+    return n_elements, [c.get_state() for c in converters]
 
 
 def clone_repo(input_path: Path) -> None:
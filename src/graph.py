@@ -0,0 +1,96 @@
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+IDS_FILE_NAME = 'ids.npy'
+OUT_OFFSETS_FILE_NAME = 'out_offsets.npy'
+OUT_INDICES_FILE_NAME = 'out_indices.npy'
+IN_OFFSETS_FILE_NAME = 'in_offsets.npy'
+IN_INDICES_FILE_NAME = 'in_indices.npy'
+
+
+class CitationGraph:
+    # ids are a sorted fixed-width byte array, so looking up an id is a binary
+    # search over memory-mapped pages that all worker processes share
+    def __init__(self, path: Path):
+        self._ids = np.load(str(path / IDS_FILE_NAME), mmap_mode='r')
+        self._out_offsets = np.load(str(path / OUT_OFFSETS_FILE_NAME), mmap_mode='r')
+        self._out_indices = np.load(str(path / OUT_INDICES_FILE_NAME), mmap_mode='r')
+        self._in_offsets = np.load(str(path / IN_OFFSETS_FILE_NAME), mmap_mode='r')
+        self._in_indices = np.load(str(path / IN_INDICES_FILE_NAME), mmap_mode='r')
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (path / IDS_FILE_NAME).exists()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def references(
+        self, paper_id: str, after: str = '', limit: Optional[int] = None
+    ) -> List[str]:
+        return self._neighbors(
+            self._out_offsets, self._out_indices, paper_id, after, limit
+        )
+
+    def referenced_by(
+        self, paper_id: str, after: str = '', limit: Optional[int] = None
+    ) -> List[str]:
+        return self._neighbors(
+            self._in_offsets, self._in_indices, paper_id, after, limit
+        )
+
+    def _index(self, paper_id: str) -> Optional[int]:
+        key = paper_id.encode()
+        index = int(np.searchsorted(self._ids, key))
+        if index < len(self._ids) and self._ids[index] == key:
+            return index
+        return None
+
+    def _neighbors(
+        self,
+        offsets: np.ndarray,
+        indices: np.ndarray,
+        paper_id: str,
+        after: str,
+        limit: Optional[int],
+    ) -> List[str]:
+        index = self._index(paper_id)
+        if index is None:
+            return []
+
+        start, end = offsets[index], offsets[index + 1]
+        row = indices[start:end]
+        if after != '':
+            first_index = np.searchsorted(self._ids, after.encode(), side='right')
+            start = np.searchsorted(row, first_index)
+            row = row[start:]
+        if limit is not None:
+            row = row[:limit]
+        return [i.decode() for i in self._ids[row]]
+
+
+def build(
+    path: Path, ids: np.ndarray, referencers: np.ndarray, referencees: np.ndarray
+) -> None:
+    # ids must be sorted, the edges are given as indices into them
+    path.mkdir(exist_ok=True, parents=True)
+    out_offsets, out_indices = _to_csr(referencers, referencees, len(ids))
+    in_offsets, in_indices = _to_csr(referencees, referencers, len(ids))
+    np.save(str(path / IDS_FILE_NAME), ids)
+    np.save(str(path / OUT_OFFSETS_FILE_NAME), out_offsets)
+    np.save(str(path / OUT_INDICES_FILE_NAME), out_indices)
+    np.save(str(path / IN_OFFSETS_FILE_NAME), in_offsets)
+    np.save(str(path / IN_INDICES_FILE_NAME), in_indices)
+
+
+def _to_csr(
+    rows: np.ndarray, columns: np.ndarray, n_rows: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.lexsort((columns, rows))
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=offsets[1:])
+    indices = columns[order].astype(np.int32)
+    return offsets, indices
@@ -0,0 +1,61 @@
+import heapq
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+
+class IdStore:
+    # holds at most max_size ids in memory, everything beyond that is spilled to
+    # sorted run files which are merged and deduplicated while iterating
+    def __init__(self, folder: Path, max_size: int):
+        self._folder = folder
+        self._max_size = max_size
+        self._ids = set()
+        self._run_file_paths = []  # type: List[Path]
+
+    def add(self, paper_id: str) -> None:
+        self._ids.add(paper_id)
+        if len(self._ids) >= self._max_size:
+            self._spill()
+
+    def update(self, paper_ids: Iterable[str]) -> None:
+        [self.add(paper_id) for paper_id in paper_ids]
+
+    @property
+    def n_runs(self) -> int:
+        return len(self._run_file_paths)
+
+    def _spill(self) -> None:
+        file_descriptor, run_file_path = tempfile.mkstemp(
+            suffix='.run', dir=str(self._folder)
+        )
+        with open(file_descriptor, 'w') as run_file:
+            run_file.writelines([f'{i}\n' for i in sorted(self._ids)])
+        self._run_file_paths.append(Path(run_file_path))
+        self._ids = set()
+
+    def __iter__(self) -> Iterator[str]:
+        run_files = [open(str(p), 'r') for p in self._run_file_paths]
+        try:
+            runs = [(line[:-1] for line in f) for f in run_files]
+            yield from merge_unique(runs + [sorted(self._ids)])
+        finally:
+            [f.close() for f in run_files]
+
+    def write(self, file_path: Path) -> None:
+        with open(str(file_path), 'w') as file:
+            file.writelines(f'{i}\n' for i in self)
+
+    def clear(self) -> None:
+        [os.remove(str(p)) for p in self._run_file_paths]
+        self._run_file_paths = []
+        self._ids = set()
+
+
+def merge_unique(sorted_iterables: List[Iterable[str]]) -> Iterator[str]:
+    previous = None
+    for value in heapq.merge(*sorted_iterables):
+        if value != previous:
+            yield value
+            previous = value
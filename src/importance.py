@@ -0,0 +1,49 @@
+from typing import NamedTuple
+
+import numpy as np
+
+
+class CitationMetrics(NamedTuple):
+    references_n: np.ndarray
+    referenced_by_n: np.ndarray
+    pagerank: np.ndarray
+    n_iterations: int
+
+
+def compute(
+    n_papers: int,
+    referencers: np.ndarray,
+    referencees: np.ndarray,
+    damping: float,
+    tolerance: float,
+    max_iterations: int,
+) -> CitationMetrics:
+    # the edges are given as indices into the papers, a reference passes on the
+    # importance of the referencing paper to the referenced one
+    references_n = np.bincount(referencers, minlength=n_papers)
+    referenced_by_n = np.bincount(referencees, minlength=n_papers)
+    if n_papers == 0:
+        return CitationMetrics(references_n, referenced_by_n, np.zeros(0), 0)
+
+    is_dangling = references_n == 0
+    inverse_references_n = np.zeros(n_papers)
+    inverse_references_n[~is_dangling] = 1.0 / references_n[~is_dangling]
+
+    pagerank = np.full(n_papers, 1.0 / n_papers)
+    n_iterations = 0
+    while n_iterations < max_iterations:
+        n_iterations += 1
+        # papers without references spread their importance over all papers
+        dangling_rank = pagerank[is_dangling].sum()
+        # every edge passes on its share, summed per referenced paper
+        shares = (pagerank * inverse_references_n)[referencers]
+        next_pagerank = damping * np.bincount(
+            referencees, weights=shares, minlength=n_papers
+        )
+        next_pagerank += (damping * dangling_rank + 1.0 - damping) / n_papers
+        error = np.abs(next_pagerank - pagerank).sum()
+        pagerank = next_pagerank
+        if error < tolerance:
+            break
+
+    return CitationMetrics(references_n, referenced_by_n, pagerank, n_iterations)
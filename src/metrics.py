@@ -0,0 +1,55 @@
+from typing import Any, Dict, Tuple
+
+import prometheus_client
+
+import config
+
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+REQUEST_SECONDS = prometheus_client.Histogram(
+    'api_request_seconds',
+    'Time spent handling a request',
+    ['endpoint'],
+    buckets=config.MetricsConfig.LATENCY_BUCKETS,
+)
+BACKEND_SECONDS = prometheus_client.Histogram(
+    'api_backend_seconds',
+    'Time spent in a backend while handling a request',
+    ['endpoint', 'backend'],
+    buckets=config.MetricsConfig.LATENCY_BUCKETS,
+)
+REQUESTS = prometheus_client.Counter(
+    'api_requests', 'Handled requests', ['endpoint', 'status']
+)
+
+
+# labels() locks and validates on every call, the children never change
+_children: Dict[Tuple, Any] = dict()
+
+
+def observe(
+    endpoint: str, status: int, duration: float, timings: Dict[str, float]
+) -> None:
+    _child(REQUEST_SECONDS, endpoint).observe(duration)
+    _child(REQUESTS, endpoint, str(status)).inc()
+    for backend, backend_duration in timings.items():
+        _child(BACKEND_SECONDS, endpoint, backend).observe(backend_duration)
+
+
+def _child(metric: Any, *labels: str) -> Any:
+    key = (metric,) + labels
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def server_timing(duration: float, timings: Dict[str, float]) -> str:
+    # https://www.w3.org/TR/server-timing/, durations are in milliseconds
+    entries = [f'{b};dur={d * 1000:.2f}' for b, d in timings.items()]
+    entries.append(f'total;dur={duration * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def latest() -> bytes:
+    return prometheus_client.generate_latest()
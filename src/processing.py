@@ -1,12 +1,38 @@
+import functools
+import os
 import re
+from typing import TYPE_CHECKING, Iterable, List, Tuple
 
-import nltk
 
+if TYPE_CHECKING:
+    import nltk
+
+
+STEM_CACHE_SIZE = 2 ** 16
 
 pattern_alpha = re.compile(r'[^a-zA-Z ]+')
+pattern_alpha_lines = re.compile(r'[^a-zA-Z \n]+')
 pattern_alphanumeric = re.compile(r'[\W]+')
-stop_words = set(nltk.corpus.stopwords.words('english'))
-stemmer = nltk.stem.SnowballStemmer('english')
+# nltk's english stop words, shipped so no corpus has to be downloaded or loaded
+stop_words = frozenset(
+    (
+        "a about above after again against ain all am an and any are aren "
+        + "aren't as at be because been before being below between both but by "
+        + "can couldn couldn't d did didn didn't do does doesn doesn't doing "
+        + "don don't down during each few for from further had hadn hadn't has "
+        + "hasn hasn't have haven haven't having he her here hers herself him "
+        + "himself his how i if in into is isn isn't it it's its itself just ll "
+        + "m ma me mightn mightn't more most mustn mustn't my myself needn "
+        + "needn't no nor not now o of off on once only or other our ours "
+        + "ourselves out over own re s same shan shan't she she's should "
+        + "should've shouldn shouldn't so some such t than that that'll the "
+        + "their theirs them themselves then there these they this those "
+        + "through to too under until up ve very was wasn wasn't we were weren "
+        + "weren't what when where which while who whom why will with won won't "
+        + "wouldn wouldn't y you you'd you'll you're you've your yours yourself "
+        + "yourselves"
+    ).split()
+)
 
 
 def clean_field(s: str) -> str:
@@ -26,18 +52,87 @@ def clean_authors(s: str) -> str:
 
 
 def clean_title(s: str, min_title_word_length: int = 3) -> str:
-    s = clean_query(s)
-    s = ' '.join(
-        [w for w in s.split() if w not in stop_words and len(w) > min_title_word_length]
-    )
-    return s
+    return _clean_normalized_title(_normalize(s), min_title_word_length)
+
+
+def clean_titles(strings: Iterable[str], min_title_word_length: int = 3) -> List[str]:
+    return [
+        _clean_normalized_title(s, min_title_word_length)
+        for s in _normalize_all(strings)
+    ]
 
 
 def clean_query(s: str) -> str:
+    return _clean_normalized_query(_normalize(s))
+
+
+def clean_typeahead_query(s: str, min_title_word_length: int = 3) -> Tuple[str, str]:
+    # the last word is still being typed unless the query ends with a separator,
+    # it is kept as a prefix that also matches its own stem, the finished words
+    # are cleaned like titles, a required stop word would never match a title
+    words = _normalize(s).split()
+    if len(words) == 0 or not s[-1:].isalpha():
+        return _clean_normalized_title(' '.join(words), min_title_word_length), ''
+    prefix = os.path.commonprefix([words[-1], stem(words[-1])])
+    query = _clean_normalized_title(' '.join(words[:-1]), min_title_word_length)
+    return query, prefix
+
+
+def clean_queries(strings: Iterable[str]) -> List[str]:
+    return [_clean_normalized_query(s) for s in _normalize_all(strings)]
+
+
+def _clean_normalized_title(s: str, min_title_word_length: int) -> str:
+    s = [_title_stem(w, min_title_word_length) for w in s.split()]
+    s = ' '.join([w for w in s if w != ''])
+    return s
+
+
+def _clean_normalized_query(s: str) -> str:
+    s = [stem(w) for w in s.split()]
+    s = ' '.join(s)
+    return s
+
+
+@functools.lru_cache(maxsize=None)
+def get_stemmer() -> 'nltk.stem.SnowballStemmer':
+    # importing nltk takes most of a second, so it happens on first use or warm_up
+    import nltk
+
+    return nltk.stem.SnowballStemmer('english')
+
+
+def warm_up() -> None:
+    stem('warm')
+
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word: str) -> str:
+    return get_stemmer().stem(word)
+
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def _title_stem(word: str, min_title_word_length: int) -> str:
+    # an empty string marks a stem that is dropped from titles
+    s = stem(word)
+    if s in stop_words or len(s) <= min_title_word_length:
+        return ''
+    return s
+
+
+def _normalize(s: str) -> str:
     s = clean_field(s)
     s = s.lower()
     s = pattern_alpha.sub(' ', s)
-
-    s = [stemmer.stem(w) for w in s.split()]
-    s = ' '.join(s)
     return s
+
+
+def _normalize_all(strings: Iterable[str]) -> List[str]:
+    # one lower() and one regex pass over all strings joined by newlines
+    strings = [clean_field(s).replace('\n', ' ') for s in strings]
+    if len(strings) == 0:
+        return []
+    s = '\n'.join(strings)
+    s = s.lower()
+    s = pattern_alpha_lines.sub(' ', s)
+    return s.split('\n')
@@ -0,0 +1,64 @@
+import itertools
+import re
+from typing import BinaryIO, Iterator, List, Pattern, Sequence, Tuple
+
+
+# a category starts after the first semicolon or after a comma
+SEPARATORS = b';,'
+
+
+def read_records(
+    input_file: BinaryIO,
+    category_prefixes: Sequence[str],
+    n_max_splits: int,
+    chunk_size: int,
+) -> Iterator[List[str]]:
+    # the file is scanned in large binary chunks for the prefixes, only lines
+    # where a prefix starts one of the categories, the second field, are decoded
+    # and split, every other line is skipped without touching it in python
+    # one plain literal each, so the regex engine uses its fast substring search
+    patterns = [re.compile(re.escape(p.encode())) for p in set(category_prefixes)]
+    is_keeping_all = '' in category_prefixes
+
+    rest = b''
+    while True:
+        chunk = input_file.read(chunk_size)
+        is_eof = len(chunk) == 0
+        chunk = rest + chunk
+        end = len(chunk) if is_eof else chunk.rfind(b'\n') + 1
+        if is_keeping_all:
+            for line in chunk[:end].split(b'\n'):
+                if line.count(b';') >= 2 and not line.startswith(b'#'):
+                    yield line.decode().split(';', n_max_splits)
+        else:
+            lines = [_matching_lines(chunk, end, p) for p in patterns]
+            if len(lines) > 1:
+                # a line can match several prefixes but is kept once and in order
+                lines = [sorted(set(itertools.chain(*lines)))]
+            for start, line_end in lines[0]:
+                yield chunk[start:line_end].decode().split(';', n_max_splits)
+        if is_eof:
+            break
+        rest = chunk[end:]
+
+
+def _matching_lines(
+    chunk: bytes, end: int, pattern: Pattern[bytes]
+) -> Iterator[Tuple[int, int]]:
+    match = pattern.search(chunk, 0, end)
+    while match is not None:
+        position = match.start()
+        start = chunk.rfind(b'\n', 0, position) + 1
+        line_end = chunk.find(b'\n', position, end)
+        line_end = end if line_end == -1 else line_end
+        first = chunk.find(b';', start, line_end)
+        second = chunk.find(b';', first + 1, line_end) if first != -1 else -1
+        if chunk.startswith(b'#', start) or second == -1 or position > second:
+            # a comment, or the prefix appeared after the categories
+            match = pattern.search(chunk, line_end + 1, end)
+        elif position > first and chunk[position - 1] in SEPARATORS:
+            yield start, line_end
+            match = pattern.search(chunk, line_end + 1, end)
+        else:
+            # inside a category or the id, e.g. cs. in physics.optics
+            match = pattern.search(chunk, position + 1, end)
@@ -0,0 +1,194 @@
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+IDS_FILE_NAME = 'ids.npy'
+TERMS_FILE_NAME = 'terms.npy'
+OFFSETS_FILE_NAME = 'offsets.npy'
+POSTINGS_FILE_NAME = 'postings.npy'
+WEIGHTS_FILE_NAME = 'weights.npy'
+REFERENCED_BY_N_FILE_NAME = 'referenced_by_n.npy'
+FIELD_NAMES = ('year', 'authors', 'title')
+BM25_K1 = 1.2
+BM25_B = 0.75
+# a short prefix is only expanded to its most frequent completions
+MAX_PREFIX_EXPANSIONS = 200
+
+# matching documents, their weights and whether they matched a prefix exactly
+Row = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class SearchIndex:
+    # terms are a sorted fixed-width byte array and the postings of every term
+    # are sorted document indices, so a query is a chain of binary searches over
+    # memory-mapped pages, starting from the rarest term
+    def __init__(self, path: Path):
+        self._ids = np.load(str(path / IDS_FILE_NAME), mmap_mode='r')
+        self._terms = np.load(str(path / TERMS_FILE_NAME), mmap_mode='r')
+        self._offsets = np.load(str(path / OFFSETS_FILE_NAME), mmap_mode='r')
+        self._postings = np.load(str(path / POSTINGS_FILE_NAME), mmap_mode='r')
+        self._weights = np.load(str(path / WEIGHTS_FILE_NAME), mmap_mode='r')
+        self._referenced_by_n = np.load(
+            str(path / REFERENCED_BY_N_FILE_NAME), mmap_mode='r'
+        )
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (path / IDS_FILE_NAME).exists()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def search(
+        self, terms: List[str], size: int, prefix: str = ''
+    ) -> Tuple[List[str], int]:
+        # every term is required and the prefix has to start one of the terms of a
+        # document, exact matches of the prefix come first, then the summed BM25
+        # weights boosted by how often a document is referenced
+        rows = [self._row(term) for term in dict.fromkeys(terms)]
+        if prefix != '':
+            rows.append(self._prefix_row(prefix))
+        if len(rows) == 0 or any([row is None for row in rows]):
+            return [], 0
+
+        rows.sort(key=lambda row: len(row[0]))
+        documents, scores, is_exact = [np.asarray(a) for a in rows[0]]
+        scores = scores.astype(np.float64)
+        for row_documents, row_weights, row_is_exact in rows[1:]:
+            positions = np.searchsorted(row_documents, documents)
+            positions = np.minimum(positions, len(row_documents) - 1)
+            is_match = row_documents[positions] == documents
+            positions = positions[is_match]
+            documents = documents[is_match]
+            scores = scores[is_match] + row_weights[positions]
+            is_exact = is_exact[is_match] & row_is_exact[positions]
+
+        scores *= 1.0 + np.log1p(self._referenced_by_n[documents])
+        # lifting exact matches above every other score keeps a single sort key
+        ranks = scores + is_exact * (scores.max(initial=0.0) + 1.0)
+        n_hits = len(documents)
+        top = np.arange(n_hits)
+        if size < n_hits:
+            top = np.argpartition(-ranks, size - 1)[:size]
+        top = top[np.lexsort((documents[top], -ranks[top]))]
+        return [i.decode() for i in self._ids[documents[top]]], n_hits
+
+    def _row(self, term: str) -> Optional[Row]:
+        key = term.encode()
+        index = int(np.searchsorted(self._terms, key))
+        if index == len(self._terms) or self._terms[index] != key:
+            return None
+        return self._row_at(index, True)
+
+    def _prefix_row(self, prefix: str) -> Optional[Row]:
+        # utf-8 never contains 0xff, so it sorts after every completion of the key
+        key = prefix.encode()
+        first_index = int(np.searchsorted(self._terms, key))
+        end_index = int(np.searchsorted(self._terms, key + b'\xff'))
+        if first_index == end_index:
+            return None
+
+        indices = np.arange(first_index, end_index)
+        if len(indices) > MAX_PREFIX_EXPANSIONS:
+            frequencies = self._offsets[indices + 1] - self._offsets[indices]
+            most_frequent = np.argpartition(-frequencies, MAX_PREFIX_EXPANSIONS - 1)
+            indices = indices[most_frequent[:MAX_PREFIX_EXPANSIONS]]
+
+        rows = [self._row_at(i, self._terms[i] == key) for i in indices]
+        documents = np.concatenate([documents for documents, _, _ in rows])
+        weights = np.concatenate([weights for _, weights, _ in rows])
+        is_exact = np.concatenate([is_exact for _, _, is_exact in rows])
+        order = np.argsort(documents, kind='stable')
+        documents, starts = np.unique(documents[order], return_index=True)
+        # a document counts with its best completion of the prefix
+        weights = np.maximum.reduceat(weights[order], starts)
+        is_exact = np.logical_or.reduceat(is_exact[order], starts)
+        return documents, weights, is_exact
+
+    def _row_at(self, index: int, is_exact: bool) -> Row:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return (
+            self._postings[start:end],
+            self._weights[start:end],
+            np.full(end - start, is_exact),
+        )
+
+
+def document_terms(fields: Dict[str, str]) -> List[str]:
+    return [term for name in FIELD_NAMES for term in str(fields.get(name, '')).split()]
+
+
+def build(
+    path: Path,
+    documents: Iterable[Tuple[str, Dict[str, str]]],
+    referenced_by_n: Optional[Dict[str, int]] = None,
+) -> None:
+    path.mkdir(exist_ok=True, parents=True)
+    referenced_by_n = dict() if referenced_by_n is None else referenced_by_n
+    ids = []
+    term_indices = dict()  # type: Dict[str, int]
+    posting_terms = array('l')
+    posting_documents = array('l')
+    posting_counts = array('l')
+    document_lengths = array('l')
+    for document_index, (paper_id, fields) in enumerate(documents):
+        ids.append(paper_id)
+        terms = [t.lower() for t in document_terms(fields)]
+        document_lengths.append(len(terms))
+        for term, count in Counter(terms).items():
+            posting_terms.append(term_indices.setdefault(term, len(term_indices)))
+            posting_documents.append(document_index)
+            posting_counts.append(count)
+
+    terms = np.array([t.encode() for t in term_indices], dtype='S')
+    term_order = np.argsort(terms, kind='stable')
+    term_ranks = np.empty(len(terms), dtype=np.int64)
+    term_ranks[term_order] = np.arange(len(terms))
+    posting_terms = term_ranks[np.frombuffer(posting_terms, dtype=np.int_)]
+    posting_documents = np.frombuffer(posting_documents, dtype=np.int_)
+    posting_counts = np.frombuffer(posting_counts, dtype=np.int_)
+    document_lengths = np.frombuffer(document_lengths, dtype=np.int_)
+
+    order = np.lexsort((posting_documents, posting_terms))
+    posting_terms = posting_terms[order]
+    posting_documents = posting_documents[order]
+    posting_counts = posting_counts[order]
+    document_frequencies = np.bincount(posting_terms, minlength=len(terms))
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(document_frequencies, out=offsets[1:])
+
+    mean_document_length = float(np.mean(document_lengths)) if len(ids) > 0 else 0.0
+    weights = _bm25_weights(
+        document_frequencies[posting_terms],
+        posting_counts,
+        document_lengths[posting_documents],
+        len(ids),
+        max(mean_document_length, 1.0),
+    )
+    np.save(str(path / IDS_FILE_NAME), np.array(ids, dtype='S'))
+    np.save(str(path / TERMS_FILE_NAME), terms[term_order])
+    np.save(str(path / OFFSETS_FILE_NAME), offsets)
+    np.save(str(path / POSTINGS_FILE_NAME), posting_documents.astype(np.int32))
+    np.save(str(path / WEIGHTS_FILE_NAME), weights.astype(np.float32))
+    np.save(
+        str(path / REFERENCED_BY_N_FILE_NAME),
+        np.array([referenced_by_n.get(i, 0) for i in ids], dtype=np.int32),
+    )
+
+
+def _bm25_weights(
+    document_frequencies: np.ndarray,
+    counts: np.ndarray,
+    document_lengths: np.ndarray,
+    n_documents: int,
+    mean_document_length: float,
+) -> np.ndarray:
+    idf = np.log1p(
+        (n_documents - document_frequencies + 0.5) / (document_frequencies + 0.5)
+    )
+    length_norm = 1 - BM25_B + BM25_B * document_lengths / mean_document_length
+    return idf * counts * (BM25_K1 + 1) / (counts + BM25_K1 * length_norm)
@@ -1,15 +1,39 @@
 import abc
+import collections
 import csv
+import itertools
+import json
 import logging
 import socket
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 import click
+import numpy as np
+import psycopg2.extensions
+import redis
 import requests
 
+import compression
 import config
+import graph
+import importance
+import search
 
 
 logging.basicConfig(format=config.LOG_FORMAT, level=logging.DEBUG)
@@ -22,8 +46,9 @@ def cli():
 
 
 class Setup(abc.ABC):
-    def __init__(self):
+    def __init__(self, workers: int = 1):
         # self._service_config must be set by the implementation class
+        self._workers = workers
         self._input_path, self._input_file_paths = self._get_paths()
         self._wait_until_open()
 
@@ -83,42 +108,135 @@ class Setup(abc.ABC):
         self._post_setup()
 
     def _do_work(self) -> None:
-        for input_file_path in self._input_file_paths:
-            start_time = time.time()
+        start_time = time.time()
+        input_file_paths = [
+            p
+            for p in self._input_file_paths
+            if compression.base_name(p) not in self._filename_skip_list
+        ]
+        if self._workers > 1:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                list(executor.map(self._timed_step, input_file_paths))
+        else:
+            [self._timed_step(p) for p in input_file_paths]
 
-            if input_file_path.name in self._filename_skip_list:
-                continue
+        end_time = time.time()
+        duration = end_time - start_time
+        logging.info(f'Time passed in total: {duration:.02f}')
+
+    def _timed_step(self, input_file_path: Path) -> None:
+        start_time = time.time()
 
-            self._log_filename(input_file_path)
-            self._step(input_file_path)
+        self._log_filename(input_file_path)
+        self._step(input_file_path)
 
-            end_time = time.time()
-            duration = end_time - start_time
-            logging.info(f'Time passed: {duration:.02f}')
+        end_time = time.time()
+        duration = end_time - start_time
+        logging.info(f'Time passed for {input_file_path.name}: {duration:.02f}')
 
     @staticmethod
     def _log_filename(filename: Path) -> None:
         logging.info(f'Reading {filename.name}...')
 
 
+class BulkReport(NamedTuple):
+    n_requests: int
+    n_failed_requests: int
+    n_entries: Optional[int]
+
+
 class SetupBlast(Setup):
-    def __init__(self):
+    def __init__(
+        self,
+        workers: int,
+        max_entries_per_request: Optional[int],
+        timeout: float,
+        max_retries: int,
+    ):
         # set it here so the type is correctly recognized
         self._service_config = config.BlastServiceConfig
-        super().__init__()
+        super().__init__(workers)
+        self._max_entries_per_request = max_entries_per_request
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._session = self._service_config.create_session()
+        self._redis_connection = config.RedisServiceConfig.create_connection()
+        self._reports: Dict[str, BulkReport] = dict()
 
     @property
     def _filename_skip_list(self) -> List[str]:
         return []
 
     def _step(self, file: Path) -> None:
-        response = requests.post(
-            self._service_config.POST_URL, data=open(str(file), 'rb')
-        )
-        logger.info(f'{response.status_code}: {response.content}')
+        if self._max_entries_per_request is None:
+            is_success = self._post(file.name, lambda: self._open_body(file))
+            self._reports[file.name] = BulkReport(1, 0 if is_success else 1, None)
+            return
+
+        n_requests = 0
+        n_failed_requests = 0
+        n_entries = 0
+        with compression.open_file(file, 'r') as input_file:
+            entries = iter_json_array(input_file)
+            while True:
+                batch = list(itertools.islice(entries, self._max_entries_per_request))
+                if len(batch) == 0:
+                    break
+                data = json.dumps(batch).encode()
+                n_requests += 1
+                n_entries += len(batch)
+                if not self._post(f'{file.name} #{n_requests}', lambda: data):
+                    n_failed_requests += 1
+        self._reports[file.name] = BulkReport(n_requests, n_failed_requests, n_entries)
+
+    @staticmethod
+    def _open_body(file: Path) -> Union[bytes, BinaryIO]:
+        # requests takes the length of a file from its descriptor, which would be
+        # the compressed size, so a compressed file is sent decompressed in memory
+        if compression.codec_of(file) == 'none':
+            return open(str(file), 'rb')
+        with compression.open_file(file, 'rb') as input_file:
+            return input_file.read()
+
+    def _post(self, name: str, data: Callable[[], Union[bytes, BinaryIO]]) -> bool:
+        for attempt in range(self._max_retries + 1):
+            if attempt > 0:
+                time.sleep(self._service_config.BULK_BACKOFF * 2 ** (attempt - 1))
+            body = data()
+            try:
+                response = self._session.post(
+                    self._service_config.POST_URL, data=body, timeout=self._timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as error:
+                logger.warning(f'{name}: attempt {attempt + 1} failed with {error}')
+                continue
+            finally:
+                if not isinstance(body, bytes):
+                    body.close()
+
+            logger.info(f'{name}: {response.status_code}: {response.content[:200]}')
+            if response.status_code < 500:
+                return response.ok
+            logger.warning(f'{name}: attempt {attempt + 1} failed')
+        return False
 
     def _post_setup(self) -> None:
-        pass
+        n_failed_files = 0
+        for file_name, report in sorted(self._reports.items()):
+            is_success = report.n_failed_requests == 0
+            n_failed_files += 0 if is_success else 1
+            logger.info(
+                f'{file_name}: {"ok" if is_success else "FAILED"}'
+                + f' ({report.n_requests - report.n_failed_requests}'
+                + f'/{report.n_requests} requests succeeded'
+                + ('' if report.n_entries is None else f', {report.n_entries} entries')
+                + ')'
+            )
+        if n_failed_files > 0:
+            logger.error(f'{n_failed_files} of {len(self._reports)} files failed')
+            exit(-1)
+        # the autocomplete caches of the API hold hits of the previous index
+        bump_dataset_version(self._redis_connection)
 
 
 class SetupPostgres(Setup):
@@ -133,33 +251,48 @@ class SetupPostgres(Setup):
     def _filename_skip_list(self) -> List[str]:
         return [
             self._service_config.CREATE_TABLE_FILE_NAME,
-            self._service_config.INSERT_INTO_PAPERS_FILE_NAME,
+            self._service_config.PAPERS_FILE_NAME,
         ]
 
     def _step(self, file: Path) -> None:
-        cursor = self._connection.cursor()
-        cursor.execute(open(str(file), 'r').read())
-        self._connection.commit()
-        cursor.close()
+        self._copy(file, self._service_config.COPY_REFS_SQL)
 
     def _post_setup(self) -> None:
         self._connection.close()
 
     def _read_priority_files(self) -> None:
-        for input_file_name in self._filename_skip_list:
-            input_file_path = self._input_path / input_file_name
-            self._log_filename(input_file_path)
-            cursor = self._connection.cursor()
-            cursor.execute(open(str(input_file_path), 'r').read())
-            self._connection.commit()
-            cursor.close()
+        create_tables_file_path = (
+            self._input_path / self._service_config.CREATE_TABLE_FILE_NAME
+        )
+        self._log_filename(create_tables_file_path)
+        cursor = self._connection.cursor()
+        cursor.execute(open(str(create_tables_file_path), 'r').read())
+        self._connection.commit()
+        cursor.close()
+
+        papers_file_path = compression.find(
+            self._input_path / self._service_config.PAPERS_FILE_NAME
+        )
+        self._log_filename(papers_file_path)
+        self._copy(papers_file_path, self._service_config.COPY_PAPERS_SQL)
+
+    def _copy(self, file: Path, sql: str) -> None:
+        # psycopg2 streams the file in chunks, it is never read into memory at once
+        cursor = self._connection.cursor()
+        with compression.open_file(file, 'r') as input_file:
+            cursor.copy_expert(
+                sql, input_file, size=self._service_config.COPY_CHUNK_SIZE
+            )
+        self._connection.commit()
+        cursor.close()
 
 
 class SetupRedis(Setup):
-    def __init__(self):
+    def __init__(self, batch_size: int, workers: int = 1):
         # set it here so the type is correctly recognized
         self._service_config = config.RedisServiceConfig
-        super().__init__()
+        super().__init__(workers)
+        self._batch_size = batch_size
         self._connection = self._service_config.create_connection()
 
     @property
@@ -167,19 +300,53 @@ class SetupRedis(Setup):
         return []
 
     def _step(self, file: Path) -> None:
-        with open(str(file), newline='') as input_file:
+        start_time = time.time()
+        n_rows = 0
+        # pipelines are not thread-safe, so every step uses its own
+        pipeline = self._connection.pipeline(transaction=False)
+        with compression.open_file(file, 'r', newline='') as input_file:
             file_reader = csv.reader(input_file)
             for paper_id, year, authors, title in file_reader:
                 data = {'year': year, 'authors': authors, 'title': title}
-                self._connection.hmset(paper_id, data)
+                pipeline.hset(paper_id, mapping=data)
+                n_rows += 1
+                if n_rows % self._batch_size == 0:
+                    pipeline.execute()
+        pipeline.execute()
+
+        duration = max(time.time() - start_time, 1e-6)
+        logging.info(
+            f'Loaded {n_rows} rows from {file.name} at {n_rows / duration:.0f} rows/s'
+        )
 
     def _post_setup(self) -> None:
-        pass
+        bump_dataset_version(self._connection)
 
 
 @cli.command()
-def init_blast() -> None:
-    SetupBlast().run()
+@click.option('--workers', '-w', type=int, default=4, show_default=True)
+@click.option('--max-entries-per-request', '-mepr', type=int, default=None)
+@click.option(
+    '--timeout',
+    '-t',
+    type=float,
+    default=config.BlastServiceConfig.BULK_TIMEOUT,
+    show_default=True,
+)
+@click.option(
+    '--max-retries',
+    '-mr',
+    type=int,
+    default=config.BlastServiceConfig.BULK_MAX_RETRIES,
+    show_default=True,
+)
+def init_blast(
+    workers: int,
+    max_entries_per_request: Optional[int],
+    timeout: float,
+    max_retries: int,
+) -> None:
+    SetupBlast(workers, max_entries_per_request, timeout, max_retries).run()
 
 
 @cli.command()
@@ -188,32 +355,298 @@ def init_postgres() -> None:
 
 
 @cli.command()
-def init_redis() -> None:
-    SetupRedis().run()
+@click.option(
+    '--batch-size',
+    '-bs',
+    type=int,
+    default=config.RedisServiceConfig.LOAD_BATCH_SIZE,
+    show_default=True,
+)
+@click.option('--workers', '-w', type=int, default=1, show_default=True)
+def init_redis(batch_size: int, workers: int) -> None:
+    SetupRedis(batch_size, workers).run()
 
 
 @cli.command()
-def count_referenced_by() -> None:
+@click.argument('ref_files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--batch-size',
+    '-bs',
+    type=int,
+    default=config.RedisServiceConfig.LOAD_BATCH_SIZE,
+    show_default=True,
+)
+def count_referenced_by(ref_files: Tuple[str], batch_size: int) -> None:
+    # with REF_FILES only the papers referenced in these files are recounted
+    start_time = time.time()
     postgres_service_config = config.PostgresServiceConfig
     postgres_connection = postgres_service_config.create_connection()
 
-    sql = """
-SELECT p.ID, COUNT(*)
-FROM papers p
-    INNER JOIN refs r
-        ON r.referencee = p.ID
-GROUP BY p.ID"""
-    cursor = postgres_connection.cursor()
-    cursor.execute(sql)
-
     redis_service_config = config.RedisServiceConfig
     redis_connection = redis_service_config.create_connection()
-    for paper_id, referenced_count in cursor:
-        redis_connection.hsetnx(paper_id, 'referenced_by_n', referenced_count)
-    postgres_connection.commit()
+    pipeline = redis_connection.pipeline(transaction=False)
+    n_papers = 0
+
+    if len(ref_files) == 0:
+        # every paper, so a count that fell to 0 overwrites the previous one too
+        sql = """
+SELECT p.ID, COUNT(r.referencee)
+FROM papers p
+    LEFT JOIN refs r ON r.referencee = p.ID
+GROUP BY p.ID"""
+        # a server-side cursor, so the counts are never all held in memory
+        cursor = postgres_connection.cursor(name='count_referenced_by')
+        cursor.itersize = batch_size
+        cursor.execute(sql)
+        for paper_id, referenced_count in cursor:
+            pipeline.hset(paper_id, 'referenced_by_n', referenced_count)
+            n_papers += 1
+            if n_papers % batch_size == 0:
+                pipeline.execute()
+    else:
+        sql = """
+SELECT referencee, COUNT(*)
+FROM refs
+WHERE referencee = ANY(%(paper_ids)s)
+GROUP BY referencee"""
+        paper_ids = sorted(_read_referencees(ref_files))
+        cursor = postgres_connection.cursor()
+        for index in range(0, len(paper_ids), batch_size):
+            batch = paper_ids[index:][:batch_size]
+            cursor.execute(sql, dict(paper_ids=batch))
+            for paper_id, referenced_count in cursor:
+                pipeline.hset(paper_id, 'referenced_by_n', referenced_count)
+                n_papers += 1
+            pipeline.execute()
+    pipeline.execute()
     cursor.close()
+    postgres_connection.commit()
+
+    postgres_connection.close()
+    bump_dataset_version(redis_connection)
+
+    duration = time.time() - start_time
+    logging.info(f'Updated counts of {n_papers} papers in {duration:.02f}')
+
+
+def _read_referencees(ref_files: Tuple[str]) -> Set[str]:
+    referencees = set()
+    for ref_file in ref_files:
+        with compression.open_file(Path(ref_file), 'r') as input_file:
+            for line in input_file:
+                referencer, referencee = line.rstrip('\n').split('\t')
+                referencees.add(referencee)
+    return referencees
 
+
+@cli.command()
+def export_citation_graph() -> None:
+    start_time = time.time()
+    postgres_connection = config.PostgresServiceConfig.create_connection()
+    ids, referencers, referencees = _read_citation_graph(postgres_connection)
     postgres_connection.close()
+    graph.build(config.GraphConfig.FOLDER_PATH, ids, referencers, referencees)
+
+    duration = time.time() - start_time
+    logging.info(
+        f'Exported {len(ids)} papers and {len(referencers)} references'
+        + f' in {duration:.02f}'
+    )
+
+
+@cli.command()
+@click.option(
+    '--damping',
+    '-d',
+    type=float,
+    default=config.GraphConfig.PAGERANK_DAMPING,
+    show_default=True,
+)
+@click.option(
+    '--tolerance',
+    '-t',
+    type=float,
+    default=config.GraphConfig.PAGERANK_TOLERANCE,
+    show_default=True,
+)
+@click.option(
+    '--max-iterations',
+    '-mi',
+    type=int,
+    default=config.GraphConfig.PAGERANK_MAX_ITERATIONS,
+    show_default=True,
+)
+@click.option(
+    '--batch-size',
+    '-bs',
+    type=int,
+    default=config.RedisServiceConfig.LOAD_BATCH_SIZE,
+    show_default=True,
+)
+def compute_citation_metrics(
+    damping: float, tolerance: float, max_iterations: int, batch_size: int
+) -> None:
+    # the whole refs table is loaded once, so every metric is a few array operations
+    start_time = time.time()
+    postgres_connection = config.PostgresServiceConfig.create_connection()
+    ids, referencers, referencees = _read_citation_graph(postgres_connection)
+    postgres_connection.close()
+    citation_metrics = importance.compute(
+        len(ids), referencers, referencees, damping, tolerance, max_iterations
+    )
+    logging.info(
+        f'Computed the metrics of {len(ids)} papers'
+        + f' in {citation_metrics.n_iterations} iterations'
+    )
+
+    redis_connection = config.RedisServiceConfig.create_connection()
+    pipeline = redis_connection.pipeline(transaction=False)
+    importance_field = config.GraphConfig.IMPORTANCE_FIELD
+    # papers without any reference keep the defaults of the API
+    indices = np.flatnonzero(
+        (citation_metrics.references_n > 0) | (citation_metrics.referenced_by_n > 0)
+    )
+    for index in range(0, len(indices), batch_size):
+        batch_indices = indices[index:][:batch_size]
+        rows = zip(
+            ids[batch_indices].tolist(),
+            citation_metrics.references_n[batch_indices].tolist(),
+            citation_metrics.referenced_by_n[batch_indices].tolist(),
+            citation_metrics.pagerank[batch_indices].tolist(),
+        )
+        for paper_id, references_n, referenced_by_n, pagerank in rows:
+            pipeline.hset(
+                paper_id.decode(),
+                mapping={
+                    'references_n': references_n,
+                    'referenced_by_n': referenced_by_n,
+                    importance_field: repr(pagerank),
+                },
+            )
+        pipeline.execute()
+    bump_dataset_version(redis_connection)
+
+    duration = time.time() - start_time
+    logging.info(f'Updated the metrics of {len(indices)} papers in {duration:.02f}')
+
+
+def _read_citation_graph(
+    postgres_connection: psycopg2.extensions.connection,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # sorted ids and the references as indices into them
+    batch_size = config.GraphConfig.EXPORT_BATCH_SIZE
+    cursor = postgres_connection.cursor(name='export_papers')
+    cursor.itersize = batch_size
+    cursor.execute('SELECT ID FROM papers')
+    ids = np.sort(np.array([r[0] for r in cursor], dtype='S'))
+    cursor.close()
+
+    cursor = postgres_connection.cursor(name='export_refs')
+    cursor.execute('SELECT referencer, referencee FROM refs')
+    referencers = []
+    referencees = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        referencers.append(np.searchsorted(ids, np.array([r[0] for r in rows], 'S')))
+        referencees.append(np.searchsorted(ids, np.array([r[1] for r in rows], 'S')))
+    cursor.close()
+    postgres_connection.commit()
+
+    referencers = np.concatenate(referencers) if referencers else np.array([], int)
+    referencees = np.concatenate(referencees) if referencees else np.array([], int)
+    return ids, referencers, referencees
+
+
+@cli.command()
+def build_search_index() -> None:
+    start_time = time.time()
+    output_path = Path('data') / 'output_for'
+    blast_config = config.BlastServiceConfig
+    blast_path = output_path / blast_config.FOLDER_NAME
+    blast_file_paths = sorted(blast_path.glob(blast_config.FILE_GLOB), reverse=True)
+    # counted from the converted references, so no service has to be running
+    postgres_config = config.PostgresServiceConfig
+    postgres_path = output_path / postgres_config.FOLDER_NAME
+    ref_file_paths = [
+        p
+        for p in postgres_path.glob(postgres_config.FILE_GLOB)
+        if compression.base_name(p) != postgres_config.PAPERS_FILE_NAME
+    ]
+    search.build(
+        config.SearchConfig.FOLDER_PATH,
+        _read_blast_documents(blast_file_paths),
+        _count_referencees(ref_file_paths),
+    )
+
+    duration = time.time() - start_time
+    n_documents = len(search.SearchIndex(config.SearchConfig.FOLDER_PATH))
+    logging.info(f'Indexed {n_documents} documents in {duration:.02f}')
+
+
+def _read_blast_documents(
+    input_file_paths: List[Path],
+) -> Iterator[Tuple[str, Dict[str, str]]]:
+    for input_file_path in input_file_paths:
+        with compression.open_file(input_file_path, 'r') as input_file:
+            for entry in iter_json_array(input_file):
+                yield entry['document']['id'], entry['document']['fields']
+
+
+def _count_referencees(ref_file_paths: List[Path]) -> Dict[str, int]:
+    referenced_by_n = collections.Counter()
+    for ref_file_path in ref_file_paths:
+        with compression.open_file(ref_file_path, 'r') as input_file:
+            referenced_by_n.update(
+                line.rstrip('\n').split('\t')[1] for line in input_file
+            )
+    return referenced_by_n
+
+
+def iter_json_array(input_file: TextIO, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    # yields the elements of a top-level JSON array without reading the whole file
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    is_in_array = False
+    is_eof = False
+    while True:
+        while position < len(buffer):
+            character = buffer[position]
+            if character == '[' and not is_in_array:
+                is_in_array = True
+            elif character == ']' and is_in_array:
+                return
+            elif character not in ' \t\r\n,':
+                break
+            position += 1
+
+        if position < len(buffer):
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if is_eof:
+                    raise
+            else:
+                # a number cut by the end of the buffer still decodes, '[12, 345]'
+                # read by the byte would yield 1 and 2, so a delimiter has to follow
+                if is_eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                    position = end
+                    yield element
+                    continue
+        elif is_eof:
+            return
+
+        chunk = input_file.read(chunk_size)
+        is_eof = chunk == ''
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def bump_dataset_version(redis_connection: redis.Redis) -> None:
+    version = redis_connection.incr(config.RedisServiceConfig.DATASET_VERSION_KEY)
+    logger.info(f'Dataset version is now {version}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+
+# the modules import their siblings by name, like when run from src, so the
+# tests import them the same way and never load a second copy through src.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import processing  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def warm_up_processing() -> None:
+    # nltk is imported by the first stem, which would count against the first
+    # hypothesis example and overrun its deadline
+    processing.warm_up()
@@ -0,0 +1,243 @@
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import config
+import graph
+import search
+
+
+class StandInRedis:
+    # just enough of redis.StrictRedis for the read path of the API
+    def __init__(self, hashes: Dict[str, Dict[str, str]]):
+        self._hashes = hashes
+
+    def pipeline(self, transaction: bool = True) -> 'StandInRedisPipeline':
+        return StandInRedisPipeline(self._hashes)
+
+    def get(self, key: str) -> Optional[str]:
+        return None
+
+    def ping(self) -> bool:
+        return True
+
+
+class StandInRedisPipeline:
+    def __init__(self, hashes: Dict[str, Dict[str, str]]):
+        self._hashes = hashes
+        self._results = []
+
+    def hgetall(self, key: str) -> None:
+        self._results.append(dict(self._hashes.get(key, dict())))
+
+    def execute(self) -> List[Dict[str, str]]:
+        results, self._results = self._results, []
+        return results
+
+
+class StandInPostgresPool:
+    # answers the queries of the API from a citation graph instead of a database
+    def __init__(self, citation_graph: graph.CitationGraph):
+        self._citation_graph = citation_graph
+
+    def getconn(self) -> 'StandInPostgresConnection':
+        return StandInPostgresConnection(self._citation_graph)
+
+    def putconn(self, connection: 'StandInPostgresConnection', close=False) -> None:
+        pass
+
+    def closeall(self) -> None:
+        pass
+
+
+class StandInPostgresConnection:
+    closed = 0
+
+    def __init__(self, citation_graph: graph.CitationGraph):
+        self._citation_graph = citation_graph
+
+    def __enter__(self) -> 'StandInPostgresConnection':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def cursor(self, name: Optional[str] = None) -> 'StandInPostgresCursor':
+        return StandInPostgresCursor(self._citation_graph)
+
+
+class StandInPostgresCursor:
+    def __init__(self, citation_graph: graph.CitationGraph):
+        self._citation_graph = citation_graph
+        self._rows = []  # type: List[Tuple[str, ...]]
+
+    def __enter__(self) -> 'StandInPostgresCursor':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def execute(self, sql: str, parameters: Optional[Dict] = None) -> None:
+        postgres_config = config.PostgresServiceConfig
+        g = self._citation_graph
+        if sql == 'SELECT 1':
+            self._rows = [(1,)]
+        elif sql == postgres_config.REFERENCED_BY_SQL:
+            ids = g.referenced_by(
+                parameters['paper_id'], parameters['after'], parameters['limit']
+            )
+            self._rows = [(i,) for i in ids]
+        elif sql == postgres_config.REFERENCES_SQL:
+            ids = g.references(
+                parameters['paper_id'], parameters['after'], parameters['limit']
+            )
+            self._rows = [(i,) for i in ids]
+        elif sql == postgres_config.NEIGHBORHOOD_REFERENCED_BY_SQL:
+            self._rows = [
+                (n, paper_id)
+                for paper_id in parameters['paper_ids']
+                for n in g.referenced_by(paper_id, limit=parameters['max_fan_out'])
+            ]
+        elif sql == postgres_config.NEIGHBORHOOD_REFERENCES_SQL:
+            self._rows = [
+                (paper_id, n)
+                for paper_id in parameters['paper_ids']
+                for n in g.references(paper_id, limit=parameters['max_fan_out'])
+            ]
+        else:
+            raise NotImplementedError(sql)
+
+    def fetchall(self) -> List[Tuple[str, ...]]:
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size: int) -> List[Tuple[str, ...]]:
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+
+class StandInResponse(NamedTuple):
+    status_code: int
+    content: bytes
+
+
+class StandInBlastSession:
+    # answers search requests from an embedded index instead of over HTTP
+    def __init__(
+        self, search_index: search.SearchIndex, fields: Dict[str, Dict[str, str]]
+    ):
+        self._search_index = search_index
+        self._fields = fields
+
+    def post(self, url: str, data: str, timeout: object = None) -> StandInResponse:
+        search_request = json.loads(data)['search_request']
+        words = [w.lstrip('+') for w in search_request['query']['query'].split()]
+        terms = [w for w in words if not w.endswith('*')]
+        prefix = ''.join([w[:-1] for w in words if w.endswith('*')])
+        ids, n_hits = self._search_index.search(terms, search_request['size'], prefix)
+        hits = [dict(id=i, fields=self._fields[i]) for i in ids]
+        body = dict(success=True, search_result=dict(total_hits=n_hits, hits=hits))
+        return StandInResponse(200, json.dumps(body).encode())
+
+
+class StandInAsyncRedis:
+    # the asyncio client of redis over the same hashes, for api_async
+    def __init__(self, hashes: Dict[str, Dict[str, str]]):
+        self._redis = StandInRedis(hashes)
+
+    def pipeline(self, transaction: bool = True) -> 'StandInAsyncRedisPipeline':
+        return StandInAsyncRedisPipeline(self._redis.pipeline(transaction))
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._redis.get(key)
+
+    async def ping(self) -> bool:
+        return self._redis.ping()
+
+    async def close(self) -> None:
+        pass
+
+
+class StandInAsyncRedisPipeline:
+    def __init__(self, pipeline: StandInRedisPipeline):
+        self._pipeline = pipeline
+
+    def hgetall(self, key: str) -> None:
+        self._pipeline.hgetall(key)
+
+    async def execute(self) -> List[Dict[str, str]]:
+        return self._pipeline.execute()
+
+
+class StandInAsyncPostgresPool:
+    # answers the positional queries of api_async like the cursor answers the
+    # named ones of the flask app
+    def __init__(self, citation_graph: graph.CitationGraph):
+        self._citation_graph = citation_graph
+
+    def acquire(self, timeout: Optional[float] = None) -> 'StandInAsyncConnection':
+        return StandInAsyncConnection(self._citation_graph)
+
+    async def fetchval(self, sql: str) -> object:
+        async with self.acquire() as connection:
+            return (await connection.fetch(sql))[0][0]
+
+    async def close(self) -> None:
+        pass
+
+
+class StandInAsyncConnection:
+    def __init__(self, citation_graph: graph.CitationGraph):
+        self._citation_graph = citation_graph
+
+    async def __aenter__(self) -> 'StandInAsyncConnection':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def fetch(self, sql: str, *args: object) -> List[Tuple[str, ...]]:
+        postgres_config = config.PostgresServiceConfig
+        cursor = StandInPostgresCursor(self._citation_graph)
+        for named_sql in [
+            'SELECT 1',
+            postgres_config.REFERENCED_BY_SQL,
+            postgres_config.REFERENCES_SQL,
+            postgres_config.NEIGHBORHOOD_REFERENCED_BY_SQL,
+            postgres_config.NEIGHBORHOOD_REFERENCES_SQL,
+        ]:
+            positional_sql, names = postgres_config.POSITIONAL_SQL(named_sql)
+            if sql == positional_sql:
+                cursor.execute(named_sql, dict(zip(names, args)))
+                return cursor.fetchall()
+        raise NotImplementedError(sql)
+
+
+class StandInAsyncBlastSession:
+    # the aiohttp session of api_async, answered by the stand-in of blast
+    def __init__(
+        self, search_index: search.SearchIndex, fields: Dict[str, Dict[str, str]]
+    ):
+        self._session = StandInBlastSession(search_index, fields)
+
+    def post(
+        self, url: str, data: str, timeout: object = None
+    ) -> 'StandInAsyncResponse':
+        return StandInAsyncResponse(self._session.post(url, data, timeout))
+
+    async def close(self) -> None:
+        pass
+
+
+class StandInAsyncResponse:
+    def __init__(self, response: StandInResponse):
+        self.status = response.status_code
+        self._content = response.content
+
+    async def __aenter__(self) -> 'StandInAsyncResponse':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return self._content
@@ -0,0 +1,430 @@
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import flask.testing
+import numpy as np
+import prometheus_client.parser
+import psycopg2
+import pytest
+import requests
+
+import api
+import config
+import graph
+import search
+from tests import standins
+
+
+N_PAPERS = 6
+# the fields as the converter writes them for blast, with cleaned titles
+DOCUMENTS = dict(
+    a=dict(year='2019', authors='smith', title='neural network'),
+    b=dict(year='2019', authors='smith', title='neuron graph'),
+    c=dict(year='2018', authors='jones', title='graph neural network'),
+    d=dict(year='2018', authors='jones', title='graph kernel'),
+    e=dict(year='2018', authors='jones', title='neuralgia'),
+)
+# as written by compute-citation-metrics, the other papers have no references
+IMPORTANCES = dict(b='0.1', c='0.3', d='0.5')
+# every paper references p0, which references p1 and p2
+EDGES = [(i, 0) for i in range(1, N_PAPERS)] + [(0, 1), (0, 2)]
+
+
+@pytest.fixture(params=['graph', 'postgres'])
+def client(request, tmp_path: Path, monkeypatch) -> flask.testing.FlaskClient:
+    citation_graph = _build_graph(tmp_path)
+    hashes = {
+        f'p{i}': dict(year='2019', authors='smith', title=f'title {i}')
+        for i in range(N_PAPERS)
+    }
+
+    monkeypatch.setattr(api, 'redis_connection', standins.StandInRedis(hashes))
+    monkeypatch.setattr(
+        api, 'postgres_pool', standins.StandInPostgresPool(citation_graph)
+    )
+    is_graph = request.param == 'graph'
+    monkeypatch.setattr(api, 'citation_graph', citation_graph if is_graph else None)
+    monkeypatch.setattr(api, 'is_warmed_up', True)
+    api.paper_cache.clear()
+    api.autocomplete_cache.clear()
+    return api.app.test_client()
+
+
+@pytest.fixture
+def cold_api(tmp_path: Path, monkeypatch) -> None:
+    # nothing warmed up yet, and postgres is down
+    def create_connection_pool() -> None:
+        raise psycopg2.OperationalError('could not connect to server')
+
+    monkeypatch.setattr(
+        config.PostgresServiceConfig, 'create_connection_pool', create_connection_pool
+    )
+    monkeypatch.setattr(config.GraphConfig, 'FOLDER_PATH', tmp_path / 'graph')
+    for name in [
+        'redis_connection',
+        'postgres_pool',
+        'blast_session',
+        'citation_graph',
+        'search_index',
+    ]:
+        monkeypatch.setattr(api, name, None)
+    monkeypatch.setattr(api, 'is_warmed_up', False)
+
+
+@pytest.fixture
+def blast_client(tmp_path: Path, monkeypatch) -> flask.testing.FlaskClient:
+    # autocomplete through blast, which the stand-in answers from a local index
+    search.build(tmp_path / 'search', DOCUMENTS.items())
+    search_index = search.SearchIndex(tmp_path / 'search')
+    hashes = {paper_id: dict(fields) for paper_id, fields in DOCUMENTS.items()}
+    for paper_id, importance in IMPORTANCES.items():
+        hashes[paper_id][config.GraphConfig.IMPORTANCE_FIELD] = importance
+    monkeypatch.setattr(api, 'redis_connection', standins.StandInRedis(hashes))
+    monkeypatch.setattr(
+        api, 'blast_session', standins.StandInBlastSession(search_index, DOCUMENTS)
+    )
+    monkeypatch.setattr(api, 'search_index', None)
+    monkeypatch.setattr(api, 'is_warmed_up', True)
+    monkeypatch.setattr(api, '_autocomplete_stats', dict(prefix_reuses=0))
+    api.paper_cache.clear()
+    api.autocomplete_cache.clear()
+    return api.app.test_client()
+
+
+def _build_graph(path: Path) -> graph.CitationGraph:
+    ids = np.array([f'p{i}' for i in range(N_PAPERS)], dtype='S')
+    referencers = np.array([r for r, _ in EDGES], dtype=np.int64)
+    referencees = np.array([r for _, r in EDGES], dtype=np.int64)
+    graph.build(path, ids, referencers, referencees)
+    return graph.CitationGraph(path)
+
+
+def _ids(response) -> List[str]:
+    return [p['id'] for p in response.get_json()]
+
+
+def _next_url(response) -> str:
+    next_url, rel = response.headers['Link'].split('; ')
+    assert rel == 'rel="next"'
+    return next_url.strip('<>')
+
+
+def test_referenced_by_pages_with_link_header(client) -> None:
+    response = client.get('/api/v1/referenced_by/p0?limit=2')
+    pages = [_ids(response)]
+    while 'Link' in response.headers:
+        response = client.get(_next_url(response))
+        pages.append(_ids(response))
+    assert pages == [['p1', 'p2'], ['p3', 'p4'], ['p5']]
+
+    # a full last page links to an empty one
+    response = client.get('/api/v1/referenced_by/p0?after=p3&limit=2')
+    assert _ids(response) == ['p4', 'p5']
+    assert _ids(client.get(_next_url(response))) == []
+    assert 'Link' not in client.get('/api/v1/referenced_by/p0').headers
+
+
+def test_referenced_by_streams_ndjson(client, monkeypatch) -> None:
+    monkeypatch.setattr(type(config.PostgresServiceConfig), 'STREAM_BATCH_SIZE', 2)
+    response = client.get('/api/v1/referenced_by/p0?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == ['p1', 'p2', 'p3', 'p4', 'p5']
+
+    response = client.get('/api/v1/referenced_by/p0?format=ndjson&after=p1&limit=3')
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == ['p2', 'p3', 'p4']
+    url = '/api/v1/referenced_by/p0?format=ndjson&order=importance'
+    assert client.get(url).status_code == 400
+
+
+def test_referenced_by_stream_holds_no_connection_between_pages(
+    client, monkeypatch
+) -> None:
+    monkeypatch.setattr(type(config.PostgresServiceConfig), 'STREAM_BATCH_SIZE', 2)
+    monkeypatch.setattr(api, 'postgres_pool_slots', threading.BoundedSemaphore(1))
+    response = client.get('/api/v1/referenced_by/p0?format=ndjson', buffered=False)
+    pages = iter(response.response)
+    lines = next(pages).decode().splitlines()
+    # a client that stops reading leaves the pool to the other requests
+    assert api.postgres_pool_slots.acquire(timeout=0)
+    api.postgres_pool_slots.release()
+    lines += b''.join(pages).decode().splitlines()
+    response.close()
+    assert [json.loads(line)['id'] for line in lines] == ['p1', 'p2', 'p3', 'p4', 'p5']
+
+
+def test_busy_pool_answers_503(client, monkeypatch) -> None:
+    monkeypatch.setattr(api, 'postgres_pool_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(type(config.PostgresServiceConfig), 'POOL_TIMEOUT', 0.01)
+    # the graph answers without postgres
+    status_code = 503 if api.citation_graph is None else 200
+    with api.postgres_pool_slots:
+        for path in [
+            '/api/v1/referenced_by/p0',
+            '/api/v1/referenced_by/p0?format=ndjson',
+            '/api/v1/references/p0',
+            '/api/v1/neighborhood/p0',
+        ]:
+            response = client.get(path)
+            response.get_data()
+            assert response.status_code == status_code, path
+    assert client.get('/api/v1/referenced_by/p0').status_code == 200
+
+
+def test_references(client) -> None:
+    assert _ids(client.get('/api/v1/references/p0')) == ['p1', 'p2']
+    response = client.get('/api/v1/references/p0?limit=1')
+    assert _ids(response) == ['p1']
+    assert _ids(client.get(_next_url(response))) == ['p2']
+    assert _ids(client.get('/api/v1/references/p5')) == ['p0']
+    assert _ids(client.get('/api/v1/references/unknown')) == []
+
+
+def _edges(response) -> List[List[str]]:
+    return [[e['referencer'], e['referencee']] for e in response.get_json()['edges']]
+
+
+def test_neighborhood(client) -> None:
+    response = client.get('/api/v1/neighborhood/p1')
+    assert {p['id'] for p in response.get_json()['nodes']} == {'p0', 'p1'}
+    assert _edges(response) == [['p0', 'p1'], ['p1', 'p0']]
+
+    response = client.get('/api/v1/neighborhood/p3?depth=2&direction=out')
+    assert {p['id'] for p in response.get_json()['nodes']} == {'p0', 'p1', 'p2', 'p3'}
+    assert _edges(response) == [['p0', 'p1'], ['p0', 'p2'], ['p3', 'p0']]
+
+    response = client.get('/api/v1/neighborhood/p3?depth=2&direction=out&max_fan_out=1')
+    assert _edges(response) == [['p0', 'p1'], ['p3', 'p0']]
+    assert client.get('/api/v1/neighborhood/p3?direction=up').status_code == 400
+
+
+def test_papers_maps_ids_to_papers(client) -> None:
+    response = client.post('/api/v1/papers', json=dict(ids=['p1', 'unknown', 'p2']))
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'p1': dict(
+            id='p1', year='2019', authors='smith', title='title 1', referenced_by_n=0
+        ),
+        'unknown': None,
+        'p2': dict(
+            id='p2', year='2019', authors='smith', title='title 2', referenced_by_n=0
+        ),
+    }
+
+
+def test_papers_projects_fields(client) -> None:
+    body = dict(ids=['p1', 'unknown'], fields=['title', 'missing', 'id'])
+    response = client.post('/api/v1/papers', json=body)
+    assert response.get_json() == dict(p1=dict(title='title 1', id='p1'), unknown=None)
+    # the projection is a copy, the cached paper keeps all of its fields
+    assert client.get('/api/v1/paper/p1').get_json()['year'] == '2019'
+
+
+@pytest.mark.parametrize(
+    'body',
+    [
+        ['p1'],
+        dict(),
+        dict(ids='p1'),
+        dict(ids=[]),
+        dict(ids=['p1', 1]),
+        dict(ids=['p1'], fields='title'),
+        dict(ids=['p1'], fields=[None]),
+    ],
+)
+def test_papers_rejects_malformed_bodies(client, body) -> None:
+    assert client.post('/api/v1/papers', json=body).status_code == 400
+
+
+def test_papers_rejects_malformed_json(client) -> None:
+    response = client.post(
+        '/api/v1/papers', data='{"ids": [', content_type='application/json'
+    )
+    assert response.status_code == 400
+    assert client.post('/api/v1/papers', data='p1').status_code == 400
+
+
+def test_papers_limits_the_number_of_ids(client) -> None:
+    max_bulk_papers = config.RedisServiceConfig.MAX_BULK_PAPERS
+    paper_ids = [f'p{i}' for i in range(max_bulk_papers + 1)]
+    response = client.post('/api/v1/papers', json=dict(ids=paper_ids[:-1]))
+    assert response.status_code == 200
+    assert len(response.get_json()) == max_bulk_papers
+    response = client.post('/api/v1/papers', json=dict(ids=paper_ids))
+    assert response.status_code == 413
+
+
+def test_warm_up_leaves_postgres_alone_with_a_graph(cold_api) -> None:
+    with pytest.raises(psycopg2.OperationalError):
+        api.warm_up()
+    assert not api.is_warmed_up
+
+    _build_graph(config.GraphConfig.FOLDER_PATH)
+    api.warm_up()
+    assert api.is_warmed_up
+    assert api.citation_graph is not None
+    assert api.postgres_pool is None
+
+
+def test_process_endpoints_answer_while_backends_are_down(cold_api) -> None:
+    client = api.app.test_client()
+    for path in ['/', '/healthz', '/metrics', '/api/v1/stats/caches']:
+        assert client.get(path).status_code == 200, path
+    assert client.get('/readyz').status_code == 503
+    assert client.get('/api/v1/paper/p1').status_code == 503
+    assert not api.is_warmed_up
+
+
+def test_postgres_probe_gives_up_on_a_busy_pool(client, monkeypatch) -> None:
+    monkeypatch.setattr(api, 'postgres_pool_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(config.ProbeConfig, 'TIMEOUT', 0.01)
+    assert api._check(api._ping_postgres) == 'ok'
+    with api.postgres_pool_slots:
+        assert api._check(api._ping_postgres).startswith('TimeoutError')
+    assert api._check(api._ping_postgres) == 'ok'
+
+
+def test_warm_up_connects_outside_of_the_lock(cold_api, monkeypatch) -> None:
+    is_connecting = threading.Event()
+    may_connect = threading.Event()
+    pool = standins.StandInPostgresPool(None)
+
+    def create_connection_pool() -> standins.StandInPostgresPool:
+        is_connecting.set()
+        may_connect.wait()
+        return pool
+
+    monkeypatch.setattr(
+        config.PostgresServiceConfig, 'create_connection_pool', create_connection_pool
+    )
+    thread = threading.Thread(target=api.warm_up)
+    thread.start()
+    assert is_connecting.wait(10)
+    try:
+        # other requests are not held up while postgres is connecting
+        assert api._warm_up_lock.acquire(timeout=1)
+        api._warm_up_lock.release()
+    finally:
+        may_connect.set()
+        thread.join()
+    assert api.is_warmed_up
+    assert api.postgres_pool is pool
+
+
+def test_autocomplete_gives_up_on_a_hung_blast(blast_client, monkeypatch) -> None:
+    timeouts = []
+
+    def post(url: str, data: str, timeout: object) -> None:
+        timeouts.append(timeout)
+        raise requests.Timeout('Read timed out')
+
+    monkeypatch.setattr(api.blast_session, 'post', post)
+    assert blast_client.get('/api/v1/autocomplete/neur').status_code == 503
+    assert timeouts == [config.BlastServiceConfig.SEARCH_TIMEOUT]
+
+
+def _metric(client, name: str, **labels: str) -> float:
+    # read from the exposition, as prometheus scrapes it
+    text = client.get('/metrics').get_data(as_text=True)
+    for family in prometheus_client.parser.text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == name and sample.labels == labels:
+                return sample.value
+    return 0.0
+
+
+def test_requests_are_timed(client) -> None:
+    n_requests = _metric(client, 'api_requests_total', endpoint='paper', status='200')
+    backend = api._graph_backend()
+    n_backend_observations = _metric(
+        client, 'api_backend_seconds_count', endpoint='referenced_by', backend=backend
+    )
+
+    response = client.get('/api/v1/paper/p1')
+    # the backends first, then the whole request, in milliseconds
+    timing_pattern = r'(\w+;dur=\d+\.\d\d, )*total;dur=\d+\.\d\d'
+    assert re.fullmatch(timing_pattern, response.headers['Server-Timing'])
+    assert 'redis;dur=' in response.headers['Server-Timing']
+    # a response is observed once the server closes it, streamed or not
+    response.close()
+    response = client.get('/api/v1/referenced_by/p0?format=ndjson')
+    response.get_data()
+    response.close()
+
+    assert (
+        _metric(client, 'api_requests_total', endpoint='paper', status='200')
+        == n_requests + 1
+    )
+    assert _metric(client, 'api_request_seconds_count', endpoint='paper') > 0
+    assert (
+        _metric(
+            client,
+            'api_backend_seconds_count',
+            endpoint='referenced_by',
+            backend=backend,
+        )
+        == n_backend_observations + 1
+    )
+    assert client.get('/metrics').mimetype == 'text/plain'
+
+
+@pytest.mark.parametrize('is_propagating', [False, True])
+def test_failed_requests_are_counted(client, monkeypatch, is_propagating) -> None:
+    def paper(paper_id: str) -> None:
+        raise RuntimeError('Bug')
+
+    monkeypatch.setitem(api.app.view_functions, 'paper', paper)
+    monkeypatch.setitem(api.app.config, 'PROPAGATE_EXCEPTIONS', is_propagating)
+    n_requests = _metric(client, 'api_requests_total', endpoint='paper', status='500')
+    if is_propagating:
+        with pytest.raises(RuntimeError):
+            client.get('/api/v1/paper/p1')
+    else:
+        response = client.get('/api/v1/paper/p1')
+        response.close()
+        assert response.status_code == 500
+    assert (
+        _metric(client, 'api_requests_total', endpoint='paper', status='500')
+        == n_requests + 1
+    )
+
+
+def test_autocomplete_ranks_blast_hits_by_importance(blast_client) -> None:
+    # blast alone would rank the shorter titles first
+    assert _ids(blast_client.get('/api/v1/autocomplete/graph ')) == ['d', 'c', 'b']
+
+
+def _autocomplete_stats(client) -> Dict[str, object]:
+    return client.get('/api/v1/stats/caches').get_json()['autocomplete']
+
+
+def test_autocomplete_reuses_a_shorter_query_in_the_same_order(blast_client) -> None:
+    cold_ids = _ids(blast_client.get('/api/v1/autocomplete/neural'))
+    assert cold_ids == ['c', 'a', 'e']
+    assert _autocomplete_stats(blast_client)['prefix_reuses'] == 0
+
+    api.autocomplete_cache.clear()
+    assert _ids(blast_client.get('/api/v1/autocomplete/neura')) == ['c', 'a', 'e']
+    assert _ids(blast_client.get('/api/v1/autocomplete/neural')) == cold_ids
+    assert _autocomplete_stats(blast_client)['prefix_reuses'] == 1
+
+
+def test_autocomplete_answers_a_repeated_query_from_the_cache(
+    blast_client, monkeypatch
+) -> None:
+    queries = []
+    post = api.blast_session.post
+
+    def counting_post(url: str, data: str, timeout: object) -> object:
+        queries.append(data)
+        return post(url, data, timeout)
+
+    monkeypatch.setattr(api.blast_session, 'post', counting_post)
+    first_ids = _ids(blast_client.get('/api/v1/autocomplete/graph '))
+    assert _ids(blast_client.get('/api/v1/autocomplete/graph ')) == first_ids
+    assert len(queries) == 1
+    assert _autocomplete_stats(blast_client)['hits'] == 1
@@ -0,0 +1,230 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import flask.testing
+import prometheus_client
+import pytest
+import redis
+from aiohttp import test_utils
+
+import api
+import api_async
+import api_common
+import config
+import search
+from tests import standins, test_api
+
+
+# the same requests are sent to both apps, which have to answer them alike, with
+# the status the flask app answers
+PARITY_REQUESTS = [
+    ('GET', '/api/v1/paper/p0', None, 200),
+    ('GET', '/api/v1/paper/unknown', None, 200),
+    ('POST', '/api/v1/papers', dict(ids=['p1', 'unknown', 'c'], fields=['title']), 200),
+    ('POST', '/api/v1/papers', dict(ids=[]), 400),
+    ('POST', '/api/v1/papers', dict(ids=['p1'] * 1001), 413),
+    ('GET', '/api/v1/referenced_by/p0', None, 200),
+    ('GET', '/api/v1/referenced_by/p0?limit=2&after=p1', None, 200),
+    ('GET', '/api/v1/referenced_by/p0?limit=x', None, 200),
+    ('GET', '/api/v1/referenced_by/p0?order=importance', None, 200),
+    ('GET', '/api/v1/referenced_by/p0?order=year', None, 400),
+    ('GET', '/api/v1/referenced_by/p0?format=ndjson&limit=3', None, 200),
+    ('GET', '/api/v1/referenced_by/p0?format=ndjson&order=importance', None, 400),
+    ('GET', '/api/v1/references/p0?limit=1', None, 200),
+    ('GET', '/api/v1/neighborhood/p1?depth=2&max_fan_out=3', None, 200),
+    ('GET', '/api/v1/neighborhood/p1?direction=out', None, 200),
+    ('GET', '/api/v1/neighborhood/p1?direction=up', None, 400),
+    ('GET', '/api/v1/autocomplete/graph ', None, 200),
+    ('GET', '/api/v1/autocomplete/neura', None, 200),
+    ('GET', '/api/v1/autocomplete/neural', None, 200),
+    ('GET', '/api/v1/autocomplete/neural?order=importance', None, 200),
+    ('GET', '/api/v1/autocomplete/neural?order=year', None, 400),
+]
+
+
+@pytest.fixture(params=['graph', 'postgres'])
+def servers(request, tmp_path: Path, monkeypatch) -> flask.testing.FlaskClient:
+    # both apps over the same stand-ins, api_async is started by each test, as
+    # it needs a running loop
+    citation_graph = test_api._build_graph(tmp_path)
+    search.build(tmp_path / 'search', test_api.DOCUMENTS.items())
+    search_index = search.SearchIndex(tmp_path / 'search')
+    hashes = {
+        f'p{i}': dict(year='2019', authors='smith', title=f'title {i}')
+        for i in range(test_api.N_PAPERS)
+    }
+    hashes.update({i: dict(fields) for i, fields in test_api.DOCUMENTS.items()})
+    for paper_id, importance in test_api.IMPORTANCES.items():
+        hashes[paper_id][config.GraphConfig.IMPORTANCE_FIELD] = importance
+
+    is_graph = request.param == 'graph'
+    for module in [api, api_async]:
+        monkeypatch.setattr(
+            module, 'citation_graph', citation_graph if is_graph else None
+        )
+        monkeypatch.setattr(module, 'search_index', None)
+        monkeypatch.setattr(module, '_autocomplete_stats', dict(prefix_reuses=0))
+        module.paper_cache.clear()
+        module.autocomplete_cache.clear()
+    monkeypatch.setattr(api, 'redis_connection', standins.StandInRedis(hashes))
+    monkeypatch.setattr(
+        api, 'postgres_pool', standins.StandInPostgresPool(citation_graph)
+    )
+    monkeypatch.setattr(
+        api,
+        'blast_session',
+        standins.StandInBlastSession(search_index, test_api.DOCUMENTS),
+    )
+    monkeypatch.setattr(api, 'is_warmed_up', True)
+    monkeypatch.setattr(
+        api_async, 'postgres_pool', standins.StandInAsyncPostgresPool(citation_graph)
+    )
+    monkeypatch.setattr(
+        type(config.RedisServiceConfig),
+        'create_async_connection',
+        lambda self: standins.StandInAsyncRedis(hashes),
+    )
+    monkeypatch.setattr(
+        type(config.BlastServiceConfig),
+        'create_async_session',
+        lambda self: standins.StandInAsyncBlastSession(
+            search_index, test_api.DOCUMENTS
+        ),
+    )
+    return api.app.test_client()
+
+
+def _shape(status: int, content_type: str, text: str, link: Optional[str]) -> Tuple:
+    # error pages differ, a successful answer has to be the same
+    if status != 200:
+        return status, None, link
+    if content_type.startswith('application/json'):
+        return status, json.loads(text), link
+    return status, text, link
+
+
+def _flask_responses(client: flask.testing.FlaskClient, requests: List) -> List:
+    responses = [
+        client.open(path, method=method, json=body)
+        for method, path, body, _ in requests
+    ]
+    return [
+        _shape(
+            r.status_code,
+            r.content_type,
+            r.get_data(as_text=True),
+            r.headers.get('Link'),
+        )
+        for r in responses
+    ]
+
+
+async def _async_responses(requests: List) -> List:
+    async with test_utils.TestClient(
+        test_utils.TestServer(api_async.create_app())
+    ) as client:
+        shapes = []
+        for method, path, body, _ in requests:
+            response = await client.request(method, path, json=body)
+            shapes.append(
+                _shape(
+                    response.status,
+                    response.headers.get('Content-Type', ''),
+                    await response.text(),
+                    response.headers.get('Link'),
+                )
+            )
+        return shapes
+
+
+async def _get(path: str) -> Tuple[int, Dict[str, str], str]:
+    async with test_utils.TestClient(
+        test_utils.TestServer(api_async.create_app())
+    ) as client:
+        response = await client.get(path)
+        return response.status, dict(response.headers), await response.text()
+
+
+async def _get_statuses(paths) -> list:
+    async with test_utils.TestClient(
+        test_utils.TestServer(api_async.create_app())
+    ) as client:
+        return [(await client.get(path)).status for path in paths]
+
+
+def test_app_starts_while_postgres_is_down(monkeypatch) -> None:
+    # nothing listens on port 1, so every attempt to open the pool is refused
+    monkeypatch.setattr(
+        type(config.PostgresServiceConfig),
+        'ASYNC_CONNECTION_STRING',
+        'postgresql://postgres@127.0.0.1:1/postgres',
+    )
+    monkeypatch.setattr(api_async, 'postgres_pool', None)
+    monkeypatch.setattr(api_async, '_postgres_pool_opening', None)
+    paths = ['/', '/healthz', '/api/v1/referenced_by/p1', '/readyz']
+    assert asyncio.run(_get_statuses(paths)) == [200, 200, 503, 503]
+    # a failed attempt is not kept, the next request tries again
+    assert api_async._postgres_pool_opening is None
+
+
+def test_answers_like_the_flask_app(servers) -> None:
+    expected = _flask_responses(servers, PARITY_REQUESTS)
+    assert [status for status, _, _ in expected] == [
+        status for _, _, _, status in PARITY_REQUESTS
+    ]
+    assert asyncio.run(_async_responses(PARITY_REQUESTS)) == expected
+    # the hit counters of the caches add up over the tests, their sizes do not
+    assert api_async._autocomplete_stats == api._autocomplete_stats
+    assert len(api_async.autocomplete_cache) == len(api.autocomplete_cache)
+    assert len(api_async.paper_cache) == len(api.paper_cache)
+
+
+def test_redis_errors_answer_503(servers, monkeypatch) -> None:
+    class BrokenRedis(standins.StandInAsyncRedis):
+        async def get(self, key: str) -> None:
+            raise redis.ConnectionError('Connection refused')
+
+    monkeypatch.setattr(
+        type(config.RedisServiceConfig),
+        'create_async_connection',
+        lambda self: BrokenRedis(dict()),
+    )
+    monkeypatch.setattr(
+        api_async,
+        '_dataset_version_check',
+        api_common.DatasetVersionCheck([api_async.paper_cache]),
+    )
+    status, _, text = asyncio.run(_get('/api/v1/paper/p0'))
+    assert (status, json.loads(text)) == (
+        503,
+        dict(error='ConnectionError: Connection refused'),
+    )
+
+
+def test_autocomplete_gives_up_on_a_hung_blast(servers, monkeypatch) -> None:
+    def post(self, url: str, data: str, timeout: object) -> None:
+        assert timeout.sock_read == config.BlastServiceConfig.SEARCH_TIMEOUT[1]
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(standins.StandInAsyncBlastSession, 'post', post)
+    status, _, _ = asyncio.run(_get('/api/v1/autocomplete/neural'))
+    assert status == 503
+
+
+def test_requests_are_timed(servers) -> None:
+    def n_requests() -> float:
+        labels = dict(endpoint='referenced_by', status='200')
+        value = prometheus_client.REGISTRY.get_sample_value(
+            'api_requests_total', labels
+        )
+        return value or 0.0
+
+    n_before = n_requests()
+    status, headers, _ = asyncio.run(_get('/api/v1/referenced_by/p0'))
+    assert status == 200
+    backend = 'postgres' if api_async.citation_graph is None else 'graph'
+    assert f'{backend};dur=' in headers['Server-Timing']
+    assert 'total;dur=' in headers['Server-Timing']
+    assert n_requests() == n_before + 1
@@ -0,0 +1,110 @@
+import pytest
+
+import api_common
+import cache
+import config
+
+
+def _hits(**terms_by_id: str) -> api_common.SearchHits:
+    return api_common.SearchHits(
+        ids=list(terms_by_id),
+        terms=[frozenset(terms.split()) for terms in terms_by_id.values()],
+        is_complete=True,
+    )
+
+
+def test_order_papers_by_importance() -> None:
+    field = config.GraphConfig.IMPORTANCE_FIELD
+    papers = [dict(id='a'), {'id': 'b', field: '0.5'}, {'id': 'c', field: '0.1'}]
+    assert api_common.order_papers(papers, None) == papers
+    ordered = api_common.order_papers(papers, 'importance')
+    assert [p['id'] for p in ordered] == ['b', 'c', 'a']
+    with pytest.raises(api_common.RequestError) as error:
+        api_common.order_papers(papers, 'year')
+    assert error.value.status == 400
+
+
+def test_rank_blast_hits_puts_exact_prefix_matches_first() -> None:
+    field = config.GraphConfig.IMPORTANCE_FIELD
+    hits = _hits(a='neuralgia', b='neural network', c='neural graph')
+    papers = [{'id': 'a', field: '0.9'}, dict(id='c'), dict(id='b')]
+    ranked = api_common.rank_blast_hits(papers, hits, 'neural')
+    assert [p['id'] for p in ranked] == ['b', 'c', 'a']
+
+
+def test_search_from_shorter_query_filters_complete_hits() -> None:
+    autocomplete_cache = cache.LRUCache(10)
+    query = config.BlastServiceConfig.SEARCH_QUERY
+    autocomplete_cache.set(
+        query(['graph'], ''), _hits(a='graph kernel', b='graph neural', c='graph')
+    )
+    hits = api_common.search_from_shorter_query(autocomplete_cache, ['graph'], 'ne')
+    assert hits.ids == ['b']
+    assert (
+        api_common.search_from_shorter_query(autocomplete_cache, ['kernel'], '')
+        is cache.MISSING
+    )
+
+    autocomplete_cache.set(
+        query(['kernel'], ''), _hits(a='graph kernel')._replace(is_complete=False)
+    )
+    assert (
+        api_common.search_from_shorter_query(autocomplete_cache, ['kernel'], 'gr')
+        is cache.MISSING
+    )
+
+
+def test_dataset_version_check_drops_the_caches(monkeypatch) -> None:
+    monkeypatch.setattr(
+        type(config.RedisServiceConfig), 'DATASET_VERSION_CHECK_INTERVAL', 60.0
+    )
+    paper_cache = cache.LRUCache(10)
+    version_check = api_common.DatasetVersionCheck([paper_cache])
+    assert version_check.is_due()
+    assert not version_check.is_due()
+    version_check.update('1')
+    paper_cache.set('a', dict(id='a'))
+    version_check.update('1')
+    assert len(paper_cache) == 1
+    version_check.update('2')
+    assert len(paper_cache) == 0
+
+
+@pytest.mark.parametrize(
+    'body, status',
+    [
+        (None, 400),
+        (dict(ids=[]), 400),
+        (dict(ids=['a', 1]), 400),
+        (dict(ids=['a'], fields='title'), 400),
+        (dict(ids=['a'] * 1000), 413),
+    ],
+)
+def test_bulk_params_rejects_bad_bodies(body: object, status: int, monkeypatch) -> None:
+    monkeypatch.setattr(type(config.RedisServiceConfig), 'MAX_BULK_PAPERS', 100)
+    with pytest.raises(api_common.RequestError) as error:
+        api_common.bulk_params(body)
+    assert error.value.status == status
+
+
+def test_params_fall_back_to_the_defaults() -> None:
+    assert api_common.page_params(dict()) == ('', None)
+    assert api_common.page_params(dict(after='p1', limit='x')) == ('p1', None)
+    assert api_common.page_params(dict(limit='0')) == ('', 1)
+    depth, _, directions = api_common.neighborhood_params(dict(depth='2'))
+    assert (depth, directions) == (2, ['in', 'out'])
+    with pytest.raises(api_common.RequestError):
+        api_common.neighborhood_params(dict(direction='up'))
+
+
+def test_neighborhood_keeps_the_edges_between_found_papers() -> None:
+    neighborhood = api_common.Neighborhood('a')
+    neighborhood.add_hop([('b', 'a'), ('a', 'c')])
+    assert neighborhood.frontier == ['b', 'c']
+    neighborhood.add_hop([('c', 'd')])
+    assert neighborhood.node_ids == ['a', 'b', 'c', 'd']
+    nodes = [dict(id='a'), dict(id='c'), dict(id='d')]
+    assert neighborhood.to_dict(nodes)['edges'] == [
+        dict(referencer='a', referencee='c'),
+        dict(referencer='c', referencee='d'),
+    ]
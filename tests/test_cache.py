@@ -0,0 +1,64 @@
+import hypothesis as hy
+import hypothesis.strategies as st
+
+import cache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@hy.given(st.integers(min_value=1, max_value=20), st.lists(st.integers()))
+def test_lru_cache_is_bounded(max_size: int, keys) -> None:
+    c = cache.LRUCache(max_size)
+    for k in keys:
+        c.set(k, k)
+    assert len(c) <= max_size
+    most_recent = list(dict.fromkeys(reversed(keys)))[:max_size]
+    assert all(c.get(k) == k for k in most_recent)
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    c = cache.LRUCache(2)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1
+    c.set('c', 3)
+    assert c.get('b') is cache.MISSING
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert (c.hits, c.misses, c.evictions) == (3, 1, 1)
+
+
+def test_lru_cache_expires_entries() -> None:
+    timer = FakeTimer()
+    c = cache.LRUCache(10, ttl=5.0, timer=timer)
+    c.set('a', None)
+    timer.now = 4.0
+    assert c.get('a') is None
+    timer.now = 5.0
+    assert c.get('a', 'default') == 'default'
+    assert len(c) == 0
+
+
+def test_lru_cache_invalidates_on_new_version() -> None:
+    c = cache.LRUCache(10)
+    assert not c.invalidate_if_stale(None)
+    c.set('a', 1)
+    assert c.invalidate_if_stale('1')
+    assert c.get('a') is cache.MISSING
+    c.set('a', 1)
+    assert not c.invalidate_if_stale('1')
+    assert c.get('a') == 1
+
+
+def test_lru_cache_peek_does_not_count() -> None:
+    c = cache.LRUCache(10)
+    c.set('a', 1)
+    assert c.peek('a') == 1
+    assert c.peek('b') is cache.MISSING
+    assert (c.hits, c.misses) == (0, 0)
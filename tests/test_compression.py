@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import hypothesis as hy
+import hypothesis.strategies as st
+
+import compression
+
+
+@hy.given(st.sampled_from(['none', 'gzip']), st.text())
+@hy.settings(deadline=None)
+def test_open_file_round_trip(tmp_path_factory, codec, text) -> None:
+    # untranslated newlines, so the text has to come back unchanged
+    newline = ''
+    path = compression.with_codec(tmp_path_factory.mktemp('c') / 'a.csv', codec)
+    with compression.open_file(path, 'w', newline=newline) as output_file:
+        output_file.write(text)
+    with compression.open_file(path, 'r', newline=newline) as input_file:
+        assert input_file.read() == text
+    assert compression.codec_of(path) == codec
+    assert compression.base_name(path) == 'a.csv'
+    assert compression.find(path.with_name('a.csv')) == path
+
+
+def test_gzip_files_are_reproducible(tmp_path: Path) -> None:
+    contents = []
+    for name in ['a', 'b']:
+        (tmp_path / name).mkdir()
+        path = tmp_path / name / 'a.tsv.gz'
+        with compression.open_file(path, 'w') as output_file:
+            output_file.write('1501.00001\t1501.00002\n')
+        contents.append(path.read_bytes())
+    assert contents[0] == contents[1]
+    assert compression.resolve_codec('auto') in ('gzip', 'zstd')
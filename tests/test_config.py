@@ -0,0 +1,32 @@
+import re
+from typing import List
+
+import hypothesis as hy
+import hypothesis.strategies as st
+
+import config
+
+
+copy_escape_pattern = re.compile(r'\\(.)')
+copy_escapes = dict(t='\t', n='\n', r='\r')
+
+
+def _read_copy_row(row: str) -> List[str]:
+    # how postgres reads a line of COPY ... FROM STDIN in text format
+    assert row.endswith('\n')
+    return [
+        copy_escape_pattern.sub(lambda m: copy_escapes.get(m[1], m[1]), field)
+        for field in row[:-1].split('\t')
+    ]
+
+
+@hy.given(st.lists(st.text(), min_size=1, max_size=3))
+def test_copy_row_round_trip(fields: List[str]) -> None:
+    row = config.PostgresServiceConfig.COPY_ROW(*fields)
+    assert '\n' not in row[:-1] and '\r' not in row
+    assert _read_copy_row(row) == fields
+
+
+def test_copy_row_escapes() -> None:
+    row = config.PostgresServiceConfig.COPY_ROW('1501.00001', 'a\tb\\n\nc')
+    assert row == '1501.00001\ta\\tb\\\\n\\nc\n'
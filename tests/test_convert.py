@@ -0,0 +1,88 @@
+import gzip
+import json
+from pathlib import Path
+from typing import Dict
+
+import convert
+from benchmarks import synthetic
+
+
+YEARS = [2015, 2016, 2017]
+N_PAPERS_PER_YEAR = 60
+NEW_LINE_OF_2016 = '1601.99999;cs.LG;0;0;1501.00001;A.Smith;Graph kernels;0\n'
+
+
+def _convert(base_path: Path, monkeypatch, workers: int = 1) -> None:
+    # the converter works in ./data, like when run from the repository
+    monkeypatch.chdir(base_path)
+    convert.main.callback(
+        max_elements_per_file=25, max_n_files=None, workers=workers, codec='gzip'
+    )
+
+
+def _read_outputs(base_path: Path) -> Dict[str, bytes]:
+    output_path = base_path / 'data' / 'output_for'
+    return {
+        str(p.relative_to(output_path)): p.read_bytes()
+        for p in sorted(output_path.rglob('*'))
+        if p.is_file()
+    }
+
+
+def test_convert_with_workers_matches_sequential(tmp_path: Path, monkeypatch) -> None:
+    outputs = []
+    for workers in [1, 3]:
+        base_path = tmp_path / f'workers_{workers}'
+        synthetic.write_input(base_path / 'data' / 'input', YEARS, N_PAPERS_PER_YEAR)
+        _convert(base_path, monkeypatch, workers)
+        outputs.append(_read_outputs(base_path))
+
+    assert outputs[0] == outputs[1]
+    # the workers' manifests were merged, so all years are known as converted
+    for folder_name in ['blast', 'postgres', 'redis']:
+        manifest = json.loads(outputs[1][f'{folder_name}/manifest/manifest.json'])
+        assert sorted(manifest) == [str(year) for year in YEARS]
+    assert 'postgres/papers.tsv.gz' in outputs[1]
+
+
+def _modification_times(base_path: Path, year: int) -> Dict[str, int]:
+    output_path = base_path / 'data' / 'output_for'
+    return {
+        str(p.relative_to(output_path)): p.stat().st_mtime_ns
+        for p in output_path.glob(f'*/{year}_*')
+    }
+
+
+def test_convert_reconverts_only_changed_years(tmp_path: Path, monkeypatch) -> None:
+    base_path = tmp_path / 'incremental'
+    input_file_paths = synthetic.write_input(
+        base_path / 'data' / 'input', YEARS, N_PAPERS_PER_YEAR
+    )
+    _convert(base_path, monkeypatch)
+    first_outputs = _read_outputs(base_path)
+    modification_times = {year: _modification_times(base_path, year) for year in YEARS}
+
+    _convert(base_path, monkeypatch)
+    assert _read_outputs(base_path) == first_outputs
+    for year in YEARS:
+        assert _modification_times(base_path, year) == modification_times[year]
+
+    with open(str(input_file_paths[1]), 'a') as input_file:
+        input_file.write(NEW_LINE_OF_2016)
+    _convert(base_path, monkeypatch)
+    for year in [2015, 2017]:
+        assert _modification_times(base_path, year) == modification_times[year]
+    assert _modification_times(base_path, 2016) != modification_times[2016]
+
+    # the same as converting everything from scratch, papers.tsv included
+    fresh_path = tmp_path / 'fresh'
+    synthetic.write_input(fresh_path / 'data' / 'input', YEARS, N_PAPERS_PER_YEAR)
+    with open(str(fresh_path / 'data' / 'input' / 'pscp-2016.csv'), 'a') as input_file:
+        input_file.write(NEW_LINE_OF_2016)
+    _convert(fresh_path, monkeypatch)
+    outputs = _read_outputs(base_path)
+    assert outputs == _read_outputs(fresh_path)
+    assert outputs != first_outputs
+    papers = gzip.decompress(outputs['postgres/papers.tsv.gz']).decode().split()
+    assert papers == sorted(set(papers))
+    assert '1601_99999' in papers
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import hypothesis as hy
+import hypothesis.strategies as st
+import numpy as np
+
+import graph
+
+
+edge_lists = st.lists(
+    st.tuples(st.integers(min_value=0, max_value=9), st.integers(0, 9)), unique=True
+)
+
+
+def _build(path: Path, edges) -> graph.CitationGraph:
+    ids = np.array([f'p{i}' for i in range(10)], dtype='S')
+    referencers = np.array([r for r, _ in edges], dtype=np.int64)
+    referencees = np.array([r for _, r in edges], dtype=np.int64)
+    graph.build(path, ids, referencers, referencees)
+    return graph.CitationGraph(path)
+
+
+@hy.given(edge_lists)
+@hy.settings(deadline=None)
+def test_citation_graph_neighbors(tmp_path_factory, edges) -> None:
+    g = _build(tmp_path_factory.mktemp('graph'), edges)
+    for i in range(10):
+        expected_out = sorted(f'p{e}' for r, e in edges if r == i)
+        expected_in = sorted(f'p{r}' for r, e in edges if e == i)
+        assert g.references(f'p{i}') == expected_out
+        assert g.referenced_by(f'p{i}') == expected_in
+
+
+def test_citation_graph_pagination(tmp_path: Path) -> None:
+    g = _build(tmp_path, [(0, 1), (0, 3), (0, 5), (0, 7)])
+    assert g.references('p0', limit=2) == ['p1', 'p3']
+    assert g.references('p0', after='p3', limit=2) == ['p5', 'p7']
+    assert g.references('p0', after='p4') == ['p5', 'p7']
+    assert g.referenced_by('p5') == ['p0']
+    assert g.references('unknown') == []
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import hypothesis as hy
+import hypothesis.strategies as st
+
+import idstore
+
+
+@hy.given(
+    st.lists(st.text(st.characters(whitelist_categories=['L', 'N']))),
+    st.integers(min_value=1, max_value=10),
+)
+@hy.settings(deadline=None)
+def test_id_store(tmp_path_factory, ids, max_size) -> None:
+    folder = tmp_path_factory.mktemp('ids')
+    store = idstore.IdStore(folder, max_size)
+    store.update(ids)
+    assert list(store) == sorted(set(ids))
+
+    store.clear()
+    assert list(store) == []
+    assert list(folder.iterdir()) == []
+
+
+def test_id_store_spills(tmp_path: Path) -> None:
+    store = idstore.IdStore(tmp_path, 2)
+    store.update(['c', 'a', 'b', 'a', 'c'])
+    assert store.n_runs == 2
+
+    store.write(tmp_path / 'ids.txt')
+    assert (tmp_path / 'ids.txt').read_text() == 'a\nb\nc\n'
@@ -0,0 +1,58 @@
+import hypothesis as hy
+import hypothesis.strategies as st
+import numpy as np
+
+import importance
+
+
+edges = st.integers(min_value=1, max_value=12).flatmap(
+    lambda n: st.tuples(
+        st.just(n),
+        st.lists(
+            st.tuples(
+                st.integers(min_value=0, max_value=n - 1),
+                st.integers(min_value=0, max_value=n - 1),
+            ),
+            max_size=40,
+        ),
+    )
+)
+
+
+@hy.given(edges, st.floats(min_value=0.5, max_value=0.95))
+def test_compute_matches_dense_pagerank(n_and_edges, damping) -> None:
+    n_papers, edge_list = n_and_edges
+    referencers = np.array([e[0] for e in edge_list], dtype=int)
+    referencees = np.array([e[1] for e in edge_list], dtype=int)
+    citation_metrics = importance.compute(
+        n_papers, referencers, referencees, damping, 1e-12, 1000
+    )
+
+    transitions = np.zeros((n_papers, n_papers))
+    for referencer, referencee in edge_list:
+        transitions[referencee, referencer] += 1
+    references_n = transitions.sum(axis=0)
+    transitions[:, references_n == 0] = 1
+    transitions /= transitions.sum(axis=0)
+    # the stationary distribution solves (I - d M) r = (1 - d) / n
+    expected = np.linalg.solve(
+        np.eye(n_papers) - damping * transitions,
+        np.full(n_papers, (1 - damping) / n_papers),
+    )
+
+    assert np.array_equal(citation_metrics.references_n, references_n)
+    assert np.array_equal(
+        citation_metrics.referenced_by_n, np.bincount(referencees, minlength=n_papers)
+    )
+    assert np.isclose(citation_metrics.pagerank.sum(), 1.0)
+    assert np.allclose(citation_metrics.pagerank, expected, atol=1e-9)
+
+
+def test_compute_ranks_cited_papers_higher() -> None:
+    citation_metrics = importance.compute(
+        4, np.array([1, 2, 3, 3]), np.array([0, 0, 0, 2]), 0.85, 1e-8, 100
+    )
+    assert list(np.argsort(-citation_metrics.pagerank))[:2] == [0, 2]
+    assert citation_metrics.n_iterations < 100
+    no_edges = np.array([], dtype=int)
+    assert importance.compute(0, no_edges, no_edges, 0.85, 1e-8, 100).pagerank.size == 0
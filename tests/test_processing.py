@@ -3,7 +3,7 @@ import re
 import hypothesis as hy
 import hypothesis.strategies as st
 
-from src import processing
+import processing
 
 
 alphanumeric_underscore_pattern = re.compile(r'[\w_]*')
@@ -41,7 +41,7 @@ same_len_lists = st.integers(min_value=1, max_value=100).flatmap(
 @hy.given(same_len_lists)
 def test_clean_authors(authors):
     first_names, last_names = authors
-    expected = ' '.join([processing.stemmer.stem(n) for n in last_names])
+    expected = ' '.join([processing.get_stemmer().stem(n) for n in last_names])
     names = ','.join(
         ['.'.join(fn) + '.' + ln for fn, ln in zip(first_names, last_names)]
     )
@@ -50,5 +50,37 @@ def test_clean_authors(authors):
     assert then == expected
 
 
+@hy.given(st.lists(st.text()))
+def test_clean_queries(strings):
+    assert processing.clean_queries(strings) == [
+        processing.clean_query(s) for s in strings
+    ]
+
+
+@hy.given(st.lists(st.text()), st.integers(min_value=0, max_value=5))
+def test_clean_titles(strings, min_title_word_length):
+    assert processing.clean_titles(strings, min_title_word_length) == [
+        processing.clean_title(s, min_title_word_length) for s in strings
+    ]
+
+
+def test_clean_typeahead_query() -> None:
+    assert processing.clean_typeahead_query('deep neur') == ('deep', 'neur')
+    assert processing.clean_typeahead_query('deep learning') == ('deep', 'learn')
+    assert processing.clean_typeahead_query('deep learning ') == ('deep learn', '')
+    assert processing.clean_typeahead_query('') == ('', '')
+
+
+def test_clean_typeahead_query_drops_stop_words() -> None:
+    assert processing.clean_typeahead_query('learning for gra') == ('learn', 'gra')
+    assert processing.clean_typeahead_query('learning for graphs ') == (
+        'learn graph',
+        '',
+    )
+    assert processing.clean_typeahead_query('a graph ') == ('graph', '')
+    assert processing.clean_typeahead_query('the deep') == ('', 'deep')
+    assert processing.clean_typeahead_query('the ') == ('', '')
+
+
 if __name__ == '__main__':
     test_clean_authors(([['A']], ['ª']))
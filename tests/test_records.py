@@ -0,0 +1,45 @@
+import io
+
+import hypothesis as hy
+import hypothesis.strategies as st
+
+import records
+
+
+categories = st.lists(
+    st.sampled_from(['cs.LG', 'cs.AI', 'physics.optics', 'math.CO', 'hep-th', '']),
+    min_size=1,
+    max_size=3,
+).map(','.join)
+titles = st.lists(st.sampled_from(['graph', 'cs.', ',cs.LG', 'µ-nets']), max_size=3)
+lines = st.one_of(
+    st.tuples(st.sampled_from(['1501.00001', 'cs/0101001']), categories, titles).map(
+        lambda t: f'{t[0]};{t[1]};0;0;1501.00002;A.Smith;{" ".join(t[2])};0'
+    ),
+    st.just('# cs.LG;cs.LG;comment'),
+    st.just('1501.00003;cs.LG'),
+    st.just(''),
+)
+prefixes = st.lists(st.sampled_from(['cs.', 'math.', 'physics.', '']), min_size=1)
+
+
+def _read_lines(text: str, category_prefixes, n_max_splits):
+    # the straightforward version the reader has to agree with
+    result = []
+    for line in text.split('\n'):
+        fields = line.split(';', n_max_splits)
+        if line.startswith('#') or len(fields) < 3:
+            continue
+        if any([c.startswith(tuple(category_prefixes)) for c in fields[1].split(',')]):
+            result.append(fields)
+    return result
+
+
+@hy.given(
+    st.lists(lines), prefixes, st.booleans(), st.integers(min_value=1, max_value=64),
+)
+def test_read_records(line_list, category_prefixes, has_final_newline, chunk_size):
+    text = '\n'.join(line_list) + ('\n' if has_final_newline else '')
+    input_file = io.BytesIO(text.encode())
+    result = list(records.read_records(input_file, category_prefixes, 7, chunk_size))
+    assert result == _read_lines(text, category_prefixes, 7)
@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import hypothesis as hy
+import hypothesis.strategies as st
+
+import processing
+import search
+
+
+words = st.sampled_from(['graph', 'learn', 'neural', 'optim', 'smith', '2019'])
+documents = st.lists(
+    st.fixed_dictionaries(
+        dict(
+            year=st.sampled_from(['2018', '2019']),
+            authors=words.map(str.capitalize),
+            title=st.lists(words, max_size=4).map(' '.join),
+        )
+    ),
+    max_size=20,
+)
+
+
+@hy.given(
+    documents,
+    st.lists(words, max_size=3),
+    st.one_of(st.just(''), words.map(lambda w: w[:2]), words),
+)
+@hy.settings(deadline=None)
+def test_search_index_matches_all_terms(
+    tmp_path_factory, fields_list, terms, prefix
+) -> None:
+    path = tmp_path_factory.mktemp('search')
+    search.build(path, [(f'p{i}', f) for i, f in enumerate(fields_list)])
+    index = search.SearchIndex(path)
+
+    expected = set()
+    for i, fields in enumerate(fields_list):
+        document_terms = {t.lower() for t in search.document_terms(fields)}
+        if set(terms) <= document_terms and (
+            prefix == '' or any([t.startswith(prefix) for t in document_terms])
+        ):
+            expected.add(f'p{i}')
+    if len(terms) == 0 and prefix == '':
+        expected = set()
+    ids, n_hits = index.search(terms, len(fields_list) + 1, prefix)
+    assert len(index) == len(fields_list)
+    assert n_hits == len(expected)
+    assert set(ids) == expected
+    assert len(index.search(terms, 2, prefix)[0]) == min(2, len(expected))
+
+
+def test_search_index_ranking(tmp_path: Path) -> None:
+    search.build(
+        tmp_path,
+        [
+            ('a', dict(year='2019', authors='smith', title='graph learn optim')),
+            ('b', dict(year='2019', authors='smith', title='graph graph')),
+            ('c', dict(year='2018', authors='jones', title='neural')),
+        ],
+    )
+    index = search.SearchIndex(tmp_path)
+    assert index.search(['graph'], 10) == (['b', 'a'], 2)
+    assert index.search(['graph', 'neural'], 10) == ([], 0)
+    assert index.search(['unknown'], 10) == ([], 0)
+
+
+def test_search_index_prefix_ranking(tmp_path: Path) -> None:
+    search.build(
+        tmp_path,
+        [
+            ('a', dict(year='2019', authors='smith', title='neuron')),
+            ('b', dict(year='2019', authors='smith', title='neural')),
+            ('c', dict(year='2019', authors='smith', title='neuron')),
+            ('d', dict(year='2019', authors='smith', title='graph')),
+        ],
+        dict(c=10),
+    )
+    index = search.SearchIndex(tmp_path)
+    assert index.search([], 10, 'neur') == (['c', 'b', 'a'], 3)
+    assert index.search([], 10, 'neural') == (['b'], 1)
+    assert index.search(['smith'], 2, 'neuron') == (['c', 'a'], 2)
+
+
+def test_search_index_finds_typeahead_queries(tmp_path: Path) -> None:
+    # stop words and short words are not in the titles, so cannot be required
+    title = processing.clean_title('Deep learning for graphs')
+    search.build(tmp_path, [('a', dict(year='2019', authors='smith', title=title))])
+    index = search.SearchIndex(tmp_path)
+    for query in ['learning for graphs ', 'a graph ', 'the deep', 'learning for gra']:
+        terms, prefix = processing.clean_typeahead_query(query)
+        assert index.search(terms.split(), 10, prefix) == (['a'], 1)
@@ -0,0 +1,337 @@
+import collections
+import csv
+import io
+import json
+import sqlite3
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import hypothesis as hy
+import hypothesis.strategies as st
+import pytest
+import requests
+
+import compression
+import config
+import watch
+
+
+json_values = st.recursive(
+    st.none()
+    | st.booleans()
+    | st.integers()
+    | st.floats(allow_nan=False, allow_infinity=False)
+    | st.text(),
+    lambda children: st.lists(children, max_size=3)
+    | st.dictionaries(st.text(), children, max_size=3),
+    max_leaves=10,
+)
+# numbers and literals that a chunk boundary can cut, arrays inside the array
+ARRAY = (
+    '[{"id": "a", "n": [1, 2]}, [3, [4]], 12, 345, -6.5e2, "x, ]", true, null,'
+    + ' {"b": "}"}]'
+)
+
+
+def _iter_json_array(text: str, chunk_size: int) -> List:
+    return list(watch.iter_json_array(io.StringIO(text), chunk_size))
+
+
+def test_iter_json_array_at_every_chunk_size() -> None:
+    for chunk_size in range(1, len(ARRAY) + 1):
+        assert _iter_json_array(ARRAY, chunk_size) == json.loads(ARRAY), chunk_size
+    assert _iter_json_array('[12, 345]', 1) == [12, 345]
+    assert _iter_json_array('[\n]', 1) == []
+
+
+@hy.given(st.lists(json_values), st.integers(min_value=1, max_value=64))
+def test_iter_json_array(elements, chunk_size) -> None:
+    assert _iter_json_array(json.dumps(elements), chunk_size) == elements
+
+
+def test_iter_json_array_raises_on_a_truncated_file() -> None:
+    with pytest.raises(json.JSONDecodeError):
+        _iter_json_array('[{"id": "a"}, {"id": ', 4)
+
+
+class FakeResponse(NamedTuple):
+    status_code: int
+    content: bytes = b''
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+
+class FakeBlastSession:
+    # answers every post with the next status or raises the next error
+    def __init__(self, answer: Callable[[bytes], Union[int, Exception]]):
+        self._answer = answer
+        self.bodies = []  # type: List[bytes]
+        self.timeouts = []  # type: List[float]
+
+    def post(self, url: str, data, timeout: float) -> FakeResponse:
+        body = data if isinstance(data, bytes) else data.read()
+        self.bodies.append(body)
+        self.timeouts.append(timeout)
+        answer = self._answer(body)
+        if isinstance(answer, Exception):
+            raise answer
+        return FakeResponse(answer)
+
+
+class FakeRedis:
+    # keeps the hashes and the size of every pipeline execution of the loaders
+    def __init__(self):
+        self.hashes = collections.defaultdict(dict)  # type: Dict[str, Dict]
+        self.executions = []  # type: List[int]
+        self.version = 0
+
+    def pipeline(self, transaction: bool = True) -> 'FakeRedisPipeline':
+        return FakeRedisPipeline(self)
+
+    def incr(self, key: str) -> int:
+        assert key == config.RedisServiceConfig.DATASET_VERSION_KEY
+        self.version += 1
+        return self.version
+
+
+class FakeRedisPipeline:
+    def __init__(self, redis_connection: FakeRedis):
+        self._redis_connection = redis_connection
+        self._commands = []
+
+    def hset(
+        self,
+        name: str,
+        key: Optional[str] = None,
+        value: object = None,
+        mapping: Optional[Dict] = None,
+    ) -> None:
+        mapping = dict(mapping or dict())
+        if key is not None:
+            mapping[key] = value
+        self._commands.append((name, mapping))
+
+    def execute(self) -> List[int]:
+        commands, self._commands = self._commands, []
+        for name, mapping in commands:
+            self._redis_connection.hashes[name].update(mapping)
+        self._redis_connection.executions.append(len(commands))
+        return [len(mapping) for _, mapping in commands]
+
+
+def _answers(*answers: Union[int, Exception]) -> Callable[[bytes], object]:
+    remaining = list(answers)
+    return lambda body: remaining.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    sleeps = []
+    monkeypatch.setattr(watch.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def _setup_blast(
+    tmp_path: Path,
+    monkeypatch,
+    session: FakeBlastSession,
+    max_entries_per_request: int = None,
+) -> watch.SetupBlast:
+    # the converted files are read from ./data, the service is never waited for
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(watch.Setup, '_wait_until_open', lambda self: None)
+    monkeypatch.setattr(config.BlastServiceConfig, 'create_session', lambda: session)
+    redis_connection = FakeRedis()
+    monkeypatch.setattr(
+        config.RedisServiceConfig, 'create_connection', lambda: redis_connection
+    )
+    return watch.SetupBlast(1, max_entries_per_request, 5.0, 2)
+
+
+def _write_blast_file(tmp_path: Path, name: str, paper_ids: List[str]) -> None:
+    blast_path = tmp_path / 'data' / 'output_for' / 'blast'
+    blast_path.mkdir(parents=True, exist_ok=True)
+    entries = [dict(type='PUT', document=dict(id=i, fields={})) for i in paper_ids]
+    (blast_path / name).write_text(json.dumps(entries))
+
+
+def test_post_retries_server_errors_and_timeouts(
+    tmp_path: Path, monkeypatch, sleeps
+) -> None:
+    session = FakeBlastSession(_answers(503, requests.Timeout('slow'), 200))
+    setup = _setup_blast(tmp_path, monkeypatch, session)
+    assert setup._post('a.json', lambda: b'[]')
+    assert session.bodies == [b'[]'] * 3
+    assert session.timeouts == [5.0] * 3
+    backoff = config.BlastServiceConfig.BULK_BACKOFF
+    assert sleeps == [backoff, 2 * backoff]
+
+
+def test_post_gives_up(tmp_path: Path, monkeypatch, sleeps) -> None:
+    session = FakeBlastSession(_answers(500, requests.ConnectionError(), 502))
+    setup = _setup_blast(tmp_path, monkeypatch, session)
+    assert not setup._post('a.json', lambda: b'[]')
+    assert len(session.bodies) == 3
+
+    # a client error is not retried
+    session = FakeBlastSession(_answers(400))
+    setup = _setup_blast(tmp_path, monkeypatch, session)
+    assert not setup._post('a.json', lambda: b'[]')
+    assert len(session.bodies) == 1
+
+
+def test_run_reports_every_file(tmp_path: Path, monkeypatch, sleeps) -> None:
+    _write_blast_file(tmp_path, '2019_0.json', ['a', 'b', 'c'])
+    _write_blast_file(tmp_path, '2018_0.json', ['d'])
+    session = FakeBlastSession(lambda body: 200)
+    setup = _setup_blast(tmp_path, monkeypatch, session, max_entries_per_request=2)
+    setup.run()
+    batches = [[e['document']['id'] for e in json.loads(b)] for b in session.bodies]
+    assert batches == [['a', 'b'], ['c'], ['d']]
+    # the autocomplete caches of the API are invalidated once everything is in
+    assert setup._redis_connection.version == 1
+
+
+def test_run_exits_non_zero_when_a_file_fails(
+    tmp_path: Path, monkeypatch, sleeps
+) -> None:
+    _write_blast_file(tmp_path, '2019_0.json', ['a', 'b', 'c'])
+    _write_blast_file(tmp_path, '2018_0.json', ['d'])
+    session = FakeBlastSession(lambda body: 500 if b'"c"' in body else 200)
+    setup = _setup_blast(tmp_path, monkeypatch, session, max_entries_per_request=2)
+    with pytest.raises(SystemExit) as exit_info:
+        setup.run()
+    assert exit_info.value.code != 0
+    assert setup._reports == {
+        '2019_0.json': watch.BulkReport(2, 1, 3),
+        '2018_0.json': watch.BulkReport(1, 0, 1),
+    }
+    assert setup._redis_connection.version == 0
+
+    # a whole file is posted as it is
+    session = FakeBlastSession(lambda body: 500 if b'"d"' in body else 200)
+    setup = _setup_blast(tmp_path, monkeypatch, session)
+    with pytest.raises(SystemExit):
+        setup.run()
+    assert setup._reports['2018_0.json'] == watch.BulkReport(1, 1, None)
+    assert setup._reports['2019_0.json'] == watch.BulkReport(1, 0, None)
+
+
+def _write_redis_file(tmp_path: Path, name: str, paper_ids: List[str]) -> None:
+    redis_path = tmp_path / 'data' / 'output_for' / 'redis'
+    redis_path.mkdir(parents=True, exist_ok=True)
+    with compression.open_file(redis_path / name, 'w', newline='') as output_file:
+        csv.writer(output_file).writerows(
+            [(i, '2019', 'smith', f'title of {i}') for i in paper_ids]
+        )
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_setup_redis_loads_every_row_once(
+    tmp_path: Path, monkeypatch, workers: int
+) -> None:
+    paper_ids = [f'p{i}' for i in range(12)]
+    _write_redis_file(tmp_path, '2019_0.csv', paper_ids[:5])
+    _write_redis_file(tmp_path, '2019_1.csv.gz', paper_ids[5:9])
+    _write_redis_file(tmp_path, '2018_0.csv', paper_ids[9:])
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(watch.Setup, '_wait_until_open', lambda self: None)
+    redis_connection = FakeRedis()
+    monkeypatch.setattr(
+        config.RedisServiceConfig, 'create_connection', lambda: redis_connection
+    )
+
+    watch.SetupRedis(batch_size=2, workers=workers).run()
+    assert redis_connection.hashes == {
+        i: dict(year='2019', authors='smith', title=f'title of {i}') for i in paper_ids
+    }
+    # a batch is flushed whenever it is full and once more at the end of a file
+    assert sum(redis_connection.executions) == len(paper_ids)
+    assert sorted(redis_connection.executions) == [0, 1, 1, 2, 2, 2, 2, 2]
+    assert redis_connection.version == 1
+
+
+class FakePostgresConnection:
+    # runs the queries of count_referenced_by on the same tables in sqlite
+    def __init__(self, paper_ids: List[str], refs: List[Tuple[str, str]]):
+        self._connection = sqlite3.connect(':memory:')
+        self._connection.execute('CREATE TABLE papers (ID TEXT PRIMARY KEY)')
+        self._connection.execute('CREATE TABLE refs (referencer TEXT, referencee TEXT)')
+        self._connection.executemany(
+            'INSERT INTO papers VALUES (?)', [(i,) for i in paper_ids]
+        )
+        self._connection.executemany('INSERT INTO refs VALUES (?, ?)', refs)
+
+    def cursor(self, name: Optional[str] = None) -> 'FakePostgresCursor':
+        return FakePostgresCursor(self._connection.cursor())
+
+    def commit(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class FakePostgresCursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+        self.itersize = None
+
+    def execute(self, sql: str, parameters: Optional[Dict] = None) -> None:
+        if parameters is None:
+            self._cursor.execute(sql)
+        else:
+            paper_ids = parameters['paper_ids']
+            placeholders = ', '.join(['?'] * len(paper_ids))
+            sql = sql.replace('= ANY(%(paper_ids)s)', f'IN ({placeholders})')
+            self._cursor.execute(sql, paper_ids)
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        return iter(self._cursor.fetchall())
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+def _count_referenced_by(
+    monkeypatch, refs: List[Tuple[str, str]], ref_files: Tuple[str, ...] = ()
+) -> FakeRedis:
+    redis_connection = FakeRedis()
+    # counts left from a previous run, before p1 lost its only reference
+    for paper_id, n in [('p0', 1), ('p1', 1), ('p2', 7)]:
+        redis_connection.hashes[paper_id]['referenced_by_n'] = n
+    postgres_connection = FakePostgresConnection(['p0', 'p1', 'p2', 'p3'], refs)
+    monkeypatch.setattr(
+        config.RedisServiceConfig, 'create_connection', lambda: redis_connection
+    )
+    monkeypatch.setattr(
+        config.PostgresServiceConfig, 'create_connection', lambda: postgres_connection
+    )
+    watch.count_referenced_by.callback(ref_files=ref_files, batch_size=2)
+    return redis_connection
+
+
+def test_count_referenced_by_overwrites_every_count(monkeypatch) -> None:
+    redis_connection = _count_referenced_by(
+        monkeypatch, [('p1', 'p0'), ('p2', 'p0'), ('p3', 'p2')]
+    )
+    counts = {i: h['referenced_by_n'] for i, h in redis_connection.hashes.items()}
+    assert counts == dict(p0=2, p1=0, p2=1, p3=0)
+    assert redis_connection.version == 1
+
+
+def test_count_referenced_by_recounts_the_referencees_of_files(
+    tmp_path: Path, monkeypatch
+) -> None:
+    ref_file_path = tmp_path / '2019_0.tsv.gz'
+    with compression.open_file(ref_file_path, 'w') as ref_file:
+        ref_file.write('p3\tp0\np3\tp1\n')
+    redis_connection = _count_referenced_by(
+        monkeypatch, [('p1', 'p0'), ('p3', 'p0'), ('p3', 'p1')], (str(ref_file_path),)
+    )
+    counts = {i: h['referenced_by_n'] for i, h in redis_connection.hashes.items()}
+    # p2 is not referenced in the file, so it is left alone
+    assert counts == dict(p0=2, p1=1, p2=7)
+    assert redis_connection.version == 1